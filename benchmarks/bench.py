@@ -0,0 +1,319 @@
+import argparse
+import json
+import multiprocessing
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image
+
+from swing_tool_gui.autocrop import suggest_crop
+from swing_tool_gui.build import BuildTask, build_file
+from swing_tool_gui.imaging import open_proxy
+from swing_tool_gui.utils import (
+    crop_box_to_source_rect,
+    get_image_display_area,
+    is_image_file,
+)
+
+# name: (width, height, format)
+IMAGE_SETS = {
+    "small-jpeg": (1024, 768, "JPEG"),
+    "12mp-jpeg": (4000, 3000, "JPEG"),
+    "12mp-png": (4000, 3000, "PNG"),
+    "48mp-jpeg": (8000, 6000, "JPEG"),
+    "48mp-tiff": (8000, 6000, "TIFF"),
+}
+LARGE_IMAGE_SETS = {
+    "100mp-jpeg": (12000, 8400, "JPEG"),
+    "100mp-tiff": (12000, 8400, "TIFF"),
+}
+SUFFIXES = {"JPEG": ".jpg", "PNG": ".png", "TIFF": ".tif"}
+# size of the crop screen proxy
+PROXY_BOX = (1920, 1080)
+DEFAULT_THRESHOLD = 0.15
+
+
+class DisplayedImage:
+    """Stand-in for the Kivy image widget read by get_image_display_area."""
+
+    texture_size = (1920, 1280)
+    size = (1280, 720)
+    center_x = 640
+    center_y = 400
+
+
+def make_image(path, width, height, image_format):
+    """Writes a synthetic photo-like image: gradients with noise."""
+    red = Image.linear_gradient("L").resize((width, height))
+    green = red.transpose(Image.Transpose.ROTATE_90).resize((width, height))
+    blue = Image.effect_noise((width, height), 64)
+    Image.merge("RGB", (red, green, blue)).save(path, format=image_format)
+
+
+def make_image_sets(directory, image_sets, files_per_set):
+    """Writes the synthetic images, returns {set name: [paths]}."""
+    files = {}
+    for name, (width, height, image_format) in image_sets.items():
+        first = Path(directory) / f"{name}-0{SUFFIXES[image_format]}"
+        make_image(first, width, height, image_format)
+        files[name] = [str(first)]
+        for index in range(1, files_per_set):
+            copy = first.with_name(f"{name}-{index}{first.suffix}")
+            copy.write_bytes(first.read_bytes())
+            files[name].append(str(copy))
+    return files
+
+
+def peak_rss_mb():
+    """Returns the peak resident memory of this process in MB."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def measure(function, items):
+    """Calls function on every item, returns throughput and latencies."""
+    latencies = []
+    started = time.perf_counter()
+    for item in items:
+        item_started = time.perf_counter()
+        function(item)
+        latencies.append(time.perf_counter() - item_started)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "count": len(items),
+        "throughput": len(items) / elapsed,
+        "latency_ms": {
+            "mean": statistics.fmean(latencies) * 1000,
+            "p50": latencies[len(latencies) // 2] * 1000,
+            "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+            "max": latencies[-1] * 1000,
+        },
+    }
+
+
+def bench_import(files, output_dir):
+    return measure(is_image_file, files)
+
+
+def bench_proxy(files, output_dir):
+    return measure(lambda path: open_proxy(path, PROXY_BOX), files)
+
+
+def bench_autocrop(files, output_dir):
+    return measure(suggest_crop, files)
+
+
+def bench_build(files, output_dir):
+    tasks = [
+        BuildTask(
+            index=index, input_file=path, title="Benchmark", output_dir=output_dir
+        )
+        for index, path in enumerate(files)
+    ]
+
+    def build(task):
+        result = build_file(task)
+        if not result.ok:
+            raise RuntimeError(result.error)
+
+    return measure(build, tasks)
+
+
+def bench_display_area(files, output_dir):
+    widget = DisplayedImage()
+    return measure(lambda _: get_image_display_area(widget), range(100_000))
+
+
+def bench_crop_math(files, output_dir):
+    display_area = get_image_display_area(DisplayedImage())
+    source_size = (12000, 8400)
+    boxes = [(200 + index % 300, 100, 500, 500) for index in range(100_000)]
+    return measure(
+        lambda box: crop_box_to_source_rect(box, display_area, source_size), boxes
+    )
+
+
+# per image set benchmarks, and benchmarks run once
+FILE_BENCHMARKS = {
+    "import": bench_import,
+    "proxy": bench_proxy,
+    "autocrop": bench_autocrop,
+    "build": bench_build,
+}
+SINGLE_BENCHMARKS = {
+    "display-area": bench_display_area,
+    "crop-math": bench_crop_math,
+}
+
+
+def _run_in_child(function, args, queue):
+    """Runs a function in a child process and sends back its result."""
+    try:
+        result = function(*args)
+    except Exception as error:
+        queue.put({"error": f"{type(error).__name__}: {error}"})
+    else:
+        queue.put(result)
+
+
+def run_in_child(function, *args):
+    """
+    Run a function in a fresh process and return its result.
+
+    The peak RSS of a process is inherited through fork and exec, so the parent
+    process is kept small and every benchmark runs in its own process.
+    """
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_in_child, args=(function, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def run_case(benchmark, files, output_dir):
+    """Runs a benchmark and measures the peak RSS of its process."""
+    result = benchmark(files, output_dir)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_benchmarks(args):
+    """Runs the selected benchmarks, returns the report."""
+    image_sets = dict(IMAGE_SETS)
+    if args.large:
+        image_sets.update(LARGE_IMAGE_SETS)
+    selected = set(args.only or [*FILE_BENCHMARKS, *SINGLE_BENCHMARKS])
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="swing-bench-") as directory:
+        output_dir = Path(directory) / "output"
+        output_dir.mkdir()
+        files = run_in_child(make_image_sets, directory, image_sets, args.files)
+        if "error" in files:
+            raise RuntimeError(f"cannot write the images: {files['error']}")
+        for name, benchmark in SINGLE_BENCHMARKS.items():
+            if name in selected:
+                results[name] = run_in_child(run_case, benchmark, [], str(output_dir))
+                print(f"{name}: {_format_result(results[name])}", file=sys.stderr)
+        for name, benchmark in FILE_BENCHMARKS.items():
+            if name not in selected:
+                continue
+            for set_name, set_files in files.items():
+                case = f"{name}/{set_name}"
+                results[case] = run_in_child(
+                    run_case, benchmark, set_files, str(output_dir)
+                )
+                print(f"{case}: {_format_result(results[case])}", file=sys.stderr)
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "files_per_set": args.files,
+        },
+        "results": results,
+    }
+
+
+def _format_result(result):
+    """Formats a result for the console."""
+    if "error" in result:
+        return f"error {result['error']}"
+    rss = result["peak_rss_mb"]
+    return f"{result['throughput']:.1f}/s, p95 {result['latency_ms']['p95']:.2f}ms" + (
+        "" if rss is None else f", peak RSS {rss:.0f}MB"
+    )
+
+
+def compare(report, baseline, threshold):
+    """
+    Compare a report to a baseline.
+
+    Args:
+    report(dict): Current report
+    baseline(dict): Baseline report
+    threshold(float): Allowed relative slowdown, e.g. 0.15 for 15%
+
+    Return:
+    list: Description of each regression
+    """
+    regressions = []
+    for case, result in report["results"].items():
+        base = baseline["results"].get(case)
+        if not base or "error" in base or "error" in result:
+            continue
+        if result["throughput"] < base["throughput"] * (1 - threshold):
+            regressions.append(
+                f"{case}: throughput {result['throughput']:.1f}/s"
+                f" < baseline {base['throughput']:.1f}/s"
+            )
+        if result["latency_ms"]["p95"] > base["latency_ms"]["p95"] * (1 + threshold):
+            regressions.append(
+                f"{case}: p95 latency {result['latency_ms']['p95']:.2f}ms"
+                f" > baseline {base['latency_ms']['p95']:.2f}ms"
+            )
+        if (
+            result["peak_rss_mb"]
+            and base["peak_rss_mb"]
+            and result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + threshold)
+        ):
+            regressions.append(
+                f"{case}: peak RSS {result['peak_rss_mb']:.0f}MB"
+                f" > baseline {base['peak_rss_mb']:.0f}MB"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the import, crop and build hot paths."
+    )
+    parser.add_argument("-o", "--output", help="save the results to a JSON file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="allowed relative slowdown (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--files", type=int, default=5, help="files per image set (default: 5)"
+    )
+    parser.add_argument(
+        "--large", action="store_true", help="also benchmark 100MP images"
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        choices=[*FILE_BENCHMARKS, *SINGLE_BENCHMARKS],
+        help="benchmark to run, can be repeated",
+    )
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(report, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+import multiprocessing
+
+if __name__ == "__main__":
+    # before importing Kivy: the build workers are spawned, and a frozen app
+    # runs this script again in each of them, freeze_support() stops them here
+    multiprocessing.freeze_support()
+
+    from swing_tool_gui.app import main
+
+    main()
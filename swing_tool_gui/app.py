@@ -1,7 +1,22 @@
+import time
+
+# start of the time to first frame, taken before the heavy imports
+STARTED_AT = time.perf_counter()
+
+import multiprocessing
+import os
+
+# thumbnails are JPEG or PNG files SDL2 reads, keep Kivy from importing PIL
+# for its image loader at startup
+os.environ.setdefault("KIVY_IMAGE", "sdl2,tex,dds")
+
 from kivy.app import App
 from kivy.core.text import LabelBase
+from kivy.core.window import Window
+from kivy.logger import Logger
 from kivy.uix.screenmanager import ScreenManager
 
+from swing_tool_gui.debug import FrameMonitor, debug_enabled
 from swing_tool_gui.screens.image import (
     ImageCropScreen,
     ImageImportScreen,
@@ -9,18 +24,77 @@ from swing_tool_gui.screens.image import (
 )
 from swing_tool_gui.utils import find_system_font
 
+# quit once the first frame is drawn, to measure the startup time
+STARTUP_EXIT_ENV = "SWING_STARTUP_EXIT"
+
+
+class LazyScreenManager(ScreenManager):
+    """Screen manager creating each screen the first time it is used."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # name: factory of the screens not created yet
+        self.factories = {}
+
+    def register(self, name, factory):
+        """Registers the factory of a screen, called with the screen name."""
+        self.factories[name] = factory
+
+    def get_screen(self, name):
+        factory = self.factories.pop(name, None)
+        if factory is not None:
+            self.add_widget(factory(name=name))
+        return super().get_screen(name)
+
+    def has_screen(self, name):
+        return name in self.factories or super().has_screen(name)
+
 
 class SwingApp(App):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # times the frames and reports the stalls, with SWING_DEBUG set
+        self.frame_monitor = None
+
     def build(self):
         font_name = find_system_font()
         if font_name:
             LabelBase.register(name="Roboto", fn_regular=font_name)
-        self.sm = ScreenManager()
+        self.sm = LazyScreenManager()
         self.sm.add_widget(ImageImportScreen(name="image_import_screen"))
-        self.sm.add_widget(ImageProcessScreen(name="image_process_screen"))
-        self.sm.add_widget(ImageCropScreen(name="image_crop_screen"))
+        self.sm.register("image_process_screen", ImageProcessScreen)
+        self.sm.register("image_crop_screen", ImageCropScreen)
         return self.sm
 
+    def on_start(self):
+        Window.bind(on_flip=self._on_first_frame)
+        if debug_enabled():
+            self.frame_monitor = FrameMonitor()
+            self.frame_monitor.start()
 
-if __name__ == "__main__":
+    def on_stop(self):
+        if self.frame_monitor is not None:
+            self.frame_monitor.stop()
+        # keep the work on an opened or saved project when the app closes
+        if "image_process_screen" not in self.sm.factories:
+            self.sm.get_screen("image_process_screen").autosave_project()
+
+    def _on_first_frame(self, *args):
+        """Logs the time from launch to the first frame on screen."""
+        Window.unbind(on_flip=self._on_first_frame)
+        Logger.info(
+            f"Startup: first frame after {time.perf_counter() - STARTED_AT:.3f}s"
+        )
+        if os.environ.get(STARTUP_EXIT_ENV):
+            self.stop()
+
+
+def main():
+    """Runs the app, started by python -m swing_tool_gui."""
     SwingApp().run()
+
+
+if __name__ == "__main__":
+    # needed by the build process pool in the frozen app
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from swing_tool_gui.imaging import open_proxy
+
+# side of the box the analysed proxies fit in
+AUTOCROP_SIZE = 256
+AUTOCROP_WORKERS = 4
+# how much a crop is pulled towards the center, relative to its score
+CENTER_BIAS = 0.1
+
+
+def edge_energy(gray):
+    """
+    Score every pixel of an image by the strength of its edges.
+
+    Args:
+    gray(numpy.ndarray): 2D float array of the grayscale image
+
+    Return:
+    numpy.ndarray: 2D array of the same shape, the sum of the absolute
+                   horizontal and vertical gradients
+    """
+    import numpy as np
+
+    energy = np.zeros_like(gray)
+    energy[:, 1:] += np.abs(np.diff(gray, axis=1))
+    energy[1:, :] += np.abs(np.diff(gray, axis=0))
+    return energy
+
+
+def best_window(profile, window):
+    """
+    Find the window of a 1D profile with the highest score.
+
+    Every window position is scored at once from the cumulative sum, with a
+    slight preference for the center.
+
+    Args:
+    profile(numpy.ndarray): 1D scores along the long side of the image
+    window(int): Length of the window
+
+    Return:
+    int: Start of the best window
+    """
+    import numpy as np
+
+    positions = len(profile) - window + 1
+    if positions <= 1:
+        return 0
+    cumulative = np.concatenate(([0.0], np.cumsum(profile, dtype=np.float64)))
+    scores = cumulative[window:] - cumulative[:positions]
+    offsets = np.abs(np.arange(positions) - (positions - 1) / 2) / (positions - 1)
+    scores *= 1 - CENTER_BIAS * 2 * offsets
+    return int(np.argmax(scores))
+
+
+def suggest_crop(path, tracer=None):
+    """
+    Suggest the largest square crop of an image, placed on its busiest part.
+
+    Args:
+    path(str): Path to the image
+    tracer(Tracer): Tracer recording an "autocrop" span, optional
+
+    Return:
+    tuple: (left, top, right, bottom) in source pixels
+    """
+    if tracer is not None:
+        with tracer.span(path, "autocrop"):
+            return suggest_crop(path)
+
+    import numpy as np
+
+    proxy, (source_width, source_height) = open_proxy(
+        path, (AUTOCROP_SIZE, AUTOCROP_SIZE)
+    )
+    with proxy:
+        gray = np.asarray(proxy.convert("L"), dtype=np.float32)
+    energy = edge_energy(gray)
+    proxy_height, proxy_width = gray.shape
+    side = min(source_width, source_height)
+    if source_width >= source_height:
+        start = best_window(energy.sum(axis=0), proxy_height)
+        left = min(round(start * source_width / proxy_width), source_width - side)
+        return left, 0, left + side, side
+    start = best_window(energy.sum(axis=1), proxy_width)
+    top = min(round(start * source_height / proxy_height), source_height - side)
+    return 0, top, side, top + side
+
+
+def suggest_crops(paths, workers=AUTOCROP_WORKERS, tracer=None):
+    """
+    Suggest the crops of many images in a thread pool.
+
+    Args:
+    paths(list): Paths to the images
+    workers(int): Number of threads
+    tracer(Tracer): Tracer recording the "autocrop" spans, optional
+
+    Return:
+    dict: {path: crop}, without the images that could not be read
+    """
+    crops = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            path: executor.submit(suggest_crop, path, tracer) for path in set(paths)
+        }
+        for path, future in futures.items():
+            if future.exception() is None:
+                crops[path] = future.result()
+    return crops
+
+
+class AutoCropper:
+    """Suggests crops in the background, one request per image."""
+
+    def __init__(self, workers=AUTOCROP_WORKERS, tracer=None):
+        self.tracer = tracer
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="autocrop"
+        )
+
+    def request(self, path, callback):
+        """
+        Suggests the crop of an image in the background.
+
+        The callback is called from a worker thread with (path, crop), crop is
+        None if the image could not be read.
+        """
+        future = self._executor.submit(suggest_crop, path, self.tracer)
+        future.add_done_callback(
+            lambda future: callback(
+                path, None if future.exception() else future.result()
+            )
+        )
+
+    def shutdown(self):
+        """Stops the workers, dropping the pending requests."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
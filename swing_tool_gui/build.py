@@ -0,0 +1,724 @@
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field, replace
+from io import BytesIO
+from pathlib import Path
+from threading import Event, Lock, Semaphore, Thread
+
+from swing_tool_gui.derivatives import DerivativeSpec, make_derivatives
+from swing_tool_gui.encoders import DEFAULT_PROFILE, EncoderProfile, encode
+from swing_tool_gui.imaging import decode_region
+from swing_tool_gui.tracing import Tracer
+
+OUTPUT_SUFFIX = "_new"
+IG_OUTPUT_SUFFIX = "_new_ig"
+
+# variant name: (output name suffix, build the IG size)
+VARIANTS = {
+    "normal": (OUTPUT_SUFFIX, False),
+    "ig": (IG_OUTPUT_SUFFIX, True),
+}
+DEFAULT_VARIANTS = ("normal", "ig")
+# directory of the output directory holding the build traces
+STATE_DIR_NAME = ".swing_tool"
+# threads encoding and writing the outputs of a worker process
+ENCODER_THREADS = 2
+# seconds between two writes of the build cache by a long-running builder
+CACHE_SAVE_INTERVAL = 10.0
+# sides of the square images built once to find the output size of the
+# builder, the large one bigger than any output it makes
+PROBE_SIZES = (64, 4096)
+EXIF_ORIENTATION = 0x0112
+
+# longest side of the builder outputs, 0 if unknown, found once per process
+_output_side = None
+
+# SwingImageBuilder instance of the current worker process
+_builder = None
+# encoder thread pool of the current worker process
+_encoder_pool = None
+
+
+@dataclass
+class BuildTask:
+    """A single input file to build, with everything a worker needs."""
+
+    index: int
+    input_file: str
+    title: str
+    output_dir: str
+    crop: tuple[int, int, int, int] | None = None
+    variants: tuple[str, ...] = DEFAULT_VARIANTS
+    encoder: EncoderProfile = DEFAULT_PROFILE
+    # smaller copies saved next to the outputs of their variants
+    derivatives: tuple[DerivativeSpec, ...] = ()
+
+    def output_path(self, suffix, encoder=None):
+        """Returns the output path for the given name suffix and encoder."""
+        input_path = Path(self.input_file)
+        output_suffix = (encoder or self.encoder).output_suffix(input_path.suffix)
+        return Path(self.output_dir) / f"{input_path.stem}{suffix}{output_suffix}"
+
+    def variant_derivatives(self, variant):
+        """Returns the derivatives made for a variant."""
+        return [spec for spec in self.derivatives if spec.applies_to(variant)]
+
+    def variant_outputs(self, variant):
+        """
+        Get every output of a variant, the built image first.
+
+        Args:
+        variant(str): Variant of the task
+
+        Return:
+        list: (output path, settings) of each output, the settings being the
+              encoder and size giving the output its cache key
+        """
+        suffix = VARIANTS[variant][0]
+        outputs = [(self.output_path(suffix), self.encoder.to_dict())]
+        for spec in self.variant_derivatives(variant):
+            encoder = spec.encoder or self.encoder
+            outputs.append(
+                (
+                    self.output_path(spec.output_suffix(suffix), encoder),
+                    {**encoder.to_dict(), "max_size": spec.max_size},
+                )
+            )
+        return outputs
+
+    def output_paths(self):
+        """Returns the paths of every output of the task."""
+        return [
+            path
+            for variant in self.variants
+            for path, settings in self.variant_outputs(variant)
+        ]
+
+
+@dataclass
+class BuildResult:
+    """Outcome of building a single task."""
+
+    index: int
+    input_file: str
+    outputs: list[str] = field(default_factory=list)
+    error: str | None = None
+    error_detail: str | None = None
+    duration: float = 0.0
+    spans: list = field(default_factory=list)
+    cached: bool = False
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+@dataclass
+class BuildProgress:
+    """Snapshot of a running batch, sent after every finished file."""
+
+    done: int
+    total: int
+    succeeded: int
+    failed: int
+    elapsed: float
+    eta: float | None
+    last: BuildResult
+
+
+@dataclass
+class BuildSummary:
+    """Final report of a batch."""
+
+    results: list[BuildResult]
+    total: int
+    elapsed: float
+    cancelled: bool = False
+    trace_paths: tuple[str, str] | None = None
+    # output files, derivatives included, found up to date or built again
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+
+def default_workers():
+    """
+    Get the number of worker processes to use on this machine.
+
+    Args:
+    None
+
+    Return:
+    int: Number of CPUs available to this process
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, os.cpu_count() or 1)
+
+
+def state_dir(output_dir):
+    """
+    Get the directory holding the build state next to the outputs.
+
+    Args:
+    output_dir(str): Output directory of a batch
+
+    Return:
+    Path: Path to the state directory, created if needed
+    """
+    path = Path(output_dir) / STATE_DIR_NAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _process_pool(workers):
+    """
+    Make a pool of worker processes, spawned on every platform.
+
+    A forked worker would inherit the GL context and the threads of the app,
+    and deadlock on a lock one of them held at the fork. build_file() and its
+    tasks are picklable, so a spawned worker only imports this module.
+
+    Args:
+    workers(int): Number of worker processes
+
+    Return:
+    ProcessPoolExecutor: New pool
+    """
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def _get_builder():
+    """Returns the SwingImageBuilder of the current process, creating it once."""
+    global _builder
+    if _builder is None:
+        from swing_tool.modules.image import SwingImageBuilder
+
+        _builder = SwingImageBuilder()
+    return _builder
+
+
+def _get_output_side(builder):
+    """
+    Get the longest side of the images the builder makes, probing it once.
+
+    A small and a large synthetic image are built for every variant. If the
+    builder makes outputs of a fixed size, bigger than the small probe, it
+    never shows more source pixels along a side than its output has, so a
+    source whose short side covers this length loses nothing. A builder
+    keeping or scaling the input size gets the full resolution.
+
+    Args:
+    builder(SwingImageBuilder): Builder of the current process
+
+    Return:
+    int: Longest output side in pixels, 0 if the probe failed or the output
+         size depends on the input
+    """
+    global _output_side
+    if _output_side is None:
+        try:
+            _output_side = _probe_output_side(builder)
+        except Exception:
+            # decode at full resolution rather than risk a blurry output
+            _output_side = 0
+    return _output_side
+
+
+def _probe_output_side(builder):
+    """Builds the probes, returns the fixed output side or 0, see above."""
+    from PIL import Image
+
+    sizes = set()
+    for probe_size in PROBE_SIZES:
+        buffer = BytesIO()
+        Image.new("RGB", (probe_size, probe_size), "gray").save(buffer, format="PNG")
+        sizes.add(
+            tuple(
+                _built_size(builder, buffer.getvalue(), ig)
+                for suffix, ig in VARIANTS.values()
+            )
+        )
+    if len(sizes) > 1:
+        # the output size follows the input
+        return 0
+    side = max(max(size) for size in sizes.pop())
+    return side if side > min(PROBE_SIZES) else 0
+
+
+def _built_size(builder, data, ig):
+    """Returns the size of the image built from a probe."""
+    with builder.build(BytesIO(data), "Probe", ig) as image:
+        return image.size
+
+
+def _prepare_source(task: BuildTask, min_side, tracer: Tracer):
+    """
+    Decode and crop the source of a task once so every variant can share it.
+
+    The source is decoded at the smallest scale keeping min_side pixels on the
+    short side of the crop, and the crop is applied before decoding where the
+    format allows it. The prepared image is handed to the builder as an
+    uncompressed TIFF, which costs a memory copy to read back instead of a
+    full JPEG or PNG decode.
+
+    Args:
+    task(BuildTask): Task to prepare
+    min_side(int): Shortest short side the builder needs, 0 for full size
+    tracer(Tracer): Tracer recording the stages
+
+    Return:
+    bytes | str: Data or path to pass to the builder
+    """
+    from PIL import Image
+
+    source = Image.open(task.input_file)
+    with source:
+        reducible = min_side and 2 * min_side <= min(source.size)
+        if task.crop is None and len(task.variants) < 2 and not reducible:
+            return task.input_file
+        with tracer.span(task.input_file, "decode") as span:
+            img = decode_region(source, task.crop, min_side or None)
+            span.bytes = os.path.getsize(task.input_file)
+        with img, tracer.span(task.input_file, "prepare") as span:
+            buffer = BytesIO()
+            params = {"compression": "raw"}
+            if source.info.get("icc_profile"):
+                params["icc_profile"] = source.info["icc_profile"]
+            exif = source.getexif()
+            if source.format == "TIFF":
+                # the EXIF of a TIFF file is its own directory, with the strip
+                # layout of the source, so keep only the orientation
+                orientation = exif.get(EXIF_ORIENTATION)
+                exif = Image.Exif()
+                if orientation:
+                    exif[EXIF_ORIENTATION] = orientation
+            # a crop is made on the stored pixels, so drop the EXIF orientation
+            # like the cropped PNG data used to
+            if exif and task.crop is None:
+                params["exif"] = exif
+            img.save(buffer, format="TIFF", **params)
+            span.bytes = buffer.tell()
+    return buffer.getvalue()
+
+
+def _get_encoder_pool():
+    """Returns the encoder thread pool of this worker process."""
+    global _encoder_pool
+    if _encoder_pool is None:
+        _encoder_pool = ThreadPoolExecutor(
+            max_workers=ENCODER_THREADS, thread_name_prefix="encoder"
+        )
+    return _encoder_pool
+
+
+def _save_output(
+    task: BuildTask, image, output_path: Path, tracer: Tracer, encoder=None
+):
+    """Encodes and writes an output, runs on the encoder thread pool."""
+    try:
+        with tracer.span(task.input_file, "encode") as span:
+            data = encode(image, output_path.suffix, encoder or task.encoder)
+            span.bytes = len(data)
+    finally:
+        image.close()
+    with tracer.span(task.input_file, "write") as span:
+        output_path.write_bytes(data)
+        span.bytes = len(data)
+    return str(output_path)
+
+
+def build_file(task: BuildTask):
+    """
+    Build and save the selected variants for a single task.
+
+    Runs inside a worker process, so every error is caught and returned. The
+    spans of every stage are returned with the result.
+
+    Args:
+    task(BuildTask): Task to build
+
+    Return:
+    BuildResult: Result of the build
+    """
+    started = time.perf_counter()
+    result = BuildResult(index=task.index, input_file=task.input_file)
+    tracer = Tracer()
+    try:
+        builder = _get_builder()
+        encoder_pool = _get_encoder_pool()
+        source = _prepare_source(task, _get_output_side(builder), tracer)
+        saves = []
+        try:
+            # the next variant is built while the previous one is encoded
+            for variant in task.variants:
+                suffix, ig = VARIANTS[variant]
+                with tracer.span(task.input_file, "build"):
+                    image = builder.build(
+                        BytesIO(source) if isinstance(source, bytes) else source,
+                        task.title,
+                        ig,
+                    )
+                derivatives = []
+                specs = task.variant_derivatives(variant)
+                if specs:
+                    try:
+                        with tracer.span(task.input_file, "derive"):
+                            derivatives = make_derivatives(image, specs)
+                    except Exception:
+                        image.close()
+                        raise
+                # the derivatives are made before the image is handed over, the
+                # encoder thread closes it
+                saves.append(
+                    encoder_pool.submit(
+                        _save_output, task, image, task.output_path(suffix), tracer
+                    )
+                )
+                for spec, derivative in derivatives:
+                    encoder = spec.encoder or task.encoder
+                    output_path = task.output_path(spec.output_suffix(suffix), encoder)
+                    saves.append(
+                        encoder_pool.submit(
+                            _save_output, task, derivative, output_path, tracer, encoder
+                        )
+                    )
+        finally:
+            # wait for every save, even after a failed build, so that no
+            # thread still writes once the result is returned
+            for save in saves:
+                try:
+                    result.outputs.append(save.result())
+                except Exception as error:
+                    if result.error is None:
+                        result.error = f"{type(error).__name__}: {error}"
+                        result.error_detail = traceback.format_exc()
+    except Exception as error:
+        result.error = f"{type(error).__name__}: {error}"
+        result.error_detail = traceback.format_exc()
+    result.duration = time.perf_counter() - started
+    result.spans = tracer.spans
+    return result
+
+
+class BatchBuilder:
+    """
+    Builds a batch of tasks in a process pool without blocking the caller.
+
+    Callbacks are invoked from a background thread, callers running a UI
+    must hand them over to their main loop. With a build cache, outputs that
+    are up to date are skipped unless force is set, and the built outputs are
+    recorded in the cache.
+    """
+
+    def __init__(
+        self,
+        tasks,
+        workers=None,
+        on_progress=None,
+        on_finish=None,
+        tracer=None,
+        cache=None,
+        force=False,
+    ):
+        self.tasks = list(tasks)
+        self.workers = workers or default_workers()
+        self.tracer = tracer or Tracer()
+        self.cache = cache
+        self.force = force
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.on_progress = on_progress
+        self.on_finish = on_finish
+        self.summary = None
+        self._cancel_event = Event()
+        self._executor = None
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def start(self):
+        """Starts building in the background."""
+        self._thread = Thread(target=self._run, name="batch-builder", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """Cancels the files not started yet, running files are finished."""
+        self._cancel_event.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def wait(self):
+        """Waits for the batch to finish and returns its summary."""
+        if self._thread is not None:
+            self._thread.join()
+        return self.summary
+
+    def _run(self):
+        """Submits all tasks and collects the results as they finish."""
+        started = time.perf_counter()
+        results = []
+        # output path: cache key, of the outputs being built
+        output_keys = {}
+        total = len(self.tasks)
+        workers = max(1, min(self.workers, total))
+        with _process_pool(workers) as executor:
+            self._executor = executor
+            futures = {}
+            for task in self.tasks:
+                if self.cancelled:
+                    break
+                task = self._check_cache(task, output_keys)
+                if isinstance(task, BuildResult):
+                    results.append(task)
+                    self._report_progress(results, total, started)
+                    continue
+                try:
+                    futures[executor.submit(build_file, task)] = task
+                except RuntimeError:
+                    # the pool has been shut down by cancel()
+                    break
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                result = self._get_result(future, futures[future])
+                self.tracer.extend(result.spans)
+                self._record_outputs(result, output_keys)
+                results.append(result)
+                self._report_progress(results, total, started)
+        self._executor = None
+        self._save_cache()
+        self.summary = BuildSummary(
+            results=sorted(results, key=lambda result: result.index),
+            total=total,
+            elapsed=time.perf_counter() - started,
+            cancelled=self.cancelled,
+            cache_hits=self.cache_hits,
+            cache_misses=self.cache_misses,
+        )
+        if self.on_finish:
+            self.on_finish(self.summary)
+
+    def _check_cache(self, task, output_keys):
+        """
+        Checks the outputs of a task against the build cache.
+
+        Returns the task restricted to its outdated variants, or a cached
+        result if every output is up to date.
+        """
+        if self.cache is None:
+            return task
+        try:
+            content_hash = self.cache.content_hash(task.input_file)
+        except OSError:
+            # let the worker report the missing or unreadable file
+            return task
+        outdated = []
+        for variant in task.variants:
+            # the derivatives come from the built image, an outdated one means
+            # building the variant again
+            keys = {
+                str(output_path): self.cache.output_key(
+                    task, variant, content_hash, settings=settings
+                )
+                for output_path, settings in task.variant_outputs(variant)
+            }
+            if not self.force and all(
+                self.cache.is_fresh(output_path, key)
+                for output_path, key in keys.items()
+            ):
+                self.cache_hits += len(keys)
+                continue
+            self.cache_misses += len(keys)
+            output_keys.update(keys)
+            outdated.append(variant)
+        if not outdated:
+            return BuildResult(
+                index=task.index,
+                input_file=task.input_file,
+                outputs=[str(path) for path in task.output_paths()],
+                cached=True,
+            )
+        return replace(task, variants=tuple(outdated))
+
+    def _record_outputs(self, result, output_keys):
+        """Records the outputs of a successful build in the cache."""
+        if self.cache is None or not result.ok:
+            return
+        for output_path in result.outputs:
+            if output_path in output_keys:
+                self.cache.record(output_path, output_keys.pop(output_path))
+
+    def _save_cache(self):
+        """Writes the cache, a failure only costs rebuilding next time."""
+        if self.cache is None:
+            return
+        try:
+            self.cache.save()
+        except OSError:
+            pass
+
+    @staticmethod
+    def _get_result(future, task):
+        """Returns the result of a future, turning a crashed worker into an error."""
+        try:
+            return future.result()
+        except Exception as error:
+            return BuildResult(
+                index=task.index,
+                input_file=task.input_file,
+                error=f"{type(error).__name__}: {error}",
+            )
+
+    def _report_progress(self, results, total, started):
+        """Sends the current progress to the progress callback."""
+        if not self.on_progress:
+            return
+        done = len(results)
+        failed = sum(1 for result in results if not result.ok)
+        elapsed = time.perf_counter() - started
+        eta = elapsed / done * (total - done) if done else None
+        self.on_progress(
+            BuildProgress(
+                done=done,
+                total=total,
+                succeeded=done - failed,
+                failed=failed,
+                elapsed=elapsed,
+                eta=eta,
+                last=results[-1],
+            )
+        )
+
+
+class StreamBuilder(BatchBuilder):
+    """
+    Builds tasks as they are submitted, for long-running watch folders.
+
+    At most max_pending tasks are queued or running at once, submit() blocks
+    while the pool is full so that a fast producer waits for the workers.
+    on_result is called from a background thread after every file. The spans
+    of the workers are not kept, they would grow without bound. A pool broken
+    by a crashed worker is replaced, and the build cache is written at most
+    every CACHE_SAVE_INTERVAL seconds and when the builder closes.
+    """
+
+    def __init__(
+        self,
+        workers=None,
+        max_pending=None,
+        on_result=None,
+        cache=None,
+        force=False,
+    ):
+        super().__init__([], workers=workers, cache=cache, force=force)
+        self.max_pending = max_pending or 2 * self.workers
+        self.on_result = on_result
+        self._slots = Semaphore(self.max_pending)
+        # output path: cache key, of the outputs being built
+        self._output_keys = {}
+        self._cache_lock = Lock()
+        self._last_cache_save = time.monotonic()
+
+    @property
+    def running(self):
+        return self._executor is not None
+
+    def start(self):
+        """Starts the worker processes."""
+        self._executor = _process_pool(self.workers)
+
+    def submit(self, task: BuildTask, timeout=None):
+        """
+        Queue a task, waiting for a free slot while the pool is full.
+
+        Args:
+        task(BuildTask): Task to build
+        timeout(float): Longest wait for a slot in seconds, None to wait forever
+
+        Return:
+        bool: Whether the task was queued
+        """
+        if self.cancelled or not self._slots.acquire(timeout=timeout):
+            return False
+        with self._cache_lock:
+            checked = self._check_cache(task, self._output_keys)
+        if isinstance(checked, BuildResult):
+            self._slots.release()
+            self._report_result(checked)
+            return True
+        try:
+            future = self._submit_to_pool(checked)
+        except RuntimeError as error:
+            self._slots.release()
+            if self.cancelled:
+                # the pool has been shut down by cancel()
+                return False
+            self._report_result(
+                BuildResult(
+                    index=checked.index,
+                    input_file=checked.input_file,
+                    error=f"{type(error).__name__}: {error}",
+                )
+            )
+            return True
+        future.add_done_callback(lambda future: self._on_done(future, checked))
+        return True
+
+    def _submit_to_pool(self, task):
+        """Submits a task, replacing the pool once if a crashed worker broke it."""
+        try:
+            return self._executor.submit(build_file, task)
+        except BrokenProcessPool:
+            if self.cancelled:
+                raise
+        # the futures of the broken pool fail on their own, see _on_done()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = _process_pool(self.workers)
+        return self._executor.submit(build_file, task)
+
+    def close(self, wait=True):
+        """Stops the workers, finishing the queued tasks if wait is set."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=not wait)
+            self._executor = None
+        with self._cache_lock:
+            self._save_cache()
+
+    def _on_done(self, future, task):
+        """Records the result of a finished task and frees its slot."""
+        self._slots.release()
+        if future.cancelled():
+            return
+        result = self._get_result(future, task)
+        with self._cache_lock:
+            self._record_outputs(result, self._output_keys)
+            # rewriting the whole cache after every file gets slow as it grows
+            now = time.monotonic()
+            if now - self._last_cache_save >= CACHE_SAVE_INTERVAL:
+                self._save_cache()
+                self._last_cache_save = now
+        self._report_result(result)
+
+    def _report_result(self, result):
+        if self.on_result:
+            self.on_result(result)
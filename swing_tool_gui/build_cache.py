@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+CACHE_FILE_NAME = "build_cache.json"
+CACHE_FORMAT_VERSION = 1
+
+
+def swing_tool_version():
+    """
+    Get the installed version of swing-tool, part of every cache key.
+
+    Args:
+    None
+
+    Return:
+    str: Version, "unknown" if it cannot be found
+    """
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("swing-tool")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+class BuildCache:
+    """
+    Content-addressed record of the outputs of previous builds.
+
+    Every output is recorded with a key made of the hash of the input content,
+    the crop rectangle, the title, the variant, the swing-tool version and the
+    encoder settings. An output whose recorded key matches the key of a new
+    build is up to date. Content hashes are remembered by input path, size and
+    mtime so unchanged inputs are not read again.
+    """
+
+    def __init__(self, cache_dir):
+        self.path = Path(cache_dir) / CACHE_FILE_NAME
+        self.tool_version = swing_tool_version()
+        self.hashes = {}
+        self.outputs = {}
+        self._load()
+
+    def _load(self):
+        """Loads the cache file, starting empty if it is missing or invalid."""
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get("format") != CACHE_FORMAT_VERSION:
+            return
+        self.hashes = data.get("hashes", {})
+        self.outputs = data.get("outputs", {})
+
+    def save(self):
+        """Writes the cache file atomically."""
+        temp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "format": CACHE_FORMAT_VERSION,
+                    "hashes": self.hashes,
+                    "outputs": self.outputs,
+                },
+                file,
+                ensure_ascii=False,
+            )
+        os.replace(temp_path, self.path)
+
+    def content_hash(self, input_file):
+        """Returns the SHA-256 of a file, reading it only if it changed."""
+        stat = os.stat(input_file)
+        identity = [stat.st_size, stat.st_mtime_ns]
+        cached = self.hashes.get(input_file)
+        if cached is not None and cached[:2] == identity:
+            return cached[2]
+        with open(input_file, "rb") as file:
+            digest = hashlib.file_digest(file, "sha256").hexdigest()
+        self.hashes[input_file] = [*identity, digest]
+        return digest
+
+    def output_key(self, task, variant, content_hash, settings=None):
+        """Returns the key of an output of a task."""
+        parts = [
+            content_hash,
+            list(task.crop) if task.crop else None,
+            task.title,
+            variant,
+            self.tool_version,
+            settings,
+        ]
+        return hashlib.sha256(
+            json.dumps(parts, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def is_fresh(self, output_path, key):
+        """Checks if an output exists and was built with the given key."""
+        output_path = Path(output_path)
+        recorded = self.outputs.get(output_path.name)
+        if recorded is None or recorded[0] != key:
+            return False
+        try:
+            return output_path.stat().st_size == recorded[1]
+        except OSError:
+            return False
+
+    def record(self, output_path, key):
+        """Records an output built with the given key."""
+        output_path = Path(output_path)
+        self.outputs[output_path.name] = [key, output_path.stat().st_size]
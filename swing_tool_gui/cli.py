@@ -0,0 +1,559 @@
+# Entry point of headless servers and containers: nothing imported here may
+# import Kivy.
+import argparse
+import multiprocessing
+import sys
+from dataclasses import replace
+from pathlib import Path
+
+from swing_tool_gui.autocrop import suggest_crops
+from swing_tool_gui.build import (
+    DEFAULT_VARIANTS,
+    VARIANTS,
+    BatchBuilder,
+    BuildTask,
+    default_workers,
+    state_dir,
+)
+from swing_tool_gui.build_cache import BuildCache
+from swing_tool_gui.derivatives import check_derivative_names, parse_derivative
+from swing_tool_gui.encoders import (
+    FORMAT_SUFFIXES,
+    JPEG_SUBSAMPLING,
+    PROFILES,
+    EncoderError,
+    check_profile,
+)
+from swing_tool_gui.manifest import (
+    ManifestEntry,
+    ManifestError,
+    load_manifest,
+    scan_directory,
+)
+from swing_tool_gui.project import PROJECT_SUFFIX, ProjectError, load_project
+from swing_tool_gui.tracing import format_summary
+from swing_tool_gui.utils import format_duration
+from swing_tool_gui.watch import SETTLE_SECONDS, FolderWatcher
+from swing_tool_gui.workqueue import (
+    DEFAULT_LEASE,
+    DEFAULT_MAX_ATTEMPTS,
+    DEFAULT_SHARD_SIZE,
+    JobError,
+    JobQueue,
+    QueueWorker,
+)
+
+EXISTING_POLICIES = ("overwrite", "skip", "error")
+
+
+def _parse_variants(value):
+    """Parses a comma separated list of variants."""
+    variants = tuple(variant.strip() for variant in value.split(",") if variant)
+    unknown = [variant for variant in variants if variant not in VARIANTS]
+    if not variants or unknown:
+        raise argparse.ArgumentTypeError(
+            f"variants must be a comma separated list of {', '.join(VARIANTS)}"
+        )
+    return variants
+
+
+def _parse_derivative(value):
+    """Parses a derivative of the --derivative option."""
+    try:
+        spec = parse_derivative(value)
+        if spec.encoder is not None:
+            check_profile(spec.encoder)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error)) from None
+    return spec
+
+
+def _add_build_arguments(command, cache=True):
+    """Adds the output, encoder and crop options shared by build, watch and submit."""
+    command.add_argument(
+        "-o", "--output", required=True, help="directory to save the images to"
+    )
+    command.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=default_workers(),
+        help="number of worker processes (default: %(default)s)",
+    )
+    command.add_argument(
+        "--variants",
+        type=_parse_variants,
+        default=DEFAULT_VARIANTS,
+        help=f"variants to build (default: {','.join(DEFAULT_VARIANTS)})",
+    )
+    command.add_argument(
+        "--derivative",
+        dest="derivatives",
+        type=_parse_derivative,
+        action="append",
+        default=[],
+        metavar="NAME:SIZE[:PROFILE[:VARIANTS]]",
+        help="also save the outputs at most SIZE pixels long, as"
+        " {stem}_new_NAME, optionally with another encoder profile and only"
+        " for some variants joined by '+', e.g. thumb:320:webp (repeatable)",
+    )
+    command.add_argument(
+        "--profile",
+        choices=PROFILES,
+        default="default",
+        help="encoder profile of the outputs (default: %(default)s)",
+    )
+    command.add_argument(
+        "--format",
+        type=str.upper,
+        choices=FORMAT_SUFFIXES,
+        help="output format, overrides the profile",
+    )
+    command.add_argument(
+        "--quality", type=int, help="JPEG, WebP or AVIF quality, overrides the profile"
+    )
+    command.add_argument(
+        "--subsampling",
+        choices=JPEG_SUBSAMPLING,
+        help="JPEG chroma subsampling, overrides the profile",
+    )
+    command.add_argument(
+        "--compress-level",
+        type=int,
+        choices=range(10),
+        metavar="0-9",
+        help="PNG compression level, overrides the profile",
+    )
+    command.add_argument(
+        "--optimize",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="optimize JPEG and PNG outputs, slower (default: from the profile)",
+    )
+    command.add_argument(
+        "--lossless",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="lossless WebP or AVIF outputs (default: from the profile)",
+    )
+    command.add_argument(
+        "--auto-crop",
+        action="store_true",
+        help="crop the files without a crop on their suggested square",
+    )
+    if cache:
+        command.add_argument(
+            "--force",
+            action="store_true",
+            help="rebuild the outputs the build cache reports as up to date",
+        )
+
+
+def build_parser():
+    """Builds the argument parser of the command line interface."""
+    parser = argparse.ArgumentParser(
+        prog="swing-tool-gui", description="Build Swing images without the GUI."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_command = subparsers.add_parser(
+        "build", help="build the images of a directory or a manifest"
+    )
+    build_command.add_argument(
+        "input", help="directory of images, JSON/CSV manifest or project file"
+    )
+    _add_build_arguments(build_command)
+    build_command.add_argument(
+        "--existing",
+        choices=EXISTING_POLICIES,
+        default="overwrite",
+        help="what to do when an output file exists (default: %(default)s)",
+    )
+    build_command.add_argument(
+        "--trace",
+        action="store_true",
+        help="save per-stage timings next to the outputs and print the slowest",
+    )
+    build_command.add_argument(
+        "-q", "--quiet", action="store_true", help="only print the summary"
+    )
+
+    watch_command = subparsers.add_parser(
+        "watch", help="build the images dropped in a directory until stopped"
+    )
+    watch_command.add_argument("input", help="directory to watch")
+    _add_build_arguments(watch_command)
+    watch_command.add_argument(
+        "--queue-size",
+        type=int,
+        help="files queued or building at once (default: twice the jobs)",
+    )
+    watch_command.add_argument(
+        "--settle",
+        type=float,
+        default=SETTLE_SECONDS,
+        help="seconds a file must stay unchanged before it is built"
+        " (default: %(default)s)",
+    )
+    watch_command.add_argument(
+        "--poll",
+        action="store_true",
+        help="poll the directory instead of using inotify",
+    )
+    watch_command.add_argument(
+        "-q", "--quiet", action="store_true", help="only print failures"
+    )
+
+    submit_command = subparsers.add_parser(
+        "submit", help="split a build into shards for workers on several hosts"
+    )
+    submit_command.add_argument(
+        "input", help="directory of images, JSON/CSV manifest or project file"
+    )
+    _add_build_arguments(submit_command, cache=False)
+    submit_command.add_argument(
+        "--job-dir", help="directory of the job (default: in the output directory)"
+    )
+    submit_command.add_argument(
+        "--shard-size",
+        type=int,
+        default=DEFAULT_SHARD_SIZE,
+        help="files per shard (default: %(default)s)",
+    )
+    submit_command.add_argument(
+        "--lease",
+        type=float,
+        default=DEFAULT_LEASE,
+        help="seconds before the shard of a silent worker is retried"
+        " (default: %(default)s)",
+    )
+    submit_command.add_argument(
+        "--max-attempts",
+        type=int,
+        default=DEFAULT_MAX_ATTEMPTS,
+        help="tries of a shard before it is given up (default: %(default)s)",
+    )
+
+    worker_command = subparsers.add_parser(
+        "worker", help="build the shards of a submitted job until it is finished"
+    )
+    worker_command.add_argument("job_dir", help="directory of the job")
+    worker_command.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=default_workers(),
+        help="number of worker processes (default: %(default)s)",
+    )
+    worker_command.add_argument(
+        "-q", "--quiet", action="store_true", help="only print failures"
+    )
+
+    status_command = subparsers.add_parser(
+        "status", help="print the progress of a submitted job"
+    )
+    status_command.add_argument("job_dir", help="directory of the job")
+    return parser
+
+
+def load_entries(input_path):
+    """Loads the entries to build from a directory, a manifest or a project."""
+    if Path(input_path).is_dir():
+        return scan_directory(input_path)
+    if input_path.endswith(PROJECT_SUFFIX):
+        settings, project_entries = load_project(input_path)
+        return [
+            ManifestEntry(file=entry.file, title=entry.title, crop=entry.crop)
+            for entry in project_entries
+        ]
+    return load_manifest(input_path)
+
+
+def _print_progress(progress):
+    """Prints a line for every finished file."""
+    result = progress.last
+    if result.cached:
+        status = "up to date"
+    else:
+        status = "ok" if result.ok else f"FAILED {result.error}"
+    eta = "" if progress.eta is None else f", {format_duration(progress.eta)} left"
+    print(
+        f"[{progress.done}/{progress.total}] {result.input_file}: {status}"
+        f" ({result.duration:.1f}s{eta})",
+        file=sys.stderr,
+    )
+
+
+def encoder_profile(args):
+    """Returns the encoder profile selected by the arguments."""
+    overrides = {
+        name: getattr(args, name)
+        for name in (
+            "format",
+            "quality",
+            "subsampling",
+            "compress_level",
+            "optimize",
+            "lossless",
+        )
+        if getattr(args, name) is not None
+    }
+    return replace(PROFILES[args.profile], **overrides)
+
+
+def _make_tasks(args, entries, output_dir, encoder):
+    """Makes the tasks of the entries, cropping them on suggestions if asked."""
+    suggested_crops = {}
+    if args.auto_crop:
+        suggested_crops = suggest_crops(
+            [entry.file for entry in entries if entry.crop is None], workers=args.jobs
+        )
+    return [
+        BuildTask(
+            index=index,
+            input_file=entry.file,
+            title=entry.title,
+            output_dir=str(output_dir),
+            crop=entry.crop or suggested_crops.get(entry.file),
+            variants=entry.variants or args.variants,
+            encoder=encoder,
+            derivatives=tuple(args.derivatives),
+        )
+        for index, entry in enumerate(entries)
+    ]
+
+
+def run_build(args):
+    """Runs the build command, returns the exit code."""
+    try:
+        entries = load_entries(args.input)
+        encoder = encoder_profile(args)
+        check_profile(encoder)
+    except (ManifestError, ProjectError, EncoderError) as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tasks = []
+    existing = []
+    for task in _make_tasks(args, entries, output_dir, encoder):
+        outputs = task.output_paths()
+        if args.existing == "error":
+            # a single output would be overwritten
+            built = any(output.exists() for output in outputs)
+        else:
+            built = all(output.exists() for output in outputs)
+        if built:
+            existing.append(task)
+            if args.existing == "skip":
+                continue
+        tasks.append(task)
+
+    if existing and args.existing == "error":
+        for task in existing:
+            print(f"error: an output of {task.input_file} exists", file=sys.stderr)
+        return 2
+    if args.existing == "skip" and existing:
+        print(f"skipping {len(existing)} files already built", file=sys.stderr)
+    if not tasks:
+        print("nothing to build", file=sys.stderr)
+        return 0
+
+    builder = BatchBuilder(
+        tasks,
+        workers=args.jobs,
+        on_progress=None if args.quiet else _print_progress,
+        cache=BuildCache(state_dir(output_dir)),
+        force=args.force,
+    )
+    builder.start()
+    try:
+        summary = builder.wait()
+    except KeyboardInterrupt:
+        builder.cancel()
+        summary = builder.wait()
+
+    print(
+        f"{len(summary.succeeded)} succeeded, {len(summary.failed)} failed"
+        f" in {format_duration(summary.elapsed)}"
+        + (" (cancelled)" if summary.cancelled else "")
+    )
+    print(
+        f"cache: {summary.cache_hits} outputs up to date,"
+        f" {summary.cache_misses} built"
+    )
+    for result in summary.failed:
+        print(f"  {result.input_file}: {result.error}")
+    if args.trace:
+        for line in format_summary(builder.tracer.summary()):
+            print(line)
+        jsonl_path, chrome_path = builder.tracer.export(state_dir(output_dir))
+        print(f"Trace saved to {jsonl_path} and {chrome_path}")
+    return 1 if summary.failed or summary.cancelled else 0
+
+
+def _print_watch_result(result):
+    """Prints a line for every file built by the watch command."""
+    if result.cached:
+        status = "up to date"
+    else:
+        status = "ok" if result.ok else f"FAILED {result.error}"
+    print(f"{result.input_file}: {status} ({result.duration:.1f}s)", file=sys.stderr)
+
+
+def run_watch(args):
+    """Runs the watch command until interrupted, returns the exit code."""
+    if not Path(args.input).is_dir():
+        print(f"error: {args.input} is not a directory", file=sys.stderr)
+        return 2
+    try:
+        encoder = encoder_profile(args)
+        check_profile(encoder)
+    except EncoderError as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+
+    def on_result(result):
+        if not args.quiet or not result.ok:
+            _print_watch_result(result)
+
+    watcher = FolderWatcher(
+        args.input,
+        args.output,
+        variants=args.variants,
+        encoder=encoder,
+        derivatives=tuple(args.derivatives),
+        workers=args.jobs,
+        queue_size=args.queue_size,
+        settle=args.settle,
+        polling=args.poll,
+        auto_crop=args.auto_crop,
+        force=args.force,
+        on_result=on_result,
+    )
+    print(f"watching {args.input}, press Ctrl-C to stop", file=sys.stderr)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _format_job_progress(progress):
+    """Formats the progress of a job on one line."""
+    line = (
+        f"{progress.built + progress.errors}/{progress.files} files"
+        f" ({progress.errors} failed), shards: {progress.done} done,"
+        f" {progress.leased} building, {progress.pending} pending"
+    )
+    if progress.failed:
+        line += f", {progress.failed} given up"
+    if progress.workers:
+        line += f", {len(progress.workers)} workers"
+    return line
+
+
+def run_submit(args):
+    """Runs the submit command, returns the exit code."""
+    try:
+        entries = load_entries(args.input)
+        encoder = encoder_profile(args)
+        check_profile(encoder)
+    except (ManifestError, ProjectError, EncoderError) as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+    if not entries:
+        print("nothing to build", file=sys.stderr)
+        return 0
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    queue = JobQueue.submit(
+        _make_tasks(args, entries, output_dir, encoder),
+        output_dir,
+        encoder,
+        job_dir=args.job_dir,
+        shard_size=max(1, args.shard_size),
+        lease=args.lease,
+        max_attempts=args.max_attempts,
+        derivatives=tuple(args.derivatives),
+    )
+    print(
+        f"submitted {len(entries)} files in {queue.job['shards']} shards,"
+        f" start workers with:",
+        file=sys.stderr,
+    )
+    print(f"python -m swing_tool_gui.cli worker {queue.job_dir}")
+    return 0
+
+
+def run_worker(args):
+    """Runs the worker command until the job is finished, returns the exit code."""
+    try:
+        worker = QueueWorker(args.job_dir, workers=args.jobs)
+    except JobError as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+
+    def on_shard(shard, results):
+        failed = [result for result in results if not result.ok]
+        if not args.quiet:
+            print(
+                f"{shard.name}: {len(results) - len(failed)} built,"
+                f" {len(failed)} failed",
+                file=sys.stderr,
+            )
+        for result in failed:
+            print(f"  {result.input_file}: {result.error}", file=sys.stderr)
+
+    worker.on_shard = on_shard
+    print(f"worker {worker.worker_id} on {args.job_dir}", file=sys.stderr)
+    try:
+        built = worker.run()
+    except KeyboardInterrupt:
+        # the lease of the current shard expires and another worker takes it
+        return 1
+    progress = worker.queue.progress()
+    print(f"{built} shards built here; {_format_job_progress(progress)}")
+    return 1 if progress.errors or progress.failed else 0
+
+
+def run_status(args):
+    """Runs the status command, returns the exit code."""
+    try:
+        queue = JobQueue(args.job_dir)
+    except JobError as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+    progress = queue.progress()
+    print(_format_job_progress(progress))
+    for worker_id, shards in sorted(progress.workers.items()):
+        print(f"  {worker_id}: {shards} shards")
+    return 0 if progress.finished else 1
+
+
+def main(argv=None):
+    """Entry point of the command line interface."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        # each --derivative is parsed alone, their names are checked together
+        check_derivative_names(getattr(args, "derivatives", ()))
+    except ValueError as error:
+        parser.error(str(error))
+    if args.command == "build":
+        return run_build(args)
+    if args.command == "watch":
+        return run_watch(args)
+    if args.command == "submit":
+        return run_submit(args)
+    if args.command == "worker":
+        return run_worker(args)
+    if args.command == "status":
+        return run_status(args)
+    return 2
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
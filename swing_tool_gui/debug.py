@@ -0,0 +1,306 @@
+import heapq
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+
+from swing_tool_gui.utils import user_cache_dir
+
+# set to monitor the frame times and the stalls of the main loop
+DEBUG_ENV = "SWING_DEBUG"
+# blocking time of the main loop reported as a stall, in ms, instead of the
+# default
+STALL_THRESHOLD_ENV = "SWING_STALL_MS"
+DEFAULT_STALL_THRESHOLD = 0.2
+STALL_REPORT_FILE_NAME = "stalls.log"
+# upper bounds of the frame time buckets, in ms, the last bucket is unbounded
+FRAME_BUCKETS = (17, 33, 50, 100, 250, 500, 1000)
+WORST_FRAMES = 10
+# times per threshold the watchdog checks the main loop
+WATCHDOG_CHECKS = 4
+OVERLAY_INTERVAL = 0.5
+
+
+def append_report(path, lines):
+    """Appends lines to a report file, a failed write loses them."""
+    try:
+        with open(path, "a", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+    except OSError:
+        pass
+
+
+def debug_enabled():
+    """Returns whether the debug monitor is enabled by SWING_DEBUG."""
+    return os.environ.get(DEBUG_ENV, "") not in ("", "0")
+
+
+def stall_threshold():
+    """
+    Get the blocking time of the main loop reported as a stall.
+
+    Args:
+    None
+
+    Return:
+    float: Threshold in seconds, from SWING_STALL_MS if it is a positive number
+    """
+    try:
+        threshold = float(os.environ[STALL_THRESHOLD_ENV]) / 1000
+    except (KeyError, ValueError):
+        return DEFAULT_STALL_THRESHOLD
+    # the watchdog would spin on 0 or less, and never report on infinity
+    return threshold if 0 < threshold < math.inf else DEFAULT_STALL_THRESHOLD
+
+
+class FrameStats:
+    """Histogram of the frame times, with the worst frames and when they were."""
+
+    def __init__(self, buckets=FRAME_BUCKETS, worst=WORST_FRAMES):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.frames = 0
+        self.total = 0.0
+        self.last = 0.0
+        self._worst_count = worst
+        # min-heap of (duration, wall time) of the worst frames
+        self._worst = []
+
+    def add(self, duration):
+        """Records the duration of a frame, in seconds."""
+        self.frames += 1
+        self.total += duration
+        self.last = duration
+        self.counts[bisect_left(self.buckets, duration * 1000)] += 1
+        frame = (duration, time.time())
+        if len(self._worst) < self._worst_count:
+            heapq.heappush(self._worst, frame)
+        elif frame > self._worst[0]:
+            heapq.heapreplace(self._worst, frame)
+
+    @property
+    def mean(self):
+        return self.total / self.frames if self.frames else 0.0
+
+    def worst(self):
+        """Returns the (duration, wall time) of the worst frames, worst first."""
+        return sorted(self._worst, reverse=True)
+
+    def format(self):
+        """
+        Format the histogram and the worst frames for a report.
+
+        Args:
+        None
+
+        Return:
+        list: Lines of text
+        """
+        lines = [
+            f"{self.frames} frames, mean {self.mean * 1000:.1f} ms",
+        ]
+        lower = 0
+        for upper, count in zip((*self.buckets, None), self.counts):
+            label = f"{lower}-{upper} ms" if upper else f">{lower} ms"
+            share = count / self.frames if self.frames else 0
+            lines.append(f"  {label:>12} {count:8d} {'#' * round(share * 40)}")
+            lower = upper
+        if self._worst:
+            lines.append(
+                "Worst frames: "
+                + ", ".join(
+                    f"{duration * 1000:.0f} ms at"
+                    f" {time.strftime('%H:%M:%S', time.localtime(at))}"
+                    for duration, at in self.worst()
+                )
+            )
+        return lines
+
+
+class StallWatchdog:
+    """
+    Reports where a thread is stuck when it stops calling beat() in time.
+
+    A background thread checks a few times per threshold when the watched
+    thread last called beat(). Once it is late by more than the threshold,
+    the stack of the watched thread is captured with sys._current_frames()
+    and appended to the report file, with the length of the stall once it
+    ends. on_stall is called from the watchdog thread with (seconds, stack).
+    """
+
+    def __init__(
+        self,
+        report_path,
+        threshold=DEFAULT_STALL_THRESHOLD,
+        thread_id=None,
+        on_stall=None,
+    ):
+        self.report_path = str(report_path)
+        self.threshold = threshold
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.on_stall = on_stall
+        self.stalls = 0
+        self._last_beat = time.perf_counter()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts watching."""
+        self._last_beat = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="stall-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stops watching."""
+        self._stop_event.set()
+
+    def beat(self):
+        """Tells the watchdog the watched thread is responsive, call it often."""
+        self._last_beat = time.perf_counter()
+
+    def _run(self):
+        """Checks the beats and reports the stalls."""
+        interval = self.threshold / WATCHDOG_CHECKS
+        stalled_beat = None
+        while not self._stop_event.wait(interval):
+            beat = self._last_beat
+            late = time.perf_counter() - beat
+            if stalled_beat is not None and beat != stalled_beat:
+                # the stalled callback returned
+                append_report(
+                    self.report_path, [f"ended after {beat - stalled_beat:.3f}s", ""]
+                )
+                stalled_beat = None
+            if stalled_beat is None and late > self.threshold:
+                stalled_beat = beat
+                self._report(late)
+
+    def _report(self, late):
+        """Captures and writes the stack of the stalled thread."""
+        frame = sys._current_frames().get(self.thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else ""
+        self.stalls += 1
+        append_report(
+            self.report_path,
+            [
+                f"=== stall at {time.strftime('%Y-%m-%d %H:%M:%S')},"
+                f" main loop blocked for {late:.3f}s so far",
+                stack.rstrip(),
+            ],
+        )
+        if self.on_stall:
+            self.on_stall(late, stack)
+
+
+class FrameMonitor:
+    """
+    Records the frame times of the Kivy main loop and reports its stalls.
+
+    Every frame is timed from the Clock and beats a StallWatchdog. A small
+    overlay in the top right corner of the window shows the last and worst
+    frame times and the number of stalls. The histogram of the frames is
+    appended to the report file when the monitor stops.
+    """
+
+    def __init__(self, report_path=None, threshold=None):
+        self.report_path = report_path or user_cache_dir() / STALL_REPORT_FILE_NAME
+        self.stats = FrameStats()
+        if not threshold or threshold <= 0:
+            threshold = stall_threshold()
+        self.watchdog = StallWatchdog(
+            self.report_path, threshold, on_stall=self._on_stall
+        )
+        self.overlay = None
+        self._events = []
+
+    def start(self):
+        """Starts timing the frames and shows the overlay."""
+        from kivy.clock import Clock
+        from kivy.logger import Logger
+
+        self.watchdog.start()
+        self._events = [
+            # an interval of 0 calls back once per frame
+            Clock.schedule_interval(self._on_frame, 0),
+            Clock.schedule_interval(self._update_overlay, OVERLAY_INTERVAL),
+        ]
+        self._show_overlay()
+        Logger.info(
+            f"Debug: frame monitor on, stalls over"
+            f" {self.watchdog.threshold * 1000:.0f} ms go to {self.report_path}"
+        )
+
+    def stop(self):
+        """Stops timing and appends the frame histogram to the report."""
+        if not self._events:
+            # the app may stop more than once
+            return
+        for event in self._events:
+            event.cancel()
+        self._events = []
+        self.watchdog.stop()
+        append_report(
+            self.report_path,
+            [f"=== frames until {time.strftime('%Y-%m-%d %H:%M:%S')}"]
+            + self.stats.format()
+            + [""],
+        )
+
+    def _on_stall(self, late, stack):
+        """Logs a stall, its stack is in the report file."""
+        from kivy.logger import Logger
+
+        Logger.warning(
+            f"Debug: main loop blocked for {late * 1000:.0f} ms,"
+            f" stack in {self.report_path}"
+        )
+
+    def _on_frame(self, dt):
+        """Records a frame, dt being the time since the previous one."""
+        self.stats.add(dt)
+        self.watchdog.beat()
+
+    def _show_overlay(self):
+        """Adds the frame time label on top of the window."""
+        from kivy.core.window import Window
+        from kivy.graphics import Color, Rectangle
+        from kivy.uix.label import Label
+
+        self.overlay = Label(
+            size_hint=(None, None),
+            size=("220dp", "40dp"),
+            font_size="11sp",
+            halign="right",
+            valign="middle",
+        )
+        self.overlay.text_size = self.overlay.size
+        with self.overlay.canvas.before:
+            Color(0, 0, 0, 0.6)
+            background = Rectangle()
+
+        def place(*args):
+            self.overlay.pos = (
+                Window.width - self.overlay.width,
+                Window.height - self.overlay.height,
+            )
+            background.pos = self.overlay.pos
+            background.size = self.overlay.size
+
+        Window.bind(size=place)
+        place()
+        Window.add_widget(self.overlay)
+
+    def _update_overlay(self, dt):
+        """Shows the latest frame statistics."""
+        worst = self.stats.worst()
+        self.overlay.text = (
+            f"frame {self.stats.last * 1000:.0f} ms,"
+            f" mean {self.stats.mean * 1000:.0f} ms\n"
+            f"worst {worst[0][0] * 1000 if worst else 0:.0f} ms,"
+            f" stalls {self.watchdog.stalls}"
+        )
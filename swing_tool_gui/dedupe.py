@@ -0,0 +1,255 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from swing_tool_gui.imaging import open_reduced
+
+# the hash compares HASH_SIZE + 1 by HASH_SIZE gray pixels, 64 bits
+HASH_SIZE = 8
+# proxy the hash is computed from, decoded at 1/8 scale for big JPEG files
+HASH_PROXY_SIZE = 64
+# largest number of differing bits between two near-duplicates, re-encodes
+# and resizes of a shot stay within it while different shots rarely do
+DUPLICATE_DISTANCE = 4
+DEDUPE_WORKERS = 4
+
+
+def dhash(path):
+    """
+    Compute the difference hash of an image.
+
+    The image is shrunk to HASH_SIZE + 1 by HASH_SIZE gray pixels and every
+    bit tells if a pixel is brighter than its right neighbor, so the hash
+    survives re-encoding, resizing and small color changes.
+
+    Args:
+    path(str): Path to the image
+
+    Return:
+    int: Hash of HASH_SIZE * HASH_SIZE bits
+    """
+    from PIL import Image
+
+    with open_reduced(path, (HASH_PROXY_SIZE, HASH_PROXY_SIZE)) as img:
+        small = img.convert("L").resize(
+            (HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX
+        )
+    pixels = small.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for column in range(HASH_SIZE):
+            bit = pixels[offset + column] > pixels[offset + column + 1]
+            value = value << 1 | bit
+    return value
+
+
+def hamming(first, second):
+    """Returns the number of bits two hashes differ by."""
+    return (first ^ second).bit_count()
+
+
+class MultiIndexHash:
+    """
+    Index of hashes finding the ones within a few bits of a hash.
+
+    Hashes are split into radius + 1 bands of bits: two hashes differing by
+    at most radius bits are equal on at least one band, so a search only
+    compares the hashes sharing a band with it. With well spread hashes a
+    search costs a few comparisons instead of one per indexed hash, where a
+    BK-tree still visits most of its nodes at 64 bits.
+    """
+
+    def __init__(self, radius, bits=HASH_SIZE * HASH_SIZE):
+        self.radius = radius
+        bands = radius + 1
+        # (shift, mask) of every band
+        self.bands = []
+        start = 0
+        for band in range(bands):
+            width = (bits - start) // (bands - band)
+            self.bands.append((start, (1 << width) - 1))
+            start += width
+        # one {band value: [(hash, item)]} table per band
+        self.tables = [{} for _ in self.bands]
+
+    def add(self, value, item):
+        """Adds an item with its hash."""
+        for (shift, mask), table in zip(self.bands, self.tables):
+            table.setdefault(value >> shift & mask, []).append((value, item))
+
+    def search(self, value):
+        """Returns the items whose hash is within radius bits of a hash."""
+        found = {}
+        for (shift, mask), table in zip(self.bands, self.tables):
+            for other, item in table.get(value >> shift & mask, ()):
+                if item not in found and hamming(value, other) <= self.radius:
+                    found[item] = None
+        return list(found)
+
+
+class DuplicateFinder:
+    """
+    Groups near-duplicate images as their hashes are added.
+
+    The first image of a group is its representative, only the hashes of
+    representatives are kept in a multi-index table. A new hash joins the
+    group of the closest representative within distance, or starts a group,
+    so adding n images costs about n small lookups, not n * n comparisons.
+    Every image is within distance of its representative: a burst drifting
+    a few bits per shot is not chained into a single group.
+    """
+
+    def __init__(self, distance=DUPLICATE_DISTANCE):
+        self.distance = distance
+        self.index = MultiIndexHash(distance)
+        # path: representative path, of every image added
+        self._groups = {}
+        # representative path: hash
+        self._hashes = {}
+        # representative path: images in the group, removed ones left out
+        self._sizes = {}
+        self._removed = set()
+        # images added, counting a file listed twice, and groups among them
+        self._listed = 0
+        self._components = 0
+
+    @property
+    def duplicate_count(self):
+        """Number of images collapsing every group to one image would drop."""
+        return self._listed - self._components
+
+    def add(self, path, value):
+        """
+        Add the hash of an image and group it with its near-duplicates.
+
+        Args:
+        path(str): Path to the image
+        value(int): dhash() of the image
+
+        Return:
+        bool: Whether the image has a near-duplicate
+        """
+        self._listed += 1
+        if path in self._groups:
+            # the same file listed twice, or a collapsed file back in its group
+            if path in self._removed:
+                self._removed.discard(path)
+                self._count(self._groups[path])
+            return True
+        matches = self.index.search(value)
+        if matches:
+            representative = min(
+                matches,
+                key=lambda match: hamming(value, self._hashes[match]),
+            )
+        else:
+            representative = path
+            self.index.add(value, path)
+            self._hashes[path] = value
+        self._groups[path] = representative
+        self._count(representative)
+        return bool(matches)
+
+    def remove(self, paths):
+        """Leaves images out of the groups, e.g. once they are collapsed."""
+        self._removed.update(paths)
+        live = [path for path in self._groups if path not in self._removed]
+        self._listed = len(live)
+        self._sizes = {}
+        for path in live:
+            representative = self._groups[path]
+            self._sizes[representative] = self._sizes.get(representative, 0) + 1
+        self._components = len(self._sizes)
+
+    def groups(self):
+        """Returns the groups of more than one image, in the order added."""
+        groups = {}
+        for path, representative in self._groups.items():
+            if path not in self._removed:
+                groups.setdefault(representative, []).append(path)
+        return [group for group in groups.values() if len(group) > 1]
+
+    def _count(self, representative):
+        """Counts one more image in a group."""
+        size = self._sizes.get(representative, 0)
+        if not size:
+            self._components += 1
+        self._sizes[representative] = size + 1
+
+
+def find_duplicates(paths, distance=DUPLICATE_DISTANCE, workers=DEDUPE_WORKERS):
+    """
+    Group the near-duplicate images of a list.
+
+    Args:
+    paths(list): Paths to the images
+    distance(int): Largest number of differing hash bits of duplicates
+    workers(int): Number of threads hashing the images
+
+    Return:
+    list: Groups of more than one path, unreadable images are left out
+    """
+    finder = DuplicateFinder(distance)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(path, executor.submit(dhash, path)) for path in paths]
+        for path, future in futures:
+            if future.exception() is None:
+                finder.add(path, future.result())
+    return finder.groups()
+
+
+class DuplicateDetector:
+    """Hashes images in the background and groups their near-duplicates."""
+
+    def __init__(
+        self, distance=DUPLICATE_DISTANCE, workers=DEDUPE_WORKERS, tracer=None
+    ):
+        self.finder = DuplicateFinder(distance)
+        self.tracer = tracer
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="dedupe"
+        )
+
+    def request(self, path, callback):
+        """
+        Hashes an image in the background and adds it to the groups.
+
+        The callback is called from a worker thread with (path, duplicate),
+        duplicate tells if the image has a near-duplicate so far.
+        """
+        future = self._executor.submit(self._add, path)
+        future.add_done_callback(
+            lambda future: callback(
+                path, False if future.exception() else future.result()
+            )
+        )
+
+    @property
+    def duplicate_count(self):
+        with self._lock:
+            return self.finder.duplicate_count
+
+    def groups(self):
+        """Returns the groups of near-duplicates found so far."""
+        with self._lock:
+            return self.finder.groups()
+
+    def remove(self, paths):
+        """Leaves images out of the groups."""
+        with self._lock:
+            self.finder.remove(paths)
+
+    def shutdown(self):
+        """Stops the workers, dropping the pending requests."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _add(self, path):
+        """Hashes an image and adds it to the finder."""
+        if self.tracer is None:
+            value = dhash(path)
+        else:
+            with self.tracer.span(path, "dhash"):
+                value = dhash(path)
+        with self._lock:
+            return self.finder.add(path, value)
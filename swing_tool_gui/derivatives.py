@@ -0,0 +1,163 @@
+import re
+from dataclasses import dataclass
+
+from swing_tool_gui.encoders import PROFILES, EncoderProfile
+
+# name of a derivative, part of its output file names
+DERIVATIVE_NAME = re.compile(r"[A-Za-z0-9-]+")
+
+
+@dataclass(frozen=True)
+class DerivativeSpec:
+    """
+    A smaller copy of the built images, saved next to them.
+
+    The copy of an output named {stem}_new{suffix} is {stem}_new_{name}{suffix}.
+    Its longest side is at most max_size, an output already that small is
+    copied as it is. Without an encoder the copy is encoded like the output,
+    without variants it is made for every variant.
+    """
+
+    name: str
+    max_size: int
+    encoder: EncoderProfile | None = None
+    variants: tuple[str, ...] | None = None
+
+    def applies_to(self, variant):
+        """Returns whether the derivative is made for a variant."""
+        return self.variants is None or variant in self.variants
+
+    def output_suffix(self, variant_suffix):
+        """Returns the output name suffix of the derivative of a variant."""
+        return f"{variant_suffix}_{self.name}"
+
+    def to_dict(self):
+        """Returns the spec as a JSON-compatible dict, e.g. for job files."""
+        return {
+            "name": self.name,
+            "max_size": self.max_size,
+            "encoder": self.encoder.to_dict() if self.encoder else None,
+            "variants": list(self.variants) if self.variants else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Makes a spec from a dict written by to_dict()."""
+        return cls(
+            name=data["name"],
+            max_size=data["max_size"],
+            encoder=EncoderProfile(**data["encoder"]) if data["encoder"] else None,
+            variants=tuple(data["variants"]) if data["variants"] else None,
+        )
+
+    def __str__(self):
+        parts = [self.name, str(self.max_size)]
+        if self.encoder or self.variants:
+            parts.append(self.encoder.name if self.encoder else "")
+        if self.variants:
+            parts.append("+".join(self.variants))
+        return ":".join(parts)
+
+
+def parse_derivative(text):
+    """
+    Parse a derivative written as name:max_size[:profile[:variant+variant]].
+
+    An empty profile keeps the encoder of the outputs, e.g. "web:2048",
+    "thumb:320:webp" or "story:720::ig".
+
+    Args:
+    text(str): Derivative to parse
+
+    Return:
+    DerivativeSpec: Parsed derivative, ValueError if it is invalid
+    """
+    from swing_tool_gui.build import VARIANTS
+
+    parts = [part.strip() for part in text.strip().split(":")]
+    if not 2 <= len(parts) <= 4:
+        raise ValueError(f"{text!r}: expected name:max_size[:profile[:variants]]")
+    name, max_size, profile, variants = parts + [""] * (4 - len(parts))
+    if not DERIVATIVE_NAME.fullmatch(name):
+        raise ValueError(f"{text!r}: name must be letters, digits or '-'")
+    try:
+        max_size = int(max_size)
+    except ValueError:
+        max_size = 0
+    if max_size <= 0:
+        raise ValueError(f"{text!r}: max_size must be a positive number of pixels")
+    if profile and profile not in PROFILES:
+        raise ValueError(f"{text!r}: profile must be one of {', '.join(PROFILES)}")
+    variants = tuple(variant for variant in variants.split("+") if variant)
+    unknown = [variant for variant in variants if variant not in VARIANTS]
+    if unknown:
+        raise ValueError(f"{text!r}: variants must be among {', '.join(VARIANTS)}")
+    spec = DerivativeSpec(
+        name=name,
+        max_size=max_size,
+        encoder=PROFILES[profile] if profile else None,
+        variants=variants or None,
+    )
+    # names have no "_", so only a variant suffix can be overwritten, e.g. by
+    # the "ig" derivative of the _new outputs
+    suffixes = {suffix for suffix, ig in VARIANTS.values()}
+    for variant, (suffix, ig) in VARIANTS.items():
+        if spec.applies_to(variant) and spec.output_suffix(suffix) in suffixes:
+            raise ValueError(f"{text!r}: {name} clashes with the variant outputs")
+    return spec
+
+
+def check_derivative_names(specs):
+    """Raises ValueError if two derivatives share a name, and so output files."""
+    names = [spec.name for spec in specs]
+    repeated = sorted({name for name in names if names.count(name) > 1})
+    if repeated:
+        raise ValueError(
+            f"derivative names must be unique, repeated: {', '.join(repeated)}"
+        )
+
+
+def parse_derivatives(text):
+    """Parses a comma separated list of derivatives, see parse_derivative()."""
+    specs = [parse_derivative(part) for part in text.split(",") if part.strip()]
+    check_derivative_names(specs)
+    return tuple(specs)
+
+
+def make_derivatives(image, specs):
+    """
+    Downscale an image to every derivative size, progressively.
+
+    The sizes are made from the largest to the smallest, each from the
+    previous one, so every step resamples an image at most a few times bigger
+    than its result instead of the full-size image.
+
+    Args:
+    image(PIL.Image.Image): Built image, left open and unchanged
+    specs(list): DerivativeSpec to make
+
+    Return:
+    list: (DerivativeSpec, PIL.Image.Image) of each spec, the images are new
+          and must be closed by the caller
+    """
+    from PIL import Image
+
+    derivatives = []
+    current = image
+    try:
+        for spec in sorted(specs, key=lambda spec: spec.max_size, reverse=True):
+            scale = spec.max_size / max(current.size)
+            if scale < 1:
+                size = (
+                    max(1, round(current.width * scale)),
+                    max(1, round(current.height * scale)),
+                )
+                current = current.resize(size, Image.Resampling.LANCZOS)
+            else:
+                current = current.copy()
+            derivatives.append((spec, current))
+    except Exception:
+        for spec, derivative in derivatives:
+            derivative.close()
+        raise
+    return derivatives
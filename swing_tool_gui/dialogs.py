@@ -0,0 +1,253 @@
+import os
+import platform
+import subprocess
+from abc import ABC, abstractmethod
+from threading import Thread
+
+from kivy.clock import Clock
+from kivy.logger import Logger
+from kivy.uix.boxlayout import BoxLayout
+from kivy.uix.button import Button
+from kivy.uix.filechooser import FileChooserListView
+from kivy.uix.popup import Popup
+from kivy.uix.textinput import TextInput
+
+# name of the dialog backend to use, instead of the platform default
+DIALOG_BACKEND_ENV = "SWING_DIALOG_BACKEND"
+# answers of the stub backend, paths separated by os.pathsep
+STUB_FILES_ENV = "SWING_DIALOG_FILES"
+STUB_FOLDER_ENV = "SWING_DIALOG_FOLDER"
+STUB_SAVE_FILE_ENV = "SWING_DIALOG_SAVE_FILE"
+
+# AppleScript error number of a dialog cancelled by the user
+OSASCRIPT_CANCELLED = "-128"
+# the prompt is passed as an argument so it never needs quoting
+CHOOSE_FILES_SCRIPT = """
+on run argv
+    set theFiles to choose file with prompt (item 1 of argv) \
+of type {"public.folder", "public.item"} with multiple selections allowed
+    set output to ""
+    repeat with theFile in theFiles
+        set output to output & POSIX path of theFile & linefeed
+    end repeat
+    return output
+end run
+"""
+CHOOSE_FOLDER_SCRIPT = """
+on run argv
+    return POSIX path of (choose folder with prompt (item 1 of argv))
+end run
+"""
+CHOOSE_SAVE_FILE_SCRIPT = """
+on run argv
+    return POSIX path of \
+(choose file name with prompt (item 1 of argv) default name (item 2 of argv))
+end run
+"""
+
+
+class FileDialog(ABC):
+    """
+    Asks the user for files or a folder without blocking the UI.
+
+    The answer is passed to the callback on the main thread, an empty list or
+    None if the dialog was cancelled.
+    """
+
+    @abstractmethod
+    def choose_files(self, prompt, callback):
+        """Asks for files and folders, calls back with a list of POSIX paths."""
+
+    @abstractmethod
+    def choose_folder(self, prompt, callback):
+        """Asks for a folder, calls back with its POSIX path or None."""
+
+    @abstractmethod
+    def choose_save_file(self, prompt, default_name, callback):
+        """Asks for a file to write, calls back with its POSIX path or None."""
+
+
+class OsascriptDialog(FileDialog):
+    """Native macOS dialogs, run by osascript on a background thread."""
+
+    def choose_files(self, prompt, callback):
+        self._run(
+            CHOOSE_FILES_SCRIPT,
+            prompt,
+            lambda output: [path for path in output.splitlines() if path],
+            [],
+            callback,
+        )
+
+    def choose_folder(self, prompt, callback):
+        self._run(
+            CHOOSE_FOLDER_SCRIPT, prompt, lambda output: output or None, None, callback
+        )
+
+    def choose_save_file(self, prompt, default_name, callback):
+        self._run(
+            CHOOSE_SAVE_FILE_SCRIPT,
+            prompt,
+            lambda output: output or None,
+            None,
+            callback,
+            default_name,
+        )
+
+    def _run(self, script, prompt, parse, cancelled, callback, *args):
+        """Runs a script off the main thread and calls back with its answer."""
+
+        def run():
+            answer = cancelled
+            try:
+                process = subprocess.run(
+                    ["osascript", "-e", script, prompt, *args],
+                    capture_output=True,
+                    text=True,
+                )
+            except OSError as error:
+                Logger.error(f"Dialog: cannot run osascript: {error}")
+            else:
+                if process.returncode == 0:
+                    answer = parse(process.stdout.rstrip("\n"))
+                elif OSASCRIPT_CANCELLED not in process.stderr:
+                    Logger.error(f"Dialog: osascript failed: {process.stderr.strip()}")
+            Clock.schedule_once(lambda dt: callback(answer))
+
+        Thread(target=run, daemon=True).start()
+
+
+class KivyFileDialog(FileDialog):
+    """Dialogs drawn by Kivy, for platforms without a native backend."""
+
+    def choose_files(self, prompt, callback):
+        self._open(
+            prompt,
+            FileChooserListView(
+                path=os.path.expanduser("~"), multiselect=True, dirselect=True
+            ),
+            lambda chooser: list(chooser.selection),
+            [],
+            callback,
+        )
+
+    def choose_folder(self, prompt, callback):
+        chooser = FileChooserListView(
+            path=os.path.expanduser("~"),
+            dirselect=True,
+            filters=[lambda folder, name: os.path.isdir(os.path.join(folder, name))],
+        )
+        self._open(
+            prompt,
+            chooser,
+            lambda chooser: (chooser.selection or [chooser.path])[0],
+            None,
+            callback,
+        )
+
+    def choose_save_file(self, prompt, default_name, callback):
+        chooser = FileChooserListView(path=os.path.expanduser("~"))
+        name_input = TextInput(
+            text=default_name, multiline=False, size_hint_y=None, height="40dp"
+        )
+
+        def on_selection(chooser, selection):
+            # picking an existing file overwrites it
+            if selection:
+                name_input.text = os.path.basename(selection[0])
+
+        def answer(chooser):
+            name = name_input.text.strip()
+            return os.path.join(chooser.path, name) if name else None
+
+        chooser.bind(selection=on_selection)
+        self._open(prompt, chooser, answer, None, callback, name_input)
+
+    def _open(self, prompt, chooser, answer, cancelled, callback, extra=None):
+        """Opens a popup holding a file chooser with Select and Cancel."""
+        layout = BoxLayout(orientation="vertical", spacing=10)
+        buttons = BoxLayout(size_hint_y=None, height="48dp", spacing=10)
+        select_button = Button(text="Select")
+        cancel_button = Button(text="Cancel")
+        buttons.add_widget(cancel_button)
+        buttons.add_widget(select_button)
+        layout.add_widget(chooser)
+        if extra is not None:
+            layout.add_widget(extra)
+        layout.add_widget(buttons)
+        popup = Popup(
+            title=prompt, content=layout, size_hint=(0.9, 0.9), auto_dismiss=False
+        )
+
+        def close(result):
+            popup.dismiss()
+            callback(result)
+
+        select_button.bind(on_press=lambda instance: close(answer(chooser)))
+        cancel_button.bind(on_press=lambda instance: close(cancelled))
+        popup.open()
+
+
+class StubDialog(FileDialog):
+    """
+    Scripted answers, for headless runs and tests.
+
+    Without explicit answers the paths are read from SWING_DIALOG_FILES,
+    SWING_DIALOG_FOLDER and SWING_DIALOG_SAVE_FILE when the dialog is opened.
+    """
+
+    def __init__(self, files=None, folder=None, save_file=None):
+        self.files = files
+        self.folder = folder
+        self.save_file = save_file
+        # prompts of the dialogs opened so far
+        self.prompts = []
+
+    def choose_files(self, prompt, callback):
+        self.prompts.append(prompt)
+        files = self.files
+        if files is None:
+            files = [
+                path
+                for path in os.environ.get(STUB_FILES_ENV, "").split(os.pathsep)
+                if path
+            ]
+        Clock.schedule_once(lambda dt: callback(list(files)))
+
+    def choose_folder(self, prompt, callback):
+        self.prompts.append(prompt)
+        folder = self.folder or os.environ.get(STUB_FOLDER_ENV) or None
+        Clock.schedule_once(lambda dt: callback(folder))
+
+    def choose_save_file(self, prompt, default_name, callback):
+        self.prompts.append(prompt)
+        save_file = self.save_file or os.environ.get(STUB_SAVE_FILE_ENV) or None
+        Clock.schedule_once(lambda dt: callback(save_file))
+
+
+DIALOG_BACKENDS = {
+    "osascript": OsascriptDialog,
+    "kivy": KivyFileDialog,
+    "stub": StubDialog,
+}
+
+
+def get_dialog(name=None):
+    """
+    Create the file dialog backend.
+
+    Args:
+    name(str): Name of the backend, SWING_DIALOG_BACKEND or the platform
+               default if None
+
+    Return:
+    FileDialog: Dialog backend
+    """
+    name = name or os.environ.get(DIALOG_BACKEND_ENV)
+    if not name:
+        name = "osascript" if platform.system() == "Darwin" else "kivy"
+    if name not in DIALOG_BACKENDS:
+        raise ValueError(
+            f"unknown dialog backend {name!r}, use one of {', '.join(DIALOG_BACKENDS)}"
+        )
+    return DIALOG_BACKENDS[name]()
@@ -0,0 +1,150 @@
+from dataclasses import asdict, dataclass
+from io import BytesIO
+
+# suffix of the output files of each format
+FORMAT_SUFFIXES = {
+    "JPEG": ".jpg",
+    "PNG": ".png",
+    "WEBP": ".webp",
+    "AVIF": ".avif",
+    "TIFF": ".tif",
+}
+JPEG_SUBSAMPLING = ("4:4:4", "4:2:2", "4:2:0")
+
+
+class EncoderError(ValueError):
+    """Raised when an encoder profile cannot be used."""
+
+
+@dataclass(frozen=True)
+class EncoderProfile:
+    """
+    How the built images are encoded.
+
+    Settings left to None use the PIL defaults, a profile without a format
+    keeps the format of the input file.
+    """
+
+    name: str
+    format: str | None = None
+    quality: int | None = None
+    subsampling: str | None = None
+    compress_level: int | None = None
+    optimize: bool = False
+    lossless: bool = False
+
+    def output_suffix(self, input_suffix):
+        """Returns the suffix of the output files of an input suffix."""
+        if self.format is None:
+            return input_suffix
+        return FORMAT_SUFFIXES[self.format]
+
+    def save_params(self, image_format):
+        """Returns the PIL save parameters of this profile for a format."""
+        params = {}
+        if image_format == "JPEG":
+            if self.quality is not None:
+                params["quality"] = self.quality
+            if self.subsampling is not None:
+                params["subsampling"] = self.subsampling
+            params["optimize"] = self.optimize
+        elif image_format == "PNG":
+            if self.compress_level is not None:
+                params["compress_level"] = self.compress_level
+            params["optimize"] = self.optimize
+        elif image_format in ("WEBP", "AVIF"):
+            if self.quality is not None:
+                params["quality"] = self.quality
+            if image_format == "WEBP":
+                params["lossless"] = self.lossless
+            elif self.lossless:
+                # AVIF has no lossless switch, full quality with 4:4:4 is the
+                # closest it gets
+                params.update(quality=100, subsampling="4:4:4")
+        return params
+
+    def to_dict(self):
+        """Returns the profile as a dict, e.g. for cache keys."""
+        return asdict(self)
+
+
+PROFILES = {
+    # PIL defaults in the input format, the original behavior
+    "default": EncoderProfile("default"),
+    # input format, cheap PNG compression
+    "fast": EncoderProfile("fast", compress_level=1, quality=90),
+    "jpeg": EncoderProfile(
+        "jpeg", format="JPEG", quality=90, subsampling="4:2:0", optimize=True
+    ),
+    "png": EncoderProfile("png", format="PNG", compress_level=6),
+    "png-small": EncoderProfile("png-small", format="PNG", optimize=True),
+    "webp": EncoderProfile("webp", format="WEBP", quality=85),
+    "webp-lossless": EncoderProfile("webp-lossless", format="WEBP", lossless=True),
+    "avif": EncoderProfile("avif", format="AVIF", quality=60),
+}
+DEFAULT_PROFILE = PROFILES["default"]
+
+
+def check_profile(profile: EncoderProfile):
+    """
+    Check that the installed PIL can write the format of a profile.
+
+    Args:
+    profile(EncoderProfile): Profile to check
+
+    Return:
+    None
+    """
+    if profile.format is None:
+        return
+    from PIL import Image
+
+    Image.init()
+    if profile.format not in Image.SAVE:
+        raise EncoderError(f"{profile.format} is not supported by this PIL build")
+    if profile.subsampling is not None and profile.subsampling not in JPEG_SUBSAMPLING:
+        raise EncoderError(f"subsampling must be one of {', '.join(JPEG_SUBSAMPLING)}")
+
+
+def available_profiles():
+    """
+    Get the profiles the installed PIL can write.
+
+    Args:
+    None
+
+    Return:
+    list: Names of the usable profiles
+    """
+    names = []
+    for name, profile in PROFILES.items():
+        try:
+            check_profile(profile)
+        except EncoderError:
+            continue
+        names.append(name)
+    return names
+
+
+def encode(image, output_suffix, profile: EncoderProfile = DEFAULT_PROFILE):
+    """
+    Encode an image in memory.
+
+    Args:
+    image(PIL.Image.Image): Image to encode
+    output_suffix(str): Suffix of the output file, gives the format
+    profile(EncoderProfile): Encoder settings
+
+    Return:
+    bytes: Encoded image
+    """
+    from PIL import Image
+
+    image_format = (
+        profile.format or Image.registered_extensions()[output_suffix.lower()]
+    )
+    if image_format == "JPEG" and image.mode not in ("RGB", "L", "CMYK"):
+        image = image.convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, **profile.save_params(image_format))
+    return buffer.getvalue()
@@ -0,0 +1,182 @@
+import math
+
+
+def fit_size(size: tuple[int, int], box: tuple[int, int]):
+    """
+    Get the size of an image scaled down to fit in a box, keeping its ratio.
+
+    Args:
+    size(tuple): (width, height) of the image
+    box(tuple): (width, height) of the box
+
+    Return:
+    tuple: (width, height) of the fitted image, never bigger than the image
+    """
+    width, height = size
+    scale = min(box[0] / width, box[1] / height, 1)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def reduce_image(img, box: tuple[int, int]):
+    """
+    Load an opened image at the smallest scale that still covers a box.
+
+    JPEG files are decoded with draft() directly at 1/2, 1/4 or 1/8 scale,
+    other formats are reduced by an integer factor right after decoding.
+
+    Args:
+    img(PIL.Image.Image): Opened image, not loaded yet
+    box(tuple): (width, height) the loaded image has to cover
+
+    Return:
+    PIL.Image.Image: Loaded image, at least as big as the fitted size
+    """
+    target = fit_size(img.size, box)
+    if img.format == "JPEG":
+        img.draft(img.mode if img.mode in ("RGB", "L") else "RGB", target)
+    img.load()
+    factor = min(img.width // target[0], img.height // target[1])
+    if factor > 1:
+        img = img.reduce(factor)
+    return img
+
+
+def open_reduced(path, box: tuple[int, int]):
+    """
+    Decode an image at the smallest scale that still covers a box.
+
+    Args:
+    path(str | file): Path or file object of the image
+    box(tuple): (width, height) the decoded image has to cover
+
+    Return:
+    PIL.Image.Image: Loaded image, at least as big as the fitted size
+    """
+    from PIL import Image
+
+    img = Image.open(path)
+    try:
+        reduced = reduce_image(img, box)
+    except Exception:
+        img.close()
+        raise
+    if reduced is not img:
+        # reduce() made a copy, the file is no longer needed
+        img.close()
+    return reduced
+
+
+def open_proxy(path, box: tuple[int, int]):
+    """
+    Decode a proxy of an image fitting in a box, e.g. the screen.
+
+    Args:
+    path(str | file): Path or file object of the image
+    box(tuple): (width, height) the proxy has to fit in
+
+    Return:
+    tuple: (proxy image, (width, height) of the source image)
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        source_size = img.size
+        proxy = reduce_image(img, box)
+        proxy.thumbnail(box)
+    return proxy, source_size
+
+
+def _restrict_tiles(img, region):
+    """
+    Keep only the tiles of an opened image that a region overlaps.
+
+    The image is shrunk to the bounding box of these tiles, so loading it only
+    reads and holds that part. Works for files made of several raw tiles or
+    strips, e.g. uncompressed TIFF, and leaves other files untouched.
+
+    Args:
+    img(PIL.Image.Image): Opened image, not loaded yet
+    region(tuple): (left, top, right, bottom) in source pixels
+
+    Return:
+    tuple: (left, top) of the kept box in source pixels
+    """
+    # tiles are (codec, (left, top, right, bottom), offset, args)
+    if len(img.tile) < 2 or any(tile[0] != "raw" for tile in img.tile):
+        return 0, 0
+    left, top, right, bottom = region
+    tiles = [
+        tile
+        for tile in img.tile
+        if tile[1][0] < right
+        and tile[1][2] > left
+        and tile[1][1] < bottom
+        and tile[1][3] > top
+    ]
+    box_left = min(tile[1][0] for tile in tiles)
+    box_top = min(tile[1][1] for tile in tiles)
+    box_right = max(tile[1][2] for tile in tiles)
+    box_bottom = max(tile[1][3] for tile in tiles)
+    # Pillow 11 wraps tiles in a named tuple its loader relies on
+    make_tile = getattr(type(img.tile[0]), "_make", tuple)
+    img.tile = [
+        make_tile(
+            (
+                codec,
+                (
+                    extents[0] - box_left,
+                    extents[1] - box_top,
+                    extents[2] - box_left,
+                    extents[3] - box_top,
+                ),
+                offset,
+                args,
+            )
+        )
+        for codec, extents, offset, args in tiles
+    ]
+    img._size = (box_right - box_left, box_bottom - box_top)
+    return box_left, box_top
+
+
+def decode_region(img, crop=None, min_side=None):
+    """
+    Load the crop of an opened image at the smallest scale that keeps its
+    short side at least min_side pixels long.
+
+    The crop is applied before decoding where the format allows it: raw tiled
+    or striped TIFF files only read the tiles under the crop, JPEG files are
+    decoded with draft() at 1/2, 1/4 or 1/8 scale. The rest is reduced by an
+    integer factor and cropped in one pass right after decoding.
+
+    Args:
+    img(PIL.Image.Image): Opened image, not loaded yet
+    crop(tuple): (left, top, right, bottom) in source pixels, None for all
+    min_side(int): Shortest allowed short side, None for the full resolution
+
+    Return:
+    PIL.Image.Image: Loaded image of the crop
+    """
+    width, height = img.size
+    left, top, right, bottom = crop or (0, 0, width, height)
+    short_side = min(right - left, bottom - top)
+    scale = min(min_side / short_side, 1) if min_side else 1
+    if img.format == "JPEG" and scale <= 0.5:
+        img.draft(img.mode, (math.ceil(width * scale), math.ceil(height * scale)))
+        ratio = img.width / width
+        left, top = math.floor(left * ratio), math.floor(top * ratio)
+        right = min(math.ceil(right * ratio), img.width)
+        bottom = min(math.ceil(bottom * ratio), img.height)
+    elif crop:
+        offset_x, offset_y = _restrict_tiles(img, (left, top, right, bottom))
+        left, right = left - offset_x, right - offset_x
+        top, bottom = top - offset_y, bottom - offset_y
+    img.load()
+    region = (left, top, right, bottom)
+    factor = int(min(right - left, bottom - top) / min_side) if min_side else 1
+    # palette, bilevel and 16 bit images cannot be reduced
+    if factor > 1 and img.mode not in ("1", "P", "I;16"):
+        return img.reduce(factor, box=region)
+    if region != (0, 0, img.width, img.height):
+        return img.crop(region)
+    return img
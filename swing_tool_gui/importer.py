@@ -0,0 +1,217 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Event, Thread
+
+from swing_tool_gui.scan_index import NOT_AN_IMAGE, read_image_info
+from swing_tool_gui.utils import sniff_image
+
+IMPORT_WORKERS = 8
+# files being verified at once, bounds the memory used by a huge tree
+MAX_PENDING_FILES = IMPORT_WORKERS * 16
+BATCH_INTERVAL = 0.25
+PROGRESS_INTERVAL = 0.1
+
+
+def iter_files(paths):
+    """
+    Iterate over the files of a selection, walking into folders.
+
+    Args:
+    paths(list): Selected files and folders
+
+    Return:
+    generator: Paths of the files, in sorted order within each folder
+    """
+    for path in paths:
+        path = str(path)
+        if os.path.isdir(path):
+            yield from _walk(path)
+        elif os.path.isfile(path):
+            yield path
+
+
+def _walk(folder):
+    """Yields the files below a folder, sorted by name within each folder."""
+    try:
+        with os.scandir(folder) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk(entry.path)
+            elif entry.is_file():
+                yield entry.path
+        except OSError:
+            continue
+
+
+class ImageImporter:
+    """
+    Finds the image files of a selection in the background.
+
+    Files are sniffed by their magic bytes while walking the folders, and the
+    candidates are fully verified in a thread pool. Verified images are
+    delivered in batches, in walk order, while the scan is still running.
+    With a scan index, files unchanged since an earlier import are known from
+    a stat call and only the others are checked and recorded. The ImageInfo
+    of every image found is kept in image_info. Callbacks are invoked from a
+    background thread.
+    """
+
+    def __init__(
+        self,
+        paths,
+        on_batch=None,
+        on_progress=None,
+        on_finish=None,
+        workers=IMPORT_WORKERS,
+        tracer=None,
+        scan_index=None,
+    ):
+        self.paths = list(paths)
+        self.on_batch = on_batch
+        self.on_progress = on_progress
+        self.on_finish = on_finish
+        self.workers = workers
+        self.tracer = tracer
+        self.scan_index = scan_index
+        self.scanned = 0
+        self.found = 0
+        # files known from the scan index, without being read
+        self.indexed = 0
+        # path: ImageInfo, of the images found
+        self.image_info = {}
+        self._cancel_event = Event()
+        self._thread = None
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def start(self):
+        """Starts scanning in the background."""
+        self._thread = Thread(target=self._run, name="image-importer", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """Stops scanning, the finish callback is not invoked."""
+        self._cancel_event.set()
+
+    def wait(self):
+        """Waits for the scan to finish."""
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        """Walks the selection and verifies the candidates in a thread pool."""
+        pending = deque()
+        batch = []
+        last_batch = last_progress = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="image-verify"
+            ) as executor:
+                for path in iter_files(self.paths):
+                    if self.cancelled:
+                        break
+                    self.scanned += 1
+                    future = self._check(path, executor)
+                    if future is not None:
+                        pending.append((path, future))
+                    # collect in walk order, blocking only when too many are
+                    # pending
+                    while pending and (
+                        pending[0][1].done() or len(pending) >= MAX_PENDING_FILES
+                    ):
+                        self._collect(pending.popleft(), batch)
+                    now = time.perf_counter()
+                    if batch and now - last_batch >= BATCH_INTERVAL:
+                        self._deliver(batch)
+                        batch = []
+                        last_batch = now
+                    if now - last_progress >= PROGRESS_INTERVAL:
+                        self._report_progress()
+                        last_progress = now
+                while pending and not self.cancelled:
+                    self._collect(pending.popleft(), batch)
+                if self.cancelled:
+                    executor.shutdown(wait=False, cancel_futures=True)
+        finally:
+            # a failed scan still ends with what it found, the screen waits
+            # for the finish callback
+            self._flush_index()
+            self._deliver(batch)
+            self._report_progress()
+            if self.on_finish and not self.cancelled:
+                self.on_finish(self.found)
+
+    def _check(self, path, executor):
+        """
+        Starts checking a file, from the scan index if it knows it.
+
+        Returns a future of the ImageInfo of the file, None if it is known not
+        to be an image.
+        """
+        stat = None
+        if self.scan_index is not None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            info = self.scan_index.lookup(path, stat)
+            if info is not None:
+                self.indexed += 1
+                if not info.valid:
+                    return None
+                future = Future()
+                future.set_result(info)
+                return future
+        if not sniff_image(path):
+            if stat is not None:
+                self.scan_index.put(path, stat, NOT_AN_IMAGE)
+            return None
+        return executor.submit(self._verify, path, stat)
+
+    def _verify(self, path, stat=None):
+        """Verifies a candidate file, recording the time taken if tracing."""
+        if self.tracer is None:
+            info = read_image_info(path)
+        else:
+            with self.tracer.span(path, "verify") as span:
+                span.bytes = os.path.getsize(path)
+                info = read_image_info(path)
+        if stat is not None:
+            self.scan_index.put(path, stat, info)
+        return info
+
+    def _collect(self, item, batch):
+        """Adds a verified file to the batch."""
+        path, future = item
+        try:
+            info = future.result()
+        except Exception:
+            # e.g. the file went away while it was verified
+            info = NOT_AN_IMAGE
+        if info.valid:
+            self.found += 1
+            self.image_info[path] = info
+            batch.append(path)
+
+    def _flush_index(self):
+        """Writes what the scan learned to the scan index."""
+        if self.scan_index is not None:
+            self.scan_index.flush()
+
+    def _deliver(self, batch):
+        """Sends a batch of verified images to the batch callback."""
+        if batch and self.on_batch and not self.cancelled:
+            self.on_batch(batch)
+
+    def _report_progress(self):
+        """Sends the scan counters to the progress callback."""
+        if self.on_progress and not self.cancelled:
+            self.on_progress(self.scanned, self.found)
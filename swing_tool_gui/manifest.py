@@ -0,0 +1,163 @@
+import csv
+import json
+from dataclasses import dataclass
+from pathlib import Path
+
+from swing_tool_gui.build import VARIANTS
+from swing_tool_gui.importer import ImageImporter
+from swing_tool_gui.scan_index import open_scan_index
+from swing_tool_gui.utils import default_title
+
+CROP_FIELDS = ("left", "top", "right", "bottom")
+
+
+class ManifestError(ValueError):
+    """Raised when a manifest cannot be read."""
+
+
+@dataclass
+class ManifestEntry:
+    """A file to build, with its title, optional crop rectangle and variants."""
+
+    file: str
+    title: str
+    crop: tuple[int, int, int, int] | None = None
+    # variants of this file, None for the variants of the whole build
+    variants: tuple[str, ...] | None = None
+
+    def to_dict(self):
+        """Returns the entry as a JSON-compatible dict."""
+        entry = {"file": self.file, "title": self.title}
+        if self.crop is not None:
+            entry["crop"] = list(self.crop)
+        if self.variants is not None:
+            entry["variants"] = list(self.variants)
+        return entry
+
+
+def _parse_crop(value, where):
+    """Parses a crop rectangle given as a list or a "l,t,r,b" string."""
+    if value in (None, "", []):
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    try:
+        crop = tuple(int(side) for side in value)
+    except (TypeError, ValueError):
+        raise ManifestError(f"{where}: invalid crop {value!r}") from None
+    if len(crop) != 4 or crop[0] >= crop[2] or crop[1] >= crop[3]:
+        raise ManifestError(f"{where}: crop must be left,top,right,bottom")
+    return crop
+
+
+def _parse_variants(value, where):
+    """Parses variants given as a list or a "normal,ig" string."""
+    if value in (None, "", []):
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    variants = tuple(str(variant).strip() for variant in value)
+    unknown = [variant for variant in variants if variant not in VARIANTS]
+    if unknown:
+        raise ManifestError(f"{where}: unknown variants {', '.join(unknown)}")
+    return variants
+
+
+def _make_entry(record, base_dir, where):
+    """Makes an entry from a manifest record, resolving relative paths."""
+    if not isinstance(record, dict):
+        raise ManifestError(f"{where}: expected an object, not {record!r}")
+    file = record.get("file")
+    if not file:
+        raise ManifestError(f"{where}: missing file")
+    file_path = Path(file).expanduser()
+    if not file_path.is_absolute():
+        file_path = base_dir / file_path
+    crop = record.get("crop")
+    if crop is None and any(record.get(field) for field in CROP_FIELDS):
+        crop = [record.get(field) for field in CROP_FIELDS]
+    return ManifestEntry(
+        file=str(file_path),
+        title=record.get("title") or default_title(str(file_path)),
+        crop=_parse_crop(crop, where),
+        variants=_parse_variants(record.get("variants"), where),
+    )
+
+
+def load_manifest(manifest_path):
+    """
+    Load the entries of a JSON or CSV manifest.
+
+    JSON manifests are a list of {"file", "title", "crop", "variants"}
+    objects, or an object with such a list under "entries". CSV manifests
+    have a file and a title column, either a crop column ("l,t,r,b") or left,
+    top, right and bottom columns, and an optional variants column
+    ("normal,ig"). Relative paths are relative to the manifest.
+
+    Args:
+    manifest_path(str): Path to the manifest
+
+    Return:
+    list: ManifestEntry of each file
+    """
+    manifest_path = Path(manifest_path)
+    base_dir = manifest_path.parent
+    try:
+        if manifest_path.suffix.lower() == ".csv":
+            with open(manifest_path, newline="", encoding="utf-8-sig") as file:
+                records = list(csv.DictReader(file))
+        else:
+            with open(manifest_path, encoding="utf-8") as file:
+                records = json.load(file)
+            if isinstance(records, dict):
+                records = records.get("entries", [])
+    except (OSError, ValueError) as error:
+        raise ManifestError(f"{manifest_path}: {error}") from None
+    if not isinstance(records, list):
+        raise ManifestError(f"{manifest_path}: expected a list of entries")
+    return [
+        _make_entry(record, base_dir, f"{manifest_path} entry {index + 1}")
+        for index, record in enumerate(records)
+    ]
+
+
+def save_manifest(manifest_path, entries):
+    """
+    Save entries as a JSON manifest.
+
+    Args:
+    manifest_path(str): Path to the manifest
+    entries(list): ManifestEntry of each file
+
+    Return:
+    None
+    """
+    with open(manifest_path, "w", encoding="utf-8") as file:
+        json.dump(
+            {"entries": [entry.to_dict() for entry in entries]},
+            file,
+            ensure_ascii=False,
+            indent=2,
+        )
+
+
+def scan_directory(directory):
+    """
+    Make entries for the images below a directory, titled by file name.
+
+    Args:
+    directory(str): Path to the directory
+
+    Return:
+    list: ManifestEntry of each image, in walk order
+    """
+    image_paths = []
+    scan_index = open_scan_index()
+    importer = ImageImporter(
+        [directory], on_batch=image_paths.extend, scan_index=scan_index
+    )
+    importer.start()
+    importer.wait()
+    if scan_index is not None:
+        scan_index.close()
+    return [ManifestEntry(file=path, title=default_title(path)) for path in image_paths]
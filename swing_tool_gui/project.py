@@ -0,0 +1,287 @@
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from threading import Event, Thread
+
+from swing_tool_gui.build import DEFAULT_VARIANTS
+from swing_tool_gui.utils import default_title, verify_image
+
+PROJECT_SUFFIX = ".swingproj"
+PROJECT_FORMAT_VERSION = 1
+BATCH_INTERVAL = 0.25
+PROGRESS_INTERVAL = 0.1
+
+
+class ProjectError(ValueError):
+    """Raised when a project file cannot be read."""
+
+
+@dataclass
+class ProjectSettings:
+    """Output settings of a project, stored in the first line of its file."""
+
+    output_dir: str = ""
+    variants: tuple[str, ...] = DEFAULT_VARIANTS
+    encoder_profile: str = "default"
+    use_suggested_crops: bool = False
+    force_rebuild: bool = False
+    # smaller copies of the outputs, as parse_derivatives() reads them
+    derivatives: str = ""
+
+    @classmethod
+    def from_dict(cls, data):
+        """Makes settings from a header, ignoring unknown keys."""
+        settings = cls()
+        for name in asdict(settings):
+            if name in data:
+                setattr(settings, name, data[name])
+        settings.variants = tuple(settings.variants)
+        return settings
+
+
+@dataclass
+class ProjectEntry:
+    """A file of a project, with its identity when the project was saved."""
+
+    file: str
+    size: int
+    mtime_ns: int
+    title: str
+    crop: tuple[int, int, int, int] | None = None
+    suggested_crop: tuple[int, int, int, int] | None = None
+    valid: bool = True
+    # set when loading: the file differs from the one saved
+    changed: bool = field(default=False, compare=False)
+
+    @classmethod
+    def from_file(cls, file, title=None, crop=None, suggested_crop=None):
+        """Makes an entry of an existing file, reading its identity."""
+        stat = os.stat(file)
+        return cls(
+            file=str(file),
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            title=default_title(file) if title is None else title,
+            crop=crop,
+            suggested_crop=suggested_crop,
+        )
+
+    def to_record(self):
+        """Returns the entry as a compact JSON-compatible list."""
+        return [
+            self.file,
+            self.size,
+            self.mtime_ns,
+            self.title,
+            list(self.crop) if self.crop else None,
+            list(self.suggested_crop) if self.suggested_crop else None,
+            self.valid,
+        ]
+
+    @classmethod
+    def from_record(cls, record):
+        """Makes an entry from a list written by to_record()."""
+        file, size, mtime_ns, title, crop, suggested_crop, valid = record
+        return cls(
+            file=file,
+            size=size,
+            mtime_ns=mtime_ns,
+            title=title,
+            crop=tuple(crop) if crop else None,
+            suggested_crop=tuple(suggested_crop) if suggested_crop else None,
+            valid=valid,
+        )
+
+
+def save_project(project_path, settings, entries):
+    """
+    Save a project as JSON lines, the settings first and then every file.
+
+    Args:
+    project_path(str): Path to the project file
+    settings(ProjectSettings): Output settings
+    entries(list): ProjectEntry of each file
+
+    Return:
+    None
+    """
+    header = {"format": PROJECT_FORMAT_VERSION, **asdict(settings)}
+    temp_path = f"{project_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        file.write(json.dumps(header, ensure_ascii=False) + "\n")
+        for entry in entries:
+            file.write(json.dumps(entry.to_record(), ensure_ascii=False) + "\n")
+    os.replace(temp_path, project_path)
+
+
+def read_project_settings(project_path):
+    """
+    Read the settings of a project, without reading its files.
+
+    Args:
+    project_path(str): Path to the project file
+
+    Return:
+    ProjectSettings: Output settings of the project
+    """
+    try:
+        with open(project_path, encoding="utf-8") as file:
+            header = json.loads(file.readline())
+    except (OSError, ValueError) as error:
+        raise ProjectError(f"{project_path}: {error}") from None
+    if not isinstance(header, dict) or header.get("format") != PROJECT_FORMAT_VERSION:
+        raise ProjectError(f"{project_path}: not a project file")
+    return ProjectSettings.from_dict(header)
+
+
+def check_entry(entry):
+    """
+    Check an entry against its file with a stat, verifying it only if changed.
+
+    A changed file keeps its crops while they still fit in the image.
+
+    Args:
+    entry(ProjectEntry): Entry to check, updated in place
+
+    Return:
+    bool: Whether the file still exists
+    """
+    try:
+        stat = os.stat(entry.file)
+    except OSError:
+        return False
+    if (stat.st_size, stat.st_mtime_ns) == (entry.size, entry.mtime_ns):
+        return True
+    entry.size, entry.mtime_ns = stat.st_size, stat.st_mtime_ns
+    entry.changed = True
+    entry.valid = verify_image(entry.file)
+    if entry.valid:
+        from PIL import Image
+
+        try:
+            with Image.open(entry.file) as img:
+                width, height = img.size
+        except Exception:
+            entry.valid = False
+            return True
+        for name in ("crop", "suggested_crop"):
+            crop = getattr(entry, name)
+            if crop and (crop[2] > width or crop[3] > height):
+                setattr(entry, name, None)
+    return True
+
+
+class ProjectLoader:
+    """
+    Reads the files of a project in the background.
+
+    Every file is checked with a stat only, and verified again only if it
+    changed since the project was saved. Valid files are delivered in batches,
+    in project order, like an ImageImporter delivers new files. Callbacks are
+    invoked from a background thread.
+    """
+
+    def __init__(self, project_path, on_batch=None, on_progress=None, on_finish=None):
+        self.project_path = str(project_path)
+        self.on_batch = on_batch
+        self.on_progress = on_progress
+        self.on_finish = on_finish
+        self.scanned = 0
+        self.found = 0
+        self.changed = []
+        self.missing = []
+        self.error = None
+        self._cancel_event = Event()
+        self._thread = None
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def start(self):
+        """Starts loading in the background."""
+        self._thread = Thread(target=self._run, name="project-loader", daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        """Stops loading, the finish callback is not invoked."""
+        self._cancel_event.set()
+
+    def wait(self):
+        """Waits for the load to finish."""
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        """Reads the file lines and checks each file."""
+        batch = []
+        last_batch = last_progress = time.perf_counter()
+        try:
+            with open(self.project_path, encoding="utf-8") as file:
+                # the settings were read when opening the project
+                file.readline()
+                for line in file:
+                    if self.cancelled:
+                        return
+                    if not line.strip():
+                        continue
+                    self.scanned += 1
+                    self._collect(ProjectEntry.from_record(json.loads(line)), batch)
+                    now = time.perf_counter()
+                    if batch and now - last_batch >= BATCH_INTERVAL:
+                        self._deliver(batch)
+                        batch = []
+                        last_batch = now
+                    if now - last_progress >= PROGRESS_INTERVAL:
+                        self._report_progress()
+                        last_progress = now
+        except (OSError, ValueError, TypeError) as error:
+            self.error = f"{self.project_path}: {error}"
+        finally:
+            # the screen waits for the finish callback, even after a failure
+            self._deliver(batch)
+            self._report_progress()
+            if self.on_finish and not self.cancelled:
+                self.on_finish(self.found)
+
+    def _collect(self, entry, batch):
+        """Checks an entry and adds it to the batch if it is a valid image."""
+        if not check_entry(entry):
+            self.missing.append(entry.file)
+            return
+        if entry.changed:
+            self.changed.append(entry.file)
+        if entry.valid:
+            self.found += 1
+            batch.append(entry)
+
+    def _deliver(self, batch):
+        """Sends a batch of entries to the batch callback."""
+        if batch and self.on_batch and not self.cancelled:
+            self.on_batch(batch)
+
+    def _report_progress(self):
+        """Sends the counters to the progress callback."""
+        if self.on_progress and not self.cancelled:
+            self.on_progress(self.scanned, self.found)
+
+
+def load_project(project_path):
+    """
+    Load the settings and the valid files of a project.
+
+    Args:
+    project_path(str): Path to the project file
+
+    Return:
+    tuple: (ProjectSettings, list of ProjectEntry)
+    """
+    settings = read_project_settings(project_path)
+    entries = []
+    loader = ProjectLoader(project_path, on_batch=entries.extend)
+    loader.start()
+    loader.wait()
+    if loader.error:
+        raise ProjectError(loader.error)
+    return settings, entries
@@ -0,0 +1,226 @@
+import os
+import sqlite3
+from dataclasses import dataclass
+from threading import Lock
+
+from swing_tool_gui.utils import user_cache_dir
+
+SCAN_INDEX_FILE_NAME = "scan_index.sqlite3"
+# stored as the user_version of the database, an index of another version is
+# rebuilt from scratch
+SCAN_INDEX_VERSION = 1
+EXIF_ORIENTATION = 0x0112
+# rows written in one transaction
+FLUSH_ROWS = 500
+
+
+@dataclass(frozen=True)
+class ImageInfo:
+    """What a scan learns about a file, enough to list it without opening it."""
+
+    valid: bool
+    format: str | None = None
+    width: int = 0
+    height: int = 0
+    # EXIF orientation, 1 when the stored pixels are upright
+    orientation: int = 1
+
+    @property
+    def size(self):
+        """(width, height) of the stored pixels, as crops are given in."""
+        return self.width, self.height
+
+
+NOT_AN_IMAGE = ImageInfo(valid=False)
+
+
+def _read_orientation(img):
+    """Returns the EXIF orientation of an opened image, without decoding it."""
+    # a PNG without an eXIf chunk before its data would be decoded to look
+    # for one after it
+    if img.format == "PNG" and "exif" not in img.info:
+        return 1
+    try:
+        return int(img.getexif().get(EXIF_ORIENTATION, 1))
+    except Exception:
+        return 1
+
+
+def read_image_info(file_path: str):
+    """
+    Verify an image with PIL and read its format, size and orientation.
+
+    Args:
+    file_path(str): Path to the file
+
+    Return:
+    ImageInfo: Info of a valid image, NOT_AN_IMAGE otherwise
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(file_path) as img:
+            info = ImageInfo(
+                valid=True,
+                format=img.format,
+                width=img.width,
+                height=img.height,
+                orientation=_read_orientation(img),
+            )
+            img.verify()
+    except Exception:
+        # not only OSError, e.g. DecompressionBombError for a huge image
+        return NOT_AN_IMAGE
+    return info
+
+
+class ScanIndex:
+    """
+    SQLite record of the files earlier imports checked.
+
+    Every file is keyed by its path, size, mtime and inode, so a file that is
+    unchanged since it was checked is known from a stat call alone. Writes are
+    buffered and committed in batches. The index can be shared by threads.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = Lock()
+        self._pending = []
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        try:
+            self._prepare()
+        except sqlite3.Error:
+            self._connection.close()
+            raise
+
+    def _prepare(self):
+        """Creates the table, dropping an index of another version."""
+        connection = self._connection
+        # several app instances may import at once
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        (version,) = connection.execute("PRAGMA user_version").fetchone()
+        if version != SCAN_INDEX_VERSION:
+            connection.execute("DROP TABLE IF EXISTS files")
+            connection.execute(f"PRAGMA user_version={SCAN_INDEX_VERSION}")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER, mtime_ns INTEGER, inode INTEGER,"
+            " valid INTEGER, format TEXT, width INTEGER, height INTEGER,"
+            " orientation INTEGER)"
+        )
+        connection.commit()
+
+    def lookup(self, file_path, stat):
+        """
+        Get what is known about a file, if it did not change since.
+
+        Args:
+        file_path(str): Path to the file
+        stat(os.stat_result): Current stat of the file
+
+        Return:
+        ImageInfo: Recorded info, None if the file is unknown or changed
+        """
+        try:
+            with self._lock:
+                row = self._connection.execute(
+                    "SELECT size, mtime_ns, inode, valid, format, width, height,"
+                    " orientation FROM files WHERE path = ?",
+                    (file_path,),
+                ).fetchone()
+        except sqlite3.Error:
+            # e.g. locked by another instance for too long, check the file
+            return None
+        if row is None or tuple(row[:3]) != (
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ino,
+        ):
+            return None
+        valid, image_format, width, height, orientation = row[3:]
+        if not valid:
+            return NOT_AN_IMAGE
+        return ImageInfo(True, image_format, width, height, orientation)
+
+    def get(self, file_path):
+        """Returns the recorded info of a file after a stat, None if unknown."""
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return self.lookup(str(file_path), stat)
+
+    def put(self, file_path, stat, info: ImageInfo):
+        """Records what a check found about a file, written on the next flush."""
+        with self._lock:
+            self._pending.append(
+                (
+                    file_path,
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    stat.st_ino,
+                    info.valid,
+                    info.format,
+                    info.width,
+                    info.height,
+                    info.orientation,
+                )
+            )
+            full = len(self._pending) >= FLUSH_ROWS
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered records in one transaction."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return
+            try:
+                with self._connection:
+                    self._connection.executemany(
+                        "INSERT OR REPLACE INTO files"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        pending,
+                    )
+            except sqlite3.Error:
+                # a lost write only costs checking the files again next time
+                pass
+
+    def close(self):
+        """Writes the buffered records and closes the database."""
+        try:
+            self.flush()
+        finally:
+            self._connection.close()
+
+
+def open_scan_index(path=None):
+    """
+    Open the scan index, in the user cache directory by default.
+
+    Args:
+    path(str): Path to the database, optional
+
+    Return:
+    ScanIndex: Opened index, None if it cannot be used, imports then check
+               every file again
+    """
+    path = path or user_cache_dir() / SCAN_INDEX_FILE_NAME
+    try:
+        return ScanIndex(path)
+    except sqlite3.OperationalError:
+        # e.g. locked by a stuck process or on a read-only disk
+        return None
+    except sqlite3.DatabaseError:
+        # not a database, e.g. a file cut short, start over
+        try:
+            os.remove(path)
+            return ScanIndex(path)
+        except (OSError, sqlite3.Error):
+            return None
+    except OSError:
+        return None
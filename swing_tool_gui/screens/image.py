@@ -1,37 +1,105 @@
-import os
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-
-from kivy.clock import Clock
-from kivy.core.image import Image as CoreImage
-from kivy.graphics import Color, Line
+from threading import Thread
+
+from kivy.clock import Clock, mainthread
+from kivy.core.window import Window
+from kivy.graphics import Color, Line, Rectangle
+from kivy.graphics.texture import Texture
+from kivy.logger import Logger
+from kivy.metrics import dp
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
+from kivy.uix.checkbox import CheckBox
 from kivy.uix.floatlayout import FloatLayout
-from kivy.uix.gridlayout import GridLayout
 from kivy.uix.image import Image
 from kivy.uix.label import Label
 from kivy.uix.popup import Popup
+from kivy.uix.progressbar import ProgressBar
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivy.uix.screenmanager import Screen
-from kivy.uix.scrollview import ScrollView
+from kivy.uix.spinner import Spinner
 from kivy.uix.textinput import TextInput
 from kivy.uix.widget import Widget
-from PIL import Image as PILImage
-from swing_tool.modules.image import SwingImageBuilder
 
+from swing_tool_gui.autocrop import AutoCropper
+from swing_tool_gui.build import (
+    DEFAULT_VARIANTS,
+    VARIANTS,
+    BatchBuilder,
+    BuildTask,
+    state_dir,
+)
+from swing_tool_gui.build_cache import BuildCache
+from swing_tool_gui.dedupe import DuplicateDetector
+from swing_tool_gui.derivatives import parse_derivatives
+from swing_tool_gui.dialogs import get_dialog
+from swing_tool_gui.encoders import PROFILES, available_profiles
+from swing_tool_gui.imaging import open_proxy
+from swing_tool_gui.importer import ImageImporter
+from swing_tool_gui.project import (
+    PROJECT_SUFFIX,
+    ProjectEntry,
+    ProjectError,
+    ProjectLoader,
+    ProjectSettings,
+    read_project_settings,
+    save_project,
+)
+from swing_tool_gui.scan_index import open_scan_index
+from swing_tool_gui.session import SessionStore, image_bytes
+from swing_tool_gui.thumbnails import THUMBNAIL_SIZE, ThumbnailCache
+from swing_tool_gui.tracing import Tracer, format_summary
 from swing_tool_gui.utils import (
-    AppleScriptExecutor,
-    apple_alias_to_posix_path,
+    crop_box_to_source_rect,
+    default_title,
+    format_duration,
     get_image_display_area,
-    is_image_file,
+    source_rect_to_crop_box,
 )
+from swing_tool_gui.workqueue import JobMonitor, JobQueue
 
 # Constants
 BUTTON_HEIGHT = "40dp"
 LABEL_HEIGHT = "30dp"
 WIDGET_PADDING = 10
 SCROLL_VIEW_HEIGHT = "400dp"
+IMAGE_ROW_HEIGHT = "342dp"
 MIN_CROP_SIZE = 10
+# side of the crop box corner handles, and how far from a corner they react
+CROP_HANDLE_SIZE = 12
+CROP_HANDLE_REACH = 16
+MAX_LISTED_FAILURES = 10
+MAX_LISTED_GROUPS = 10
+# name of the trace of the import and crop stages, saved next to the build one
+IMPORT_TRACE_NAME = "import"
+
+
+def texture_from_image(image):
+    """
+    Create a texture from a PIL image without encoding it.
+
+    Args:
+    image(PIL.Image.Image): Image to upload
+
+    Return:
+    Texture: Texture holding the pixels of the image
+    """
+    colorfmt = "rgba" if image.mode in ("RGBA", "LA", "PA") else "rgb"
+    image = image.convert(colorfmt.upper())
+    texture = Texture.create(size=image.size, colorfmt=colorfmt)
+    texture.blit_buffer(image.tobytes(), colorfmt=colorfmt, bufferfmt="ubyte")
+    # PIL rows go top to bottom, texture rows bottom to top
+    texture.flip_vertical()
+    return texture
+
+
+def texture_bytes(texture):
+    """Returns the GPU memory held by a texture."""
+    width, height = texture.size
+    return width * height * len(texture.colorfmt)
 
 
 class ImageImportScreen(Screen):
@@ -48,7 +116,14 @@ class ImageImportScreen(Screen):
         )
         self.label.bind(on_touch_down=self._on_label_click)
         self.layout.add_widget(self.label)
+        open_project_button = Button(
+            text="Open project", size_hint_y=None, height=BUTTON_HEIGHT
+        )
+        open_project_button.bind(on_press=self._open_project_selection)
+        self.layout.add_widget(open_project_button)
         self.add_widget(self.layout)
+        self.dialog = get_dialog()
+        self.dialog_open = False
 
     def _on_label_click(self, instance, touch):
         """Handles label click to open file selection dialog."""
@@ -56,31 +131,42 @@ class ImageImportScreen(Screen):
             self._open_file_selection()
 
     def _open_file_selection(self):
-        """Opens the file selection dialog using AppleScript."""
-        script = (
-            "osascript -e 'set theFiles to choose file with prompt "
-            '"Select files or folder:" of type {"public.folder", "public.item"} '
-            "with multiple selections allowed'"
+        """Opens the file selection dialog, the UI keeps running meanwhile."""
+        if self.dialog_open:
+            return
+        self.dialog_open = True
+        self.dialog.choose_files(
+            "Select files or folder:", self._process_selected_files
         )
-        try:
-            output = AppleScriptExecutor.run_script(script)
-        except RuntimeError:
-            pass
-        else:
-            self._process_selected_files(output)
 
-    def _process_selected_files(self, output):
+    def _process_selected_files(self, posix_paths):
         """Processes selected files and folders."""
-        posix_paths = [
-            apple_alias_to_posix_path(alias_path)
-            for alias_path in output.strip().split(b", ")
-        ]
-
-        if len(posix_paths) == 1 and Path(posix_paths[0]).is_dir():
-            posix_paths = list(Path(posix_paths[0]).rglob("*"))
+        self.dialog_open = False
+        if not posix_paths:
+            return
+        self.manager.get_screen("image_process_screen").import_files(posix_paths)
+        self.manager.current = "image_process_screen"
 
-        image_paths = [path for path in posix_paths if is_image_file(path)]
-        self.manager.get_screen("image_process_screen").set_input_files(image_paths)
+    def _open_project_selection(self, instance):
+        """Opens the file selection dialog for a project file."""
+        if self.dialog_open:
+            return
+        self.dialog_open = True
+        self.dialog.choose_files("Select a project:", self._process_selected_project)
+
+    def _process_selected_project(self, posix_paths):
+        """Opens the first selected project file."""
+        self.dialog_open = False
+        project_paths = [path for path in posix_paths if path.endswith(PROJECT_SUFFIX)]
+        if not project_paths:
+            return
+        try:
+            self.manager.get_screen("image_process_screen").open_project(
+                project_paths[0]
+            )
+        except ProjectError as error:
+            self.label.text = f"Cannot open the project.\n{error}"
+            return
         self.manager.current = "image_process_screen"
 
 
@@ -90,30 +176,304 @@ class ImageProcessScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.input_files = []
-        self.cropped_images = {}
-        self.file_rows = []
+        self.rows = []
         self.layout = BoxLayout(
             orientation="vertical", padding=WIDGET_PADDING, spacing=WIDGET_PADDING
         )
-        self.current_image_path = None
+        self.current_index = None
+        self.batch_builder = None
+        self.progress_popup = None
+        self.job_monitor = None
+        self.selected_variants = list(DEFAULT_VARIANTS)
+        self.force_rebuild = False
+        # build the rows without a crop with their suggested crop
+        self.use_suggested_crops = False
+        self.encoder_profile = "default"
+        # smaller copies of the outputs, as typed and as parsed
+        self.derivatives_text = ""
+        self.derivatives = ()
+        self.derivatives_error = None
+        # file the list is saved to
+        self.project_path = None
+        # shown next to the number of files, e.g. what changed since the save
+        self.files_note = ""
+        self.dialog = get_dialog()
+        self.thumbnails = ThumbnailCache()
+        # what earlier imports found about the files, None if unusable
+        self.scan_index = open_scan_index()
+        # decoded proxies, crop previews and their textures, within a budget
+        self.session = SessionStore(on_change=lambda session: self._update_gauge())
+        self._update_gauge = Clock.create_trigger(self._update_memory_gauge)
+        self.memory_gauge = None
+        self.importer = None
+        # spans of the import and crop stages since the last build, saved next
+        # to the trace of the next one, every build records its own
+        self.tracer = Tracer()
+        self.autocropper = AutoCropper(tracer=self.tracer)
+        self.duplicates = DuplicateDetector(tracer=self.tracer)
+        self.duplicates_button = None
         self.add_widget(self.layout)
 
     def set_input_files(self, input_files):
         """Sets the input files and rebuilds the UI."""
-        self.input_files = input_files
+        self.input_files = list(input_files)
+        self.rows = [self._make_row(file) for file in self.input_files]
+        self.session.clear()
+        # drop the suggestions still pending for the previous files
+        self.autocropper.shutdown()
+        self.autocropper = AutoCropper(tracer=self.tracer)
+        self.duplicates.shutdown()
+        self.duplicates = DuplicateDetector(tracer=self.tracer)
+        self._request_suggested_crops(self.rows)
+        self._request_duplicate_checks(self.rows)
         self._build_ui()
         self._update_start_button_state()
 
-    def update_cropped_image(self, image_data):
-        """Updates the cropped image in the UI."""
-        core_image = CoreImage(image_data, ext="png")
-        for index, file_row in enumerate(self.file_rows):
-            img_widget = file_row.children[1]
-            if img_widget.file_path == self.current_image_path:
-                img_widget.texture = core_image.texture
-                img_widget.canvas.ask_update()
-                self.cropped_images[index] = image_data
-                break
+    def add_input_files(self, input_files, image_info=None):
+        """
+        Appends input files to the list without rebuilding the UI.
+
+        image_info maps files to their ImageInfo, known when they are imported.
+        """
+        image_info = image_info or {}
+        self._add_rows(
+            [self._make_row(file, image_info.get(file)) for file in input_files]
+        )
+
+    def _add_rows(self, rows):
+        """Appends rows to the list, suggesting the crops they do not have."""
+        self.input_files.extend(row["file_path"] for row in rows)
+        self.rows.extend(rows)
+        self._request_suggested_crops(
+            [row for row in rows if row["suggested_crop"] is None]
+        )
+        self._request_duplicate_checks(rows)
+        self._update_files_label()
+
+    def _request_suggested_crops(self, rows):
+        """Suggests the crops of new rows in the background."""
+        for row in rows:
+            self.autocropper.request(
+                row["file_path"],
+                lambda path, crop, row=row: self._set_suggested_crop(row, crop),
+            )
+
+    @mainthread
+    def _set_suggested_crop(self, row, crop):
+        """Stores the suggested crop of a row."""
+        row["suggested_crop"] = crop
+
+    def _request_duplicate_checks(self, rows):
+        """Hashes new rows in the background, grouping their near-duplicates."""
+        detector = self.duplicates
+        for row in rows:
+            detector.request(
+                row["file_path"],
+                lambda path, duplicate: self._on_duplicate_checked(detector, duplicate),
+            )
+
+    def _on_duplicate_checked(self, detector, duplicate):
+        """Called from a worker thread once a row is hashed."""
+        if duplicate:
+            self._on_duplicate_found(detector)
+
+    @mainthread
+    def _on_duplicate_found(self, detector):
+        """Shows the new number of duplicates."""
+        if detector is self.duplicates:
+            self._update_duplicates_button()
+
+    def collapse_duplicates(self):
+        """
+        Keeps one row of every group of near-duplicates.
+
+        The first row of a group is kept, or its first cropped row if the first
+        one has no crop. Returns the number of rows dropped.
+        """
+        group_of = {
+            path: index
+            for index, group in enumerate(self.duplicates.groups())
+            for path in group
+        }
+        kept = {}
+        for row in self.rows:
+            key = group_of.get(row["file_path"], row["file_path"])
+            if key not in kept or (kept[key]["crop"] is None and row["crop"]):
+                kept[key] = row
+        kept_ids = {id(row) for row in kept.values()}
+        kept_paths = {row["file_path"] for row in kept.values()}
+        dropped_paths = {
+            row["file_path"] for row in self.rows if id(row) not in kept_ids
+        } - kept_paths
+        dropped = len(self.rows) - len(kept_ids)
+        self.image_list.data = [row for row in self.rows if id(row) in kept_ids]
+        self.rows = self.image_list.data
+        self.input_files = [row["file_path"] for row in self.rows]
+        self.current_index = None
+        self.duplicates.remove(dropped_paths)
+        for path in dropped_paths:
+            self.session.discard(("preview", path))
+            self.session.discard(("texture", path))
+        self._update_duplicates_button()
+        return dropped
+
+    def import_files(self, paths):
+        """Imports the images of a selection, filling the list as they are found."""
+        self._cancel_import()
+        self.project_path = None
+        self.files_note = ""
+        self.set_input_files([])
+        self.tracer.clear()
+        importer = ImageImporter(paths, tracer=self.tracer, scan_index=self.scan_index)
+        importer.on_batch = lambda batch: self._on_import_batch(importer, batch)
+        importer.on_progress = lambda scanned, found: self._on_import_progress(importer)
+        importer.on_finish = lambda found: self._on_import_finish(importer, found)
+        self.importer = importer
+        self._update_files_label()
+        self._update_start_button_state()
+        importer.start()
+
+    def open_project(self, project_path):
+        """
+        Opens a saved project, filling the list as its files are checked.
+
+        The output settings are restored at once, the files are then read in
+        the background and only the ones changed since the save are verified.
+        Raises ProjectError if the file is not a project.
+        """
+        settings = read_project_settings(project_path)
+        self._cancel_import()
+        self.project_path = str(project_path)
+        self.files_note = ""
+        self.selected_variants = [
+            variant for variant in settings.variants if variant in VARIANTS
+        ]
+        if settings.encoder_profile in PROFILES:
+            self.encoder_profile = settings.encoder_profile
+        self.use_suggested_crops = settings.use_suggested_crops
+        self.force_rebuild = settings.force_rebuild
+        self._set_derivatives(settings.derivatives)
+        self.set_input_files([])
+        self.save_path_input.text = settings.output_dir
+        self.tracer.clear()
+        loader = ProjectLoader(project_path)
+        loader.on_batch = lambda batch: self._on_project_batch(loader, batch)
+        loader.on_progress = lambda scanned, found: self._on_import_progress(loader)
+        loader.on_finish = lambda found: self._on_project_finish(loader, found)
+        self.importer = loader
+        self._update_files_label()
+        self._update_start_button_state()
+        loader.start()
+
+    def save_project_file(self, project_path):
+        """Saves the files, titles, crops and output settings to a project."""
+        entries = []
+        for row in self.rows:
+            try:
+                entries.append(
+                    ProjectEntry.from_file(
+                        row["file_path"],
+                        row["title"],
+                        row["crop"],
+                        row["suggested_crop"],
+                    )
+                )
+            except OSError:
+                # the file is gone, it would be dropped when opening anyway
+                continue
+        settings = ProjectSettings(
+            output_dir=self.save_path_input.text.strip(),
+            variants=tuple(
+                variant for variant in VARIANTS if variant in self.selected_variants
+            ),
+            encoder_profile=self.encoder_profile,
+            use_suggested_crops=self.use_suggested_crops,
+            force_rebuild=self.force_rebuild,
+            derivatives=self.derivatives_text,
+        )
+        save_project(project_path, settings, entries)
+        self.project_path = str(project_path)
+
+    def autosave_project(self):
+        """Saves the opened or saved project again, e.g. when the app closes."""
+        if self.project_path is None or self.importer is not None:
+            return
+        try:
+            self.save_project_file(self.project_path)
+        except OSError as error:
+            Logger.error(f"Project: cannot save {self.project_path}: {error}")
+
+    def update_cropped_image(self, crop, preview):
+        """
+        Stores the crop of the current image and shows its preview.
+
+        The crop is a (left, top, right, bottom) rectangle in source pixels,
+        it is applied when building. The preview is a PIL image kept in the
+        session store.
+        """
+        if self.current_index is None:
+            return
+        row = self.rows[self.current_index]
+        row["crop"] = crop
+        self.session.discard(("texture", row["file_path"]))
+        self.session.put(
+            ("preview", row["file_path"]),
+            "preview",
+            preview,
+            image_bytes(preview),
+            spillable=True,
+        )
+        self.image_list.refresh_from_data()
+
+    def preview_texture(self, row):
+        """Returns the texture of the crop preview of a row, None if it has none."""
+        if row["crop"] is None:
+            return None
+        texture = self.session.get(("texture", row["file_path"]))
+        if texture is None:
+            preview = self.session.get(("preview", row["file_path"]))
+            if preview is None:
+                return None
+            texture = texture_from_image(preview)
+            self.session.put(
+                ("texture", row["file_path"]),
+                "texture",
+                texture,
+                texture_bytes(texture),
+            )
+        return texture
+
+    def open_crop_screen(self, index):
+        """Opens the crop screen for the row at the given index."""
+        self.current_index = index
+        neighbors = [
+            self.rows[neighbor]["file_path"]
+            for neighbor in (index + 1, index - 1)
+            if 0 <= neighbor < len(self.rows)
+        ]
+        row = self.rows[index]
+        if row["source_size"] is None and self.scan_index is not None:
+            # e.g. a row of a project, known to the index if imported before
+            info = self.scan_index.get(row["file_path"])
+            if info is not None and info.valid:
+                row["source_size"] = info.size
+        self.manager.get_screen("image_crop_screen").display_image(
+            row["file_path"],
+            neighbors,
+            row["crop"] or row["suggested_crop"],
+            row["source_size"],
+        )
+        self.manager.current = "image_crop_screen"
+
+    def request_thumbnail(self, row):
+        """Requests the thumbnail of a row once, when it is first displayed."""
+        if row["thumbnail_requested"]:
+            return
+        row["thumbnail_requested"] = True
+        self.thumbnails.request(
+            row["file_path"],
+            lambda path, thumbnail: self._set_thumbnail(row, thumbnail),
+        )
 
     def _build_ui(self):
         """Builds the UI layout for the screen."""
@@ -126,7 +486,9 @@ class ImageProcessScreen(Screen):
         """Adds the row with Back and Start buttons."""
         button_layout = BoxLayout(size_hint_y=None, height=BUTTON_HEIGHT)
         button_layout.add_widget(self._build_back_button())
-        button_layout.add_widget(Label())  # Spacer
+        button_layout.add_widget(self._build_memory_gauge())
+        button_layout.add_widget(self._build_save_button())
+        button_layout.add_widget(self._build_submit_button())
         button_layout.add_widget(self._build_start_button())
         self.layout.add_widget(button_layout)
 
@@ -138,6 +500,42 @@ class ImageProcessScreen(Screen):
         back_button.bind(on_press=self._go_back)
         return back_button
 
+    def _build_memory_gauge(self):
+        """Builds the gauge showing the memory used by the session."""
+        gauge_layout = BoxLayout(padding=(WIDGET_PADDING, 0), spacing=WIDGET_PADDING)
+        self.memory_label = Label(size_hint_x=None, width="220dp")
+        self.memory_gauge = ProgressBar(max=self.session.budget)
+        gauge_layout.add_widget(self.memory_label)
+        gauge_layout.add_widget(self.memory_gauge)
+        self._update_memory_gauge()
+        return gauge_layout
+
+    def _update_memory_gauge(self, *args):
+        """Shows the current memory usage of the session."""
+        if self.memory_gauge is None:
+            return
+        megabyte = 1024 * 1024
+        self.memory_gauge.value = min(self.session.used, self.session.budget)
+        text = (
+            f"Memory {self.session.used / megabyte:.0f}"
+            f" / {self.session.budget / megabyte:.0f} MB"
+        )
+        if self.session.spilled:
+            text += f", {self.session.spilled / megabyte:.0f} MB on disk"
+        self.memory_label.text = text
+
+    def _build_save_button(self):
+        """Builds the Save button writing the project file."""
+        self.save_button = Button(text="Save", size_hint_x=None, width="80dp")
+        self.save_button.bind(on_press=self._save_project)
+        return self.save_button
+
+    def _build_submit_button(self):
+        """Builds the Submit button, queueing the build for worker hosts."""
+        self.submit_button = Button(text="Submit", size_hint_x=None, width="80dp")
+        self.submit_button.bind(on_press=self._submit_job)
+        return self.submit_button
+
     def _build_start_button(self):
         """Builds the Start button."""
         self.start_button = Button(
@@ -155,7 +553,7 @@ class ImageProcessScreen(Screen):
         output_dir_layout = BoxLayout(
             orientation="vertical",
             size_hint_y=None,
-            height="80dp",
+            height="160dp",
             padding=(48, 0, 0, 0),
         )
         save_to_label = Label(
@@ -177,230 +575,857 @@ class ImageProcessScreen(Screen):
         save_layout.add_widget(choose_button)
 
         output_dir_layout.add_widget(save_layout)
+        output_dir_layout.add_widget(self._build_variant_options())
+        output_dir_layout.add_widget(self._build_derivative_options())
         return output_dir_layout
 
-    def _build_image_row(self, file):
-        """Builds a single row for displaying an image and its filename."""
-        file_row = BoxLayout(size_hint_y=None, height="342dp")
-        img = Image(source=file, size_hint_x=0.5, allow_stretch=True, keep_ratio=True)
-        img.bind(on_touch_down=self._on_image_click)
-        img.file_path = file
-        filename = os.path.splitext(os.path.basename(file))[0]
-        text_input = TextInput(text=filename, multiline=False, size_hint_x=0.5)
-        file_row.add_widget(img)
-        file_row.add_widget(text_input)
-        return file_row
-
-    def _on_image_click(self, instance, touch):
-        """Handles image click to initiate cropping."""
-        if instance.collide_point(*touch.pos):
-            self.current_image_path = instance.file_path
-            self.manager.get_screen("image_crop_screen").display_image(
-                self.current_image_path
+    def _build_variant_options(self):
+        """Builds the checkboxes choosing which variants to build."""
+        variants_layout = BoxLayout(size_hint_y=None, height=BUTTON_HEIGHT)
+        for variant in VARIANTS:
+            checkbox = CheckBox(
+                active=variant in self.selected_variants,
+                size_hint_x=None,
+                width="40dp",
             )
-            self.manager.current = "image_crop_screen"
+            checkbox.variant = variant
+            checkbox.bind(active=self._on_variant_toggle)
+            variant_label = Label(
+                text=variant.upper() if variant == "ig" else variant.capitalize(),
+                size_hint_x=None,
+                width="80dp",
+                halign="left",
+                valign="middle",
+            )
+            variant_label.bind(size=variant_label.setter("text_size"))
+            variants_layout.add_widget(checkbox)
+            variants_layout.add_widget(variant_label)
+        force_checkbox = CheckBox(
+            active=self.force_rebuild, size_hint_x=None, width="40dp"
+        )
+        force_checkbox.bind(active=self._on_force_rebuild_toggle)
+        force_label = Label(
+            text="Force rebuild",
+            size_hint_x=None,
+            width="120dp",
+            halign="left",
+            valign="middle",
+        )
+        force_label.bind(size=force_label.setter("text_size"))
+        variants_layout.add_widget(force_checkbox)
+        variants_layout.add_widget(force_label)
+        auto_crop_checkbox = CheckBox(
+            active=self.use_suggested_crops, size_hint_x=None, width="40dp"
+        )
+        auto_crop_checkbox.bind(active=self._on_auto_crop_toggle)
+        auto_crop_label = Label(
+            text="Auto crop",
+            size_hint_x=None,
+            width="100dp",
+            halign="left",
+            valign="middle",
+        )
+        auto_crop_label.bind(size=auto_crop_label.setter("text_size"))
+        variants_layout.add_widget(auto_crop_checkbox)
+        variants_layout.add_widget(auto_crop_label)
+        variants_layout.add_widget(Label())  # Spacer
+        profile_label = Label(text="Encoder", size_hint_x=None, width="80dp")
+        profile_spinner = Spinner(
+            text=self.encoder_profile,
+            values=available_profiles(),
+            size_hint_x=None,
+            width="160dp",
+        )
+        profile_spinner.bind(text=self._on_encoder_profile_select)
+        variants_layout.add_widget(profile_label)
+        variants_layout.add_widget(profile_spinner)
+        return variants_layout
+
+    def _build_derivative_options(self):
+        """Builds the input of the smaller copies saved with the outputs."""
+        derivatives_layout = BoxLayout(size_hint_y=None, height=BUTTON_HEIGHT)
+        sizes_label = Label(
+            text="Sizes",
+            size_hint_x=None,
+            width="120dp",
+            halign="left",
+            valign="middle",
+        )
+        sizes_label.bind(size=sizes_label.setter("text_size"))
+        self.derivatives_input = TextInput(
+            text=self.derivatives_text,
+            hint_text="name:size[:encoder[:variants]], e.g. web:2048, thumb:320:webp",
+            multiline=False,
+        )
+        self.derivatives_input.bind(text=self._on_derivatives_change)
+        self.derivatives_error_label = Label(
+            color=(0.9, 0.2, 0.2, 1), halign="left", valign="middle"
+        )
+        self.derivatives_error_label.bind(
+            size=self.derivatives_error_label.setter("text_size")
+        )
+        self._show_derivatives_error()
+        derivatives_layout.add_widget(sizes_label)
+        derivatives_layout.add_widget(self.derivatives_input)
+        derivatives_layout.add_widget(self.derivatives_error_label)
+        return derivatives_layout
+
+    def _set_derivatives(self, text):
+        """Parses the smaller copies to save, keeping the error if invalid."""
+        self.derivatives_text = text
+        try:
+            self.derivatives = parse_derivatives(text)
+            self.derivatives_error = None
+        except ValueError as error:
+            self.derivatives = ()
+            self.derivatives_error = str(error)
+
+    def _on_derivatives_change(self, instance, text):
+        """Sets the smaller copies to save as they are typed."""
+        self._set_derivatives(text)
+        self._show_derivatives_error()
+        self._update_start_button_state()
+
+    def _show_derivatives_error(self):
+        """Shows why the sizes input is invalid, if it is."""
+        self.derivatives_error_label.text = self.derivatives_error or ""
+
+    def _on_encoder_profile_select(self, spinner, name):
+        """Sets the encoder profile of the outputs."""
+        self.encoder_profile = name
+
+    def _on_auto_crop_toggle(self, checkbox, active):
+        """Sets whether rows without a crop are built with their suggestion."""
+        self.use_suggested_crops = active
+
+    def _on_force_rebuild_toggle(self, checkbox, active):
+        """Sets whether up-to-date outputs are built again."""
+        self.force_rebuild = active
+
+    def _on_variant_toggle(self, checkbox, active):
+        """Adds or removes a variant from the ones to build."""
+        if active and checkbox.variant not in self.selected_variants:
+            self.selected_variants.append(checkbox.variant)
+        elif not active and checkbox.variant in self.selected_variants:
+            self.selected_variants.remove(checkbox.variant)
+        self._update_start_button_state()
+
+    def _cancel_import(self):
+        """Stops the running import, if any."""
+        if self.importer is not None:
+            self.importer.cancel()
+            self.importer = None
+
+    @mainthread
+    def _on_import_batch(self, importer, batch):
+        """Adds a batch of imported images to the list."""
+        if importer is self.importer:
+            self.add_input_files(batch, importer.image_info)
+
+    @mainthread
+    def _on_import_progress(self, importer):
+        """Updates the scan counter."""
+        if importer is self.importer:
+            self._update_files_label()
+
+    @mainthread
+    def _on_project_batch(self, loader, entries):
+        """Adds a batch of project files to the list."""
+        if loader is not self.importer:
+            return
+        rows = []
+        for entry in entries:
+            row = self._make_row(entry.file)
+            row["title"] = entry.title
+            row["crop"] = entry.crop
+            row["suggested_crop"] = entry.suggested_crop
+            rows.append(row)
+        self._add_rows(rows)
+
+    @mainthread
+    def _on_project_finish(self, loader, found):
+        """Ends loading a project, noting the files changed since its save."""
+        if loader is not self.importer:
+            return
+        notes = []
+        if loader.changed:
+            notes.append(f"{len(loader.changed)} changed")
+        if loader.missing:
+            notes.append(f"{len(loader.missing)} missing")
+        if notes:
+            self.files_note = f"{', '.join(notes)} since saved"
+        if loader.error:
+            Logger.error(f"Project: {loader.error}")
+            self.files_note = "project file damaged, some files not loaded"
+        self._finish_import(found)
+
+    @mainthread
+    def _on_import_finish(self, importer, found):
+        """Ends the import, going back if no image was found."""
+        if importer is self.importer:
+            self._finish_import(found)
+
+    def _finish_import(self, found):
+        """Ends the running import or project load."""
+        self.importer = None
+        self._update_duplicates_button()
+        self._update_files_label()
+        self._update_start_button_state()
+        if not found:
+            self.manager.current = "image_import_screen"
+
+    def _update_files_label(self):
+        """Updates the files label with the number of files and scan progress."""
+        text = f"Files ({len(self.rows)})"
+        if self.importer is not None:
+            text += f" - scanning, {self.importer.scanned} files checked"
+        elif self.files_note:
+            text += f" - {self.files_note}"
+        self.files_label.text = text
+
+    @staticmethod
+    def _make_row(file, info=None):
+        """Makes the data model of a single file row, with its ImageInfo."""
+        return {
+            "file_path": str(file),
+            "title": default_title(file),
+            "crop": None,
+            "suggested_crop": None,
+            # (width, height) of the source, None until known
+            "source_size": info.size if info is not None else None,
+            "thumbnail": None,
+            "thumbnail_requested": False,
+        }
+
+    @mainthread
+    def _set_thumbnail(self, row, thumbnail):
+        """Stores the thumbnail of a row and refreshes the visible rows."""
+        if thumbnail is None:
+            return
+        row["thumbnail"] = thumbnail
+        self._refresh_image_list()
 
     def _build_image_rows(self):
-        """Builds the layout for displaying all selected images."""
+        """Builds the recycled list displaying all selected images."""
         image_rows_layout = BoxLayout(orientation="vertical", padding=(48, 0, 0, 0))
 
-        files_label = Label(
-            text="Files",
+        self.files_label = Label(
+            text=f"Files ({len(self.rows)})",
             size_hint_y=None,
             height=LABEL_HEIGHT,
             halign="left",
             valign="middle",
         )
-        files_label.bind(size=files_label.setter("text_size"))
-        image_rows_layout.add_widget(files_label)
-
-        files_grid_layout = GridLayout(cols=1, spacing=10, size_hint_y=None)
-        files_grid_layout.bind(minimum_height=files_grid_layout.setter("height"))
+        self.files_label.bind(size=self.files_label.setter("text_size"))
+        self.duplicates_button = Button(
+            size_hint_x=None, width="220dp", background_color=(0, 0, 0, 0)
+        )
+        self.duplicates_button.bind(on_press=self._show_duplicates_popup)
+        self._update_duplicates_button()
+        files_header = BoxLayout(size_hint_y=None, height=LABEL_HEIGHT)
+        files_header.add_widget(self.files_label)
+        files_header.add_widget(self.duplicates_button)
+        image_rows_layout.add_widget(files_header)
+
+        self.image_list = RecycleView(size_hint=(1, None), height=SCROLL_VIEW_HEIGHT)
+        self.image_list.screen = self
+        rows_layout = RecycleBoxLayout(
+            orientation="vertical",
+            spacing=10,
+            size_hint_y=None,
+            default_size=(None, IMAGE_ROW_HEIGHT),
+            default_size_hint=(1, None),
+        )
+        rows_layout.bind(minimum_height=rows_layout.setter("height"))
+        self.image_list.add_widget(rows_layout)
+        # the view class is held by the layout, set it once the layout is added
+        self.image_list.viewclass = ImageRow
+        self.image_list.data = self.rows
+        # keep the model and the view data the same list, so appending rows
+        # while importing updates the view
+        self.rows = self.image_list.data
+        self._refresh_image_list = Clock.create_trigger(
+            lambda dt: self.image_list.refresh_from_data()
+        )
+        image_rows_layout.add_widget(self.image_list)
+        return image_rows_layout
 
-        for file in self.input_files:
-            file_row = self._build_image_row(file)
-            files_grid_layout.add_widget(file_row)
-            self.file_rows.append(file_row)
+    def _update_duplicates_button(self):
+        """Shows the number of duplicates on the collapse button."""
+        if self.duplicates_button is None:
+            return
+        count = self.duplicates.duplicate_count
+        self.duplicates_button.text = f"Collapse duplicates ({count})"
+        self.duplicates_button.disabled = not count
+
+    def _show_duplicates_popup(self, instance):
+        """Lists the groups of near-duplicates before collapsing them."""
+        groups = self.duplicates.groups()
+        lines = []
+        for group in groups[:MAX_LISTED_GROUPS]:
+            names = [Path(path).name for path in group]
+            lines.append(f"{names[0]}: {', '.join(names[1:])}")
+        if len(groups) > MAX_LISTED_GROUPS:
+            lines.append(f"... and {len(groups) - MAX_LISTED_GROUPS} more groups")
+        if not groups:
+            lines.append("Some files are listed more than once.")
+        layout = BoxLayout(
+            orientation="vertical", padding=WIDGET_PADDING, spacing=WIDGET_PADDING
+        )
+        message_label = Label(text="\n".join(lines), halign="left", valign="top")
+        message_label.bind(size=message_label.setter("text_size"))
+        layout.add_widget(message_label)
+        buttons = BoxLayout(size_hint_y=None, height=BUTTON_HEIGHT)
+        cancel_button = Button(text="Cancel")
+        collapse_button = Button(text="Keep one of each")
+        buttons.add_widget(cancel_button)
+        buttons.add_widget(collapse_button)
+        layout.add_widget(buttons)
+        popup = Popup(
+            title="Near-duplicate images", content=layout, size_hint=(0.6, 0.5)
+        )
+        cancel_button.bind(on_press=lambda instance: popup.dismiss())
+        collapse_button.bind(
+            on_press=lambda instance: self._on_collapse_duplicates(popup)
+        )
+        popup.open()
 
-        scroll_view = ScrollView(size_hint=(1, None), height=SCROLL_VIEW_HEIGHT)
-        scroll_view.add_widget(files_grid_layout)
-        image_rows_layout.add_widget(scroll_view)
-        return image_rows_layout
+    def _on_collapse_duplicates(self, popup):
+        """Collapses the duplicates and notes how many rows were dropped."""
+        popup.dismiss()
+        dropped = self.collapse_duplicates()
+        self.files_note = f"{dropped} duplicates collapsed"
+        self._update_files_label()
+        self._update_start_button_state()
 
     def _go_back(self, instance):
         """Navigates back to the image import screen."""
+        self._cancel_import()
         self.manager.current = "image_import_screen"
 
     def _open_file_browser(self, instance):
         """Opens a file browser to select the output directory."""
-        script = (
-            "osascript -e 'set theFolder to choose folder "
-            'with prompt "Select Save Directory"\' '
-            "-e 'POSIX path of theFolder'"
+        instance.disabled = True
+        self.dialog.choose_folder(
+            "Select Save Directory",
+            lambda folder: self._on_output_folder_selected(instance, folder),
         )
-        selected_path = AppleScriptExecutor.run_script(script)
-        self.save_path_input.text = selected_path
+
+    def _on_output_folder_selected(self, button, folder):
+        """Sets the output directory chosen in the file browser."""
+        button.disabled = False
+        if folder:
+            self.save_path_input.text = folder
         self._update_start_button_state()
 
+    def _save_project(self, instance):
+        """Saves the project, asking for a file the first time."""
+        if self.project_path is not None:
+            self._on_project_file_selected(self.project_path)
+            return
+        instance.disabled = True
+        self.dialog.choose_save_file(
+            "Save Project", f"project{PROJECT_SUFFIX}", self._on_project_file_selected
+        )
+
+    def _on_project_file_selected(self, project_path):
+        """Writes the project file chosen in the save dialog."""
+        self._update_start_button_state()
+        if not project_path:
+            return
+        if not project_path.endswith(PROJECT_SUFFIX):
+            project_path += PROJECT_SUFFIX
+        try:
+            self.save_project_file(project_path)
+        except OSError as error:
+            self.files_note = f"cannot save the project: {error}"
+        else:
+            self.files_note = f"saved to {Path(project_path).name}"
+        self._update_files_label()
+
     def _update_start_button_state(self, *args):
-        """Enables or disables the Start button based on input."""
-        self.start_button.disabled = not bool(self.save_path_input.text)
+        """Enables or disables the Start and Save buttons based on input."""
+        self.start_button.disabled = not (
+            self.save_path_input.text
+            and self.selected_variants
+            and self.rows
+            and self.importer is None
+            and self.derivatives_error is None
+        )
+        self.save_button.disabled = not self.rows or self.importer is not None
+        self.submit_button.disabled = self.start_button.disabled
+
+    def _make_tasks(self, output_dir):
+        """Makes the build tasks of the rows with the selected settings."""
+        return [
+            BuildTask(
+                index=index,
+                input_file=row["file_path"],
+                title=row["title"],
+                output_dir=str(output_dir),
+                crop=row["crop"]
+                or (row["suggested_crop"] if self.use_suggested_crops else None),
+                variants=tuple(
+                    variant for variant in VARIANTS if variant in self.selected_variants
+                ),
+                encoder=PROFILES[self.encoder_profile],
+                derivatives=self.derivatives,
+            )
+            for index, row in enumerate(self.rows)
+        ]
 
     def _start(self, instance):
-        """Starts the image processing."""
-        swing_image_builder = SwingImageBuilder()
-        for index, input_file in enumerate(self.input_files):
-            image = swing_image_builder.build(
-                self.cropped_images.get(index, input_file),
-                self.file_rows[index].children[0].text,
-            )
-            image_ig = swing_image_builder.build(
-                self.cropped_images.get(index, input_file),
-                self.file_rows[index].children[0].text,
-                True,
+        """Starts building the images in the background."""
+        output_dir = Path(self.save_path_input.text.strip())
+        tasks = self._make_tasks(output_dir)
+        self.start_button.disabled = True
+        self.batch_builder = BatchBuilder(
+            tasks,
+            on_progress=self._on_build_progress,
+            on_finish=self._on_build_finish,
+            cache=BuildCache(state_dir(output_dir)),
+            force=self.force_rebuild,
+        )
+        self._show_progress_popup(len(tasks))
+        self.batch_builder.start()
+
+    def _submit_job(self, instance):
+        """Writes the build as a sharded job for workers on any host."""
+        output_dir = Path(self.save_path_input.text.strip())
+        tasks = self._make_tasks(output_dir)
+        encoder = PROFILES[self.encoder_profile]
+        self.submit_button.disabled = True
+
+        def write_job():
+            # many shard files on a shared filesystem, keep them off the UI
+            try:
+                queue = JobQueue.submit(
+                    tasks, output_dir, encoder, derivatives=self.derivatives
+                )
+            except OSError as error:
+                self._on_job_submitted(None, error)
+            else:
+                self._on_job_submitted(queue, None)
+
+        Thread(target=write_job, name="job-submit", daemon=True).start()
+
+    @mainthread
+    def _on_job_submitted(self, queue, error):
+        """Shows the progress of a submitted job."""
+        self._update_start_button_state()
+        if queue is None:
+            self.files_note = f"cannot submit the job: {error}"
+            self._update_files_label()
+            return
+        layout = BoxLayout(
+            orientation="vertical", padding=WIDGET_PADDING, spacing=WIDGET_PADDING
+        )
+        command_input = TextInput(
+            text=f"python -m swing_tool_gui.cli worker {queue.job_dir}",
+            readonly=True,
+            multiline=False,
+            size_hint_y=None,
+            height=BUTTON_HEIGHT,
+        )
+        progress_bar = ProgressBar(max=max(queue.job["files"], 1), value=0)
+        status_label = Label(text="Waiting for workers...")
+        status_label.bind(size=status_label.setter("text_size"))
+        close_button = Button(text="Close", size_hint_y=None, height=BUTTON_HEIGHT)
+        layout.add_widget(Label(text="Start workers on any host with:"))
+        layout.add_widget(command_input)
+        layout.add_widget(progress_bar)
+        layout.add_widget(status_label)
+        layout.add_widget(close_button)
+        popup = Popup(
+            title=f"Job {queue.job['id']}",
+            content=layout,
+            size_hint=(0.7, 0.5),
+            auto_dismiss=False,
+        )
+
+        @mainthread
+        def on_progress(progress):
+            progress_bar.value = progress.built + progress.errors
+            status_label.text = (
+                f"{progress.built} built, {progress.errors} failed"
+                f" of {progress.files} files\n"
+                f"Shards: {progress.done} done, {progress.leased} building,"
+                f" {progress.pending} pending, {progress.failed} given up\n"
+                f"Workers: {len(progress.workers)}"
             )
-            image.save(
-                Path(self.save_path_input.text.strip())
-                / f"{Path(input_file).stem}_new{Path(input_file).suffix}"
+            if progress.finished:
+                popup.title = f"Job {queue.job['id']} finished"
+
+        def close(instance):
+            # the workers go on, the job can be followed with the status command
+            self.job_monitor.stop()
+            self.job_monitor = None
+            popup.dismiss()
+
+        close_button.bind(on_press=close)
+        self.job_monitor = JobMonitor(queue, on_progress)
+        self.job_monitor.start()
+        popup.open()
+
+    def _show_progress_popup(self, total):
+        """Displays the build progress popup with a Cancel button."""
+        layout = BoxLayout(
+            orientation="vertical", padding=WIDGET_PADDING, spacing=WIDGET_PADDING
+        )
+        self.progress_bar = ProgressBar(max=max(total, 1), value=0)
+        self.progress_label = Label(text=f"0 / {total}")
+        self.progress_error_label = Label(text="", color=(1, 0.4, 0.4, 1), shorten=True)
+        self.progress_error_label.bind(
+            size=self.progress_error_label.setter("text_size")
+        )
+        cancel_button = Button(text="Cancel", size_hint_y=None, height=BUTTON_HEIGHT)
+        cancel_button.bind(on_press=self._cancel_build)
+        layout.add_widget(self.progress_bar)
+        layout.add_widget(self.progress_label)
+        layout.add_widget(self.progress_error_label)
+        layout.add_widget(cancel_button)
+        self.progress_popup = Popup(
+            title="Building",
+            content=layout,
+            size_hint=(0.6, 0.4),
+            auto_dismiss=False,
+        )
+        self.progress_popup.open()
+
+    def _cancel_build(self, instance):
+        """Cancels the running build, files already started are finished."""
+        if self.batch_builder is not None:
+            self.batch_builder.cancel()
+        instance.disabled = True
+        instance.text = "Cancelling..."
+
+    @mainthread
+    def _on_build_progress(self, progress):
+        """Updates the progress popup after a file is built."""
+        self.progress_bar.value = progress.done
+        eta = "" if progress.eta is None else f" - {format_duration(progress.eta)} left"
+        self.progress_label.text = (
+            f"{progress.done} / {progress.total}" f" ({progress.failed} failed){eta}"
+        )
+        if not progress.last.ok:
+            self.progress_error_label.text = (
+                f"{Path(progress.last.input_file).name}: {progress.last.error}"
             )
-            image_ig.save(
-                Path(self.save_path_input.text.strip())
-                / f"{Path(input_file).stem}_new_ig{Path(input_file).suffix}"
+
+    @mainthread
+    def _on_build_finish(self, summary):
+        """Closes the progress popup, saves the trace and displays the summary."""
+        tracer = self.batch_builder.tracer
+        self.batch_builder = None
+        directory = state_dir(self.save_path_input.text.strip())
+        try:
+            summary.trace_paths = tracer.export(directory)
+        except OSError:
+            summary.trace_paths = None
+        import_lines = self._export_import_trace(directory)
+        if self.progress_popup is not None:
+            self.progress_popup.dismiss()
+            self.progress_popup = None
+        self._update_start_button_state()
+        self._show_summary_popup(summary, tracer, import_lines)
+
+    def _export_import_trace(self, directory):
+        """
+        Saves the spans of the import and crop stages since the last build.
+
+        The spans are dropped once saved, so the tracer does not grow for the
+        whole session. Returns the lines summarising them.
+        """
+        if not self.tracer.spans:
+            return []
+        lines = [
+            f"Import and crops: {line}"
+            for line in format_summary(self.tracer.summary(top=0))
+        ]
+        try:
+            jsonl_path, chrome_path = self.tracer.export(
+                directory, name=IMPORT_TRACE_NAME
             )
-        self._show_success_popup()
+            lines.append(f"Import trace saved to {chrome_path}")
+        except OSError:
+            pass
+        finally:
+            self.tracer.clear()
+        return lines
 
-    def _show_success_popup(self):
-        """Displays a success message popup."""
+    def _show_summary_popup(self, summary, tracer, import_lines=()):
+        """Displays a summary of the succeeded and failed files of a build."""
         layout = BoxLayout(
             orientation="vertical", padding=WIDGET_PADDING, spacing=WIDGET_PADDING
         )
-        message_label = Label(text="Images built successfully!")
+        lines = [
+            f"{len(summary.succeeded)} succeeded, {len(summary.failed)} failed"
+            f" in {format_duration(summary.elapsed)}"
+        ]
+        if summary.cache_hits:
+            lines.append(
+                f"{summary.cache_hits} outputs up to date,"
+                f" {summary.cache_misses} built"
+            )
+        if summary.cancelled:
+            lines.append(
+                f"Cancelled, {summary.total - len(summary.results)} files skipped"
+            )
+        for result in summary.failed[:MAX_LISTED_FAILURES]:
+            lines.append(f"{Path(result.input_file).name}: {result.error}")
+        if len(summary.failed) > MAX_LISTED_FAILURES:
+            lines.append(f"... and {len(summary.failed) - MAX_LISTED_FAILURES} more")
+        lines.extend(format_summary(tracer.summary()))
+        if summary.trace_paths:
+            lines.append(f"Trace saved to {summary.trace_paths[1]}")
+        lines.extend(import_lines)
+        message_label = Label(text="\n".join(lines), halign="left", valign="top")
+        message_label.bind(size=message_label.setter("text_size"))
         layout.add_widget(message_label)
         ok_button = Button(text="OK", size_hint_y=None, height=BUTTON_HEIGHT)
         layout.add_widget(ok_button)
-        popup = Popup(title="Success", content=layout, size_hint=(0.5, 0.3))
-        ok_button.bind(on_press=lambda instance: self._on_success_ok(popup))
+        title = "Success" if not summary.failed and not summary.cancelled else "Done"
+        popup = Popup(title=title, content=layout, size_hint=(0.6, 0.5))
+        ok_button.bind(on_press=lambda instance: self._on_summary_ok(popup, summary))
         popup.open()
 
-    def _on_success_ok(self, popup):
-        """Handles the OK button click in the success popup."""
+    def _on_summary_ok(self, popup, summary):
+        """Handles the OK button click in the summary popup."""
         popup.dismiss()
-        self.manager.current = "image_import_screen"
+        if not summary.failed and not summary.cancelled:
+            self.manager.current = "image_import_screen"
+
+
+class ImageRow(RecycleDataViewBehavior, BoxLayout):
+    """Recycled row of the file list, showing an image and its title."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.index = None
+        self.row = None
+        self.screen = None
+        self.image = Image(size_hint_x=0.5, allow_stretch=True, keep_ratio=True)
+        self.image.bind(on_touch_down=self._on_image_click)
+        self.text_input = TextInput(multiline=False, size_hint_x=0.5)
+        self.text_input.bind(text=self._on_title_change)
+        self.add_widget(self.image)
+        self.add_widget(self.text_input)
+
+    def refresh_view_attrs(self, rv, index, data):
+        """Shows the row at the given index of the data model."""
+        self.index = index
+        self.row = data
+        self.screen = rv.screen
+        self.text_input.text = data["title"]
+        texture = self.screen.preview_texture(data)
+        if texture is not None:
+            self.image.source = ""
+            self.image.texture = texture
+        else:
+            self.image.source = data["thumbnail"] or ""
+            if not data["thumbnail"]:
+                self.image.texture = None
+                self.screen.request_thumbnail(data)
+
+    def _on_title_change(self, instance, text):
+        """Writes the edited title back to the data model."""
+        if self.row is not None:
+            self.row["title"] = text
+
+    def _on_image_click(self, instance, touch):
+        """Handles image click to initiate cropping."""
+        if instance.collide_point(*touch.pos) and self.screen is not None:
+            self.screen.open_crop_screen(self.index)
+            return True
+        return False
 
 
 class CropBox(Widget):
-    """Widget representing a resizable and draggable crop box."""
+    """
+    Widget representing a resizable and draggable square crop box.
+
+    Drag the box with the left button to move it. Drag a corner handle, or drag
+    vertically with the right button, to resize it. Touch moves are applied
+    once per frame with the latest touch position. The display area of the
+    image is set by the crop screen when the image geometry changes.
+    """
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.size_hint = (None, None)
         self.size = (0, 0)
-        self.dragging = False
-        self.resizing = False
-        self.drag_offset_x = 0
-        self.drag_offset_y = 0
-        self.start_drag_y = 0
+        # (x, y, width, height) of the displayed image, the box stays inside
+        self.display_area = None
+        # "drag", "corner" or "scale" while a touch moves the box
+        self.mode = None
+        self.pending_pos = None
+        self.drag_offset = (0, 0)
+        # corner opposite to the dragged one, and the direction of the drag
+        self.anchor = (0, 0)
+        self.direction = (1, 1)
+        self.start_y = 0
+        self.start_side = 0
+        self.start_center = (0, 0)
 
         with self.canvas:
             Color(1, 0, 0, 1)
             self.rect = Line(width=2)
+            self.handles = [
+                Rectangle(size=(dp(CROP_HANDLE_SIZE), dp(CROP_HANDLE_SIZE)))
+                for _ in range(4)
+            ]
 
-        self.bind(pos=self.update_position)
-        self.bind(size=self.update_position)
+        self._apply_move = Clock.create_trigger(self._apply_pending_move)
+        self._redraw = Clock.create_trigger(self.update_position)
+        self.bind(pos=self._redraw)
+        self.bind(size=self._redraw)
 
     def update_position(self, *args):
-        """Updates the position of the crop box."""
+        """Updates the position of the crop box and its handles."""
         self.rect.rectangle = (self.x, self.y, self.width, self.height)
+        half = dp(CROP_HANDLE_SIZE) / 2
+        for handle, (x, y) in zip(self.handles, self._corners()):
+            handle.pos = (x - half, y - half)
         self.canvas.ask_update()
 
+    def _corners(self):
+        """Returns the corners of the box."""
+        return [
+            (self.x, self.y),
+            (self.right, self.y),
+            (self.x, self.top),
+            (self.right, self.top),
+        ]
+
+    def _corner_at(self, x, y):
+        """Returns the corner within reach of a point, None if there is none."""
+        reach = dp(CROP_HANDLE_REACH)
+        for corner_x, corner_y in self._corners():
+            if abs(x - corner_x) <= reach and abs(y - corner_y) <= reach:
+                return corner_x, corner_y
+        return None
+
     def on_touch_down(self, touch):
         """Handles touch down events for dragging and resizing."""
-        if self.collide_point(*touch.pos):
-            if touch.button == "left":
-                self._start_dragging(touch)
-                return True
-            elif touch.button == "right":
-                self._start_resizing(touch)
-                return True
-        return super().on_touch_down(touch)
+        if self.display_area is None or not self.width:
+            return super().on_touch_down(touch)
+        button = getattr(touch, "button", "left")
+        corner = self._corner_at(*touch.pos) if button == "left" else None
+        if corner is not None:
+            self._start_corner_resizing(corner)
+        elif not self.collide_point(*touch.pos):
+            return super().on_touch_down(touch)
+        elif button == "left":
+            self._start_dragging(touch)
+        elif button == "right":
+            self._start_resizing(touch)
+        else:
+            return super().on_touch_down(touch)
+        touch.grab(self)
+        return True
 
     def on_touch_move(self, touch):
-        """Handles touch move events for dragging and resizing."""
-        if touch.button == "left" and self.dragging:
-            self._drag(touch)
-            return True
-        elif touch.button == "right" and self.resizing:
-            self._resize(touch)
+        """Queues the touch position, applied once on the next frame."""
+        if touch.grab_current is self:
+            self.pending_pos = touch.pos
+            self._apply_move()
             return True
         return super().on_touch_move(touch)
 
     def on_touch_up(self, touch):
         """Handles touch up events to end dragging and resizing."""
-        if touch.button == "left" and self.dragging:
-            self.dragging = False
-            return True
-        elif touch.button == "right" and self.resizing:
-            self.resizing = False
+        if touch.grab_current is self:
+            touch.ungrab(self)
+            self.pending_pos = touch.pos
+            self._apply_move.cancel()
+            self._apply_pending_move()
+            self.mode = None
             return True
         return super().on_touch_up(touch)
 
     def _start_dragging(self, touch):
         """Starts dragging the crop box."""
-        self.dragging = True
-        self.drag_offset_x = touch.x - self.x
-        self.drag_offset_y = touch.y - self.y
+        self.mode = "drag"
+        self.drag_offset = (touch.x - self.x, touch.y - self.y)
+
+    def _start_corner_resizing(self, corner):
+        """Starts resizing the crop box from a corner."""
+        self.mode = "corner"
+        self.anchor = (
+            self.right if corner[0] == self.x else self.x,
+            self.top if corner[1] == self.y else self.y,
+        )
+        self.direction = (
+            1 if corner[0] > self.anchor[0] else -1,
+            1 if corner[1] > self.anchor[1] else -1,
+        )
 
     def _start_resizing(self, touch):
-        """Starts resizing the crop box."""
-        self.resizing = True
-        self.start_drag_y = touch.y
+        """Starts resizing the crop box around its center."""
+        self.mode = "scale"
+        self.start_y = touch.y
+        self.start_side = self.width
+        self.start_center = self.center
+
+    def _apply_pending_move(self, *args):
+        """Applies the latest queued touch position."""
+        if self.pending_pos is None or self.mode is None:
+            return
+        x, y = self.pending_pos
+        self.pending_pos = None
+        if self.mode == "drag":
+            self._drag(x, y)
+        elif self.mode == "corner":
+            self._resize_from_corner(x, y)
+        else:
+            self._resize(y)
+
+    def _clamp_pos(self, x, y, side):
+        """Returns the closest position keeping a box inside the image."""
+        display_x, display_y, display_width, display_height = self.display_area
+        return (
+            min(max(x, display_x), display_x + display_width - side),
+            min(max(y, display_y), display_y + display_height - side),
+        )
 
-    def _drag(self, touch):
+    def _drag(self, x, y):
         """Handles the dragging of the crop box."""
-        parent = self.parent
-        if parent:
-            image_widget = parent.image_widget
-            display_x, display_y, display_width, display_height = (
-                get_image_display_area(image_widget)
-            )
-
-            new_x = touch.x - self.drag_offset_x
-            new_y = touch.y - self.drag_offset_y
-
-            new_x = min(max(new_x, display_x), display_x + display_width - self.width)
-            new_y = min(max(new_y, display_y), display_y + display_height - self.height)
-
-            self.pos = (new_x, new_y)
-
-    def _resize(self, touch):
-        """Handles the resizing of the crop box."""
-        parent = self.parent
-        if parent:
-            image_widget = parent.image_widget
-            display_x, display_y, display_width, display_height = (
-                get_image_display_area(image_widget)
-            )
-
-            max_side = min(display_width, display_height)
-            drag_distance = touch.y - self.start_drag_y
-            scale_factor = 1.01 if drag_distance > 0 else 0.99
-
-            new_width = self.width * scale_factor
-            new_height = self.height * scale_factor
-
-            if new_width > max_side or new_height > max_side:
-                new_width = min(new_width, max_side)
-                new_height = min(new_height, max_side)
-
-            if new_width < MIN_CROP_SIZE or new_height < MIN_CROP_SIZE:
-                new_width = max(new_width, MIN_CROP_SIZE)
-                new_height = max(new_height, MIN_CROP_SIZE)
+        self.pos = self._clamp_pos(
+            x - self.drag_offset[0], y - self.drag_offset[1], self.width
+        )
 
-            self.size = (new_width, new_height)
-            self.pos = (self.center_x - new_width / 2, self.center_y - new_height / 2)
+    def _resize_from_corner(self, x, y):
+        """Resizes the box so that the dragged corner follows the touch."""
+        display_x, display_y, display_width, display_height = self.display_area
+        anchor_x, anchor_y = self.anchor
+        direction_x, direction_y = self.direction
+        # room between the anchor and the edges of the image the corner moves to
+        room_x = (
+            display_x + display_width - anchor_x
+            if direction_x > 0
+            else anchor_x - display_x
+        )
+        room_y = (
+            display_y + display_height - anchor_y
+            if direction_y > 0
+            else anchor_y - display_y
+        )
+        side = max((x - anchor_x) * direction_x, (y - anchor_y) * direction_y)
+        side = min(max(side, MIN_CROP_SIZE), room_x, room_y)
+        self.size = (side, side)
+        self.pos = (
+            anchor_x if direction_x > 0 else anchor_x - side,
+            anchor_y if direction_y > 0 else anchor_y - side,
+        )
 
-            self.start_drag_y = touch.y
-            self.update_position()
+    def _resize(self, y):
+        """Resizes the box around its center in proportion to the drag."""
+        display_width, display_height = self.display_area[2:]
+        side = self.start_side + 2 * (y - self.start_y)
+        side = min(max(side, MIN_CROP_SIZE), display_width, display_height)
+        center_x, center_y = self.start_center
+        self.size = (side, side)
+        self.pos = self._clamp_pos(center_x - side / 2, center_y - side / 2, side)
 
 
 class ImageCropScreen(Screen):
@@ -416,11 +1441,19 @@ class ImageCropScreen(Screen):
         self.image_widget = Image(size_hint=(1, 1), allow_stretch=True, keep_ratio=True)
         self.layout.add_widget(self.image_widget)
 
-        self.layout.image_widget = self.image_widget
         self.crop_box = CropBox()
         self.layout.add_widget(self.crop_box)
 
-        self.original_image = None
+        self.image_widget.bind(size=self._on_image_resize)
+
+        self.image_path = None
+        self.initial_crop = None
+        self.proxy = None
+        self.source_size = None
+        self.proxy_futures = {}
+        self.proxy_loader = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="crop-proxy"
+        )
 
     def _add_button_row(self):
         """Adds the row with Back and Done buttons."""
@@ -457,79 +1490,144 @@ class ImageCropScreen(Screen):
         done_button.bind(on_press=self._crop_image)
         return done_button
 
-    def display_image(self, image_path):
-        """Displays the selected image for cropping."""
-        self.image_widget.source = image_path
-        self.original_image = PILImage.open(image_path)
-        Clock.schedule_once(self._check_texture_loaded, 0.1)
+    def display_image(self, image_path, neighbors=(), crop=None, source_size=None):
+        """
+        Displays the selected image for cropping.
+
+        A screen-sized proxy is decoded in the background and shown once
+        loaded, the neighbors are prefetched so that the next crop opens
+        without waiting. The crop box starts on the given crop, in source
+        pixels, or on the centered square. With the source size known, e.g.
+        from the scan index, the crop box is placed before the proxy loads.
+        """
+        self.image_path = image_path
+        self.initial_crop = crop
+        self.proxy = None
+        self.source_size = source_size
+        self.image_widget.texture = None
+        self.crop_box.size = (0, 0)
+        self.crop_box.display_area = None
+        if not self._show_proxy(image_path):
+            self._load_proxy(image_path)
+            if source_size is not None:
+                self._update_crop_box()
+        for neighbor in neighbors:
+            if ("proxy", neighbor) not in self.session:
+                self._load_proxy(neighbor)
+
+    @property
+    def session(self):
+        """Session store of the process screen, holding the proxies."""
+        return self.manager.get_screen("image_process_screen").session
+
+    def _load_proxy(self, image_path):
+        """Decodes the proxy of an image in the background, once."""
+        if image_path in self.proxy_futures:
+            return
+        future = self.proxy_loader.submit(
+            self._decode_proxy,
+            image_path,
+            tuple(int(side) for side in Window.size),
+            self.manager.get_screen("image_process_screen").tracer,
+        )
+        self.proxy_futures[image_path] = future
+        future.add_done_callback(
+            lambda future: self._on_proxy_loaded(image_path, future)
+        )
 
-    def _check_texture_loaded(self, *args):
-        """Checks if the image texture is loaded and updates the crop box."""
-        if self.image_widget.texture:
+    @staticmethod
+    def _decode_proxy(image_path, box, tracer):
+        """Decodes the proxy of an image, runs in a worker thread."""
+        with tracer.span(image_path, "proxy"):
+            return open_proxy(image_path, box)
+
+    @mainthread
+    def _on_proxy_loaded(self, image_path, future):
+        """Stores a loaded proxy and shows it if it is the current image."""
+        self.proxy_futures.pop(image_path, None)
+        if future.exception() is not None:
+            return
+        proxy, source_size = future.result()
+        self.session.put(
+            ("proxy", image_path), "proxy", (proxy, source_size), image_bytes(proxy)
+        )
+        if image_path == self.image_path:
+            self._show_proxy(image_path)
+
+    def _show_proxy(self, image_path):
+        """Shows the stored proxy of an image, returns False if it is not stored."""
+        stored = self.session.get(("proxy", image_path))
+        if stored is None:
+            return False
+        self.proxy, self.source_size = stored
+        self.image_widget.texture = texture_from_image(self.proxy)
+        self._update_crop_box()
+        return True
+
+    def _on_image_resize(self, *args):
+        """Fits the crop box to the image again, on the same crop, once resized."""
+        if self.image_widget.texture is not None or self.source_size is not None:
             self._update_crop_box()
-        else:
-            Clock.schedule_once(self._check_texture_loaded, 0.1)
 
     def _update_crop_box(self, *args):
-        """Updates the crop box size and position based on the image."""
-        image_width, image_height = self.image_widget.texture_size
-        widget_width, widget_height = self.image_widget.size
-
-        scale_x = widget_width / image_width
-        scale_y = widget_height / image_height
-        scale = min(scale_x, scale_y)
-        display_width = image_width * scale
-        display_height = image_height * scale
-
-        short_side = min(display_width, display_height)
-
-        self.crop_box.size = (short_side, short_side)
-        self.crop_box.pos = (
-            self.image_widget.center_x - short_side / 2,
-            self.image_widget.center_y - short_side / 2,
+        """
+        Updates the crop box size and position based on the image.
+
+        A crop box already placed on the image keeps its crop, e.g. while the
+        window is resized, a new image starts on its initial crop.
+        """
+        crop = self.initial_crop
+        area = self.crop_box.display_area
+        if area is not None and all(area[2:]) and self.source_size is not None:
+            # the crop being edited, in source pixels of the previous geometry
+            crop = crop_box_to_source_rect(
+                (*self.crop_box.pos, *self.crop_box.size), area, self.source_size
+            )
+        # the crop box keeps the display area until the geometry changes again
+        self.crop_box.display_area = get_image_display_area(
+            self.image_widget,
+            self.source_size if self.image_widget.texture is None else None,
         )
+        display_x, display_y, display_width, display_height = self.crop_box.display_area
+        if crop is not None and self.source_size is not None:
+            x, y, width, height = source_rect_to_crop_box(
+                crop, self.crop_box.display_area, self.source_size
+            )
+            self.crop_box.size = (width, height)
+            self.crop_box.pos = (x, y)
+        else:
+            short_side = min(display_width, display_height)
+            self.crop_box.size = (short_side, short_side)
+            self.crop_box.pos = (
+                display_x + (display_width - short_side) / 2,
+                display_y + (display_height - short_side) / 2,
+            )
 
         self.crop_box.update_position()
         self.layout.do_layout()
 
     def _crop_image(self, instance):
         """Crops the image based on the crop box and updates the process screen."""
-        if self.original_image is None:
+        if self.proxy is None:
             return
 
-        display_x, display_y, display_width, display_height = get_image_display_area(
-            self.image_widget
-        )
-
-        crop_x = (
-            (self.crop_box.x - display_x) / display_width * self.original_image.width
-        )
-        crop_y = (
-            (self.crop_box.y - display_y) / display_height * self.original_image.height
-        )
-        crop_width = self.crop_box.width / display_width * self.original_image.width
-        crop_height = self.crop_box.height / display_height * self.original_image.height
-        crop_x = int(crop_x)
-        crop_y = int(self.original_image.height - crop_y)
-        crop_width = int(crop_width)
-        crop_height = int(crop_height)
-
-        crop_x = max(0, crop_x)
-        crop_y = max(0, crop_y - crop_height)
-        crop_width = min(self.original_image.width - crop_x, crop_width)
-        crop_height = min(self.original_image.height - crop_y, crop_height)
-
-        cropped_image = self.original_image.crop(
-            (crop_x, crop_y, crop_x + crop_width, crop_y + crop_height)
-        )
-
-        image_data = BytesIO()
-        cropped_image.save(image_data, format="PNG")
-        image_data.seek(0)
+        process_screen = self.manager.get_screen("image_process_screen")
+        with process_screen.tracer.span(self.image_path, "crop-preview"):
+            crop = crop_box_to_source_rect(
+                (*self.crop_box.pos, *self.crop_box.size),
+                self.crop_box.display_area,
+                self.source_size,
+            )
+            scale = self.proxy.width / self.source_size[0]
+            preview = self.proxy.crop(tuple(round(side * scale) for side in crop))
+            preview.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
 
-        self.manager.get_screen("image_process_screen").update_cropped_image(image_data)
+        process_screen.update_cropped_image(crop, preview)
         self._go_back(None)
 
     def _go_back(self, instance):
         """Navigates back to the image process screen."""
+        # the proxy stays in the session store while the budget allows it
+        self.proxy = None
+        self.image_widget.texture = None
         self.manager.current = "image_process_screen"
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# memory budget of the session, in MB, instead of the default
+MEMORY_BUDGET_ENV = "SWING_MEMORY_BUDGET_MB"
+DEFAULT_MEMORY_BUDGET = 512 * 1024 * 1024
+
+
+def memory_budget():
+    """
+    Get the memory budget of a session.
+
+    Args:
+    None
+
+    Return:
+    int: Budget in bytes, from SWING_MEMORY_BUDGET_MB if it is set
+    """
+    try:
+        return int(float(os.environ[MEMORY_BUDGET_ENV]) * 1024 * 1024)
+    except (KeyError, ValueError):
+        return DEFAULT_MEMORY_BUDGET
+
+
+def image_bytes(image):
+    """Returns the memory held by the pixels of a decoded PIL image."""
+    return len(image.getbands()) * image.width * image.height
+
+
+@dataclass
+class SessionEntry:
+    """A value of the session store, in memory or spilled to disk."""
+
+    kind: str
+    value: object
+    size: int
+    spillable: bool = False
+    spill_path: str | None = None
+
+
+class SessionStore:
+    """
+    Memory-budgeted store of the decoded images and textures of a session.
+
+    Entries are kept in least recently used order. When the budget is
+    exceeded the oldest entries are evicted: spillable entries, PIL images,
+    are written to a temporary directory and read back on the next get(),
+    the others are dropped and made again by their owner.
+    """
+
+    def __init__(self, budget=None, on_change=None):
+        self.budget = memory_budget() if budget is None else budget
+        # called after every change of the usage
+        self.on_change = on_change
+        self.entries = OrderedDict()
+        self.used = 0
+        self.spilled = 0
+        self._spill_dir = None
+        self._lock = threading.RLock()
+
+    def put(self, key, kind, value, size, spillable=False):
+        """
+        Add a value, evicting older entries if the budget is exceeded.
+
+        Args:
+        key(hashable): Key of the value
+        kind(str): Kind of value, e.g. "proxy", "preview" or "texture"
+        value(object): Value to keep
+        size(int): Memory held by the value, in bytes
+        spillable(bool): Spill the value to disk instead of dropping it, the
+                         value must be a PIL image
+
+        Return:
+        None
+        """
+        with self._lock:
+            self._remove(key)
+            self.entries[key] = SessionEntry(kind, value, size, spillable)
+            self.used += size
+            self._evict(keep=key)
+        self._changed()
+
+    def __contains__(self, key):
+        """Checks if a value is stored, without marking it as used."""
+        with self._lock:
+            return key in self.entries
+
+    def get(self, key):
+        """Returns a value, reading it back if it was spilled, or None."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            if entry.value is None:
+                try:
+                    entry.value = self._unspill(entry)
+                except OSError:
+                    self._remove(key)
+                    return None
+                self.used += entry.size
+                self._evict(keep=key)
+            value = entry.value
+        self._changed()
+        return value
+
+    def discard(self, key):
+        """Removes a value if it is stored."""
+        with self._lock:
+            self._remove(key)
+        self._changed()
+
+    def clear(self):
+        """Removes every value."""
+        with self._lock:
+            for key in list(self.entries):
+                self._remove(key)
+        self._changed()
+
+    def usage(self):
+        """Returns the bytes in memory by kind of value."""
+        usage = {}
+        with self._lock:
+            for entry in self.entries.values():
+                if entry.value is not None:
+                    usage[entry.kind] = usage.get(entry.kind, 0) + entry.size
+        return usage
+
+    def close(self):
+        """Removes every value and the spill directory."""
+        self.clear()
+        if self._spill_dir is not None:
+            self._spill_dir.cleanup()
+            self._spill_dir = None
+
+    def _remove(self, key):
+        """Removes an entry and its spilled data, the lock must be held."""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        if entry.value is not None:
+            self.used -= entry.size
+        if entry.spill_path is not None:
+            self.spilled -= entry.size
+            try:
+                os.remove(entry.spill_path)
+            except OSError:
+                pass
+
+    def _evict(self, keep):
+        """Evicts the least recently used entries until under the budget."""
+        for key in list(self.entries):
+            if self.used <= self.budget:
+                return
+            entry = self.entries[key]
+            if key == keep or entry.value is None:
+                continue
+            if entry.spillable:
+                try:
+                    self._spill(key, entry)
+                    continue
+                except OSError:
+                    pass
+            self._remove(key)
+
+    def _spill(self, key, entry):
+        """Writes the value of an entry to disk and drops it from memory."""
+        if entry.spill_path is None:
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.TemporaryDirectory(prefix="swing-session-")
+            name = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+            spill_path = os.path.join(self._spill_dir.name, f"{name}.tif")
+            # uncompressed TIFF keeps every mode and reads back at memory speed
+            entry.value.save(spill_path, format="TIFF")
+            entry.spill_path = spill_path
+            self.spilled += entry.size
+        entry.value = None
+        self.used -= entry.size
+
+    def _unspill(self, entry):
+        """Reads back the spilled value of an entry."""
+        from PIL import Image
+
+        with Image.open(entry.spill_path) as image:
+            image.load()
+        return image
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self)
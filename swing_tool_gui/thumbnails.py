@@ -0,0 +1,158 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Lock, get_ident
+
+from swing_tool_gui.imaging import open_reduced
+from swing_tool_gui.utils import user_cache_dir
+
+THUMBNAIL_SIZE = 684
+THUMBNAIL_CACHE_LIMIT = 256 * 1024 * 1024
+THUMBNAIL_WORKERS = 4
+# evict down to this share of the limit so that eviction does not run on
+# every new thumbnail once the cache is full
+EVICTION_TARGET = 0.9
+# suffixes of the finished thumbnails, the others are being written
+THUMBNAIL_SUFFIXES = (".jpg", ".png")
+
+
+class ThumbnailCache:
+    """
+    On-disk cache of downscaled previews, created by background workers.
+
+    Thumbnails are keyed by the path, size and mtime of the source file, so a
+    modified file gets a new thumbnail. The cache is capped in size and the
+    least recently used thumbnails are evicted first.
+    """
+
+    def __init__(
+        self,
+        cache_dir=None,
+        size=THUMBNAIL_SIZE,
+        max_bytes=THUMBNAIL_CACHE_LIMIT,
+        workers=THUMBNAIL_WORKERS,
+    ):
+        self.cache_dir = Path(cache_dir or user_cache_dir() / "thumbnails")
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.size = size
+        self.max_bytes = max_bytes
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="thumbnail"
+        )
+        self._lock = Lock()
+        self._total_bytes = None
+
+    def cache_key(self, path):
+        """Returns the cache key of a source file, None if it does not exist."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        identity = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        return hashlib.sha1(f"{identity}|{self.size}".encode("utf-8")).hexdigest()
+
+    def get(self, path):
+        """Returns the cached thumbnail of a file, None if not created yet."""
+        key = self.cache_key(path)
+        if key is None:
+            return None
+        for thumbnail in self._candidates(key):
+            try:
+                # mark as recently used for the LRU eviction
+                os.utime(thumbnail)
+            except OSError:
+                continue
+            return str(thumbnail)
+        return None
+
+    def request(self, path, callback):
+        """
+        Gets the thumbnail of a file, creating it in the background if needed.
+
+        The callback is called with (path, thumbnail_path) directly on a cache
+        hit and from a worker thread otherwise. thumbnail_path is None if the
+        thumbnail could not be created.
+        """
+        thumbnail = self.get(path)
+        if thumbnail is not None:
+            callback(path, thumbnail)
+            return
+        future = self._executor.submit(self._create, path)
+        future.add_done_callback(
+            lambda future: callback(
+                path, None if future.exception() else future.result()
+            )
+        )
+
+    def shutdown(self):
+        """Stops the workers, dropping the pending requests."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _scan(self):
+        """Returns (path, mtime, size) of the finished thumbnails."""
+        thumbnails = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(THUMBNAIL_SUFFIXES):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # evicted by another instance of the app
+                continue
+            thumbnails.append((entry.path, stat.st_mtime, stat.st_size))
+        return thumbnails
+
+    def _candidates(self, key):
+        """Returns the possible thumbnail paths of a key."""
+        return (self.cache_dir / f"{key}.jpg", self.cache_dir / f"{key}.png")
+
+    def _create(self, path):
+        """Creates and stores the thumbnail of a file."""
+        key = self.cache_key(path)
+        if key is None:
+            return None
+        with open_reduced(path, (self.size, self.size)) as img:
+            img.thumbnail((self.size, self.size))
+            if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+                thumbnail = self.cache_dir / f"{key}.png"
+                preview = img.convert("RGBA")
+                save_params = {"format": "PNG", "compress_level": 1}
+            else:
+                thumbnail = self.cache_dir / f"{key}.jpg"
+                preview = img.convert("RGB")
+                save_params = {"format": "JPEG", "quality": 85}
+        # write to a temporary file first, readers never see a partial thumbnail
+        temp_path = thumbnail.with_suffix(f".{os.getpid()}-{get_ident()}.tmp")
+        preview.save(temp_path, **save_params)
+        os.replace(temp_path, thumbnail)
+        self._add_thumbnail(thumbnail)
+        return str(thumbnail)
+
+    def _add_thumbnail(self, thumbnail):
+        """Accounts a new thumbnail and evicts old ones if over the limit."""
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for path, mtime, size in self._scan())
+            else:
+                self._total_bytes += thumbnail.stat().st_size
+            if self._total_bytes > self.max_bytes:
+                self._evict(keep=thumbnail)
+
+    def _evict(self, keep):
+        """Deletes the least recently used thumbnails down to the target size."""
+        thumbnails = sorted(self._scan(), key=lambda thumbnail: thumbnail[1])
+        target = self.max_bytes * EVICTION_TARGET
+        for path, mtime, size in thumbnails:
+            if self._total_bytes <= target:
+                break
+            if path == str(keep):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # already evicted by another instance of the app
+                pass
+            except OSError:
+                continue
+            self._total_bytes -= size
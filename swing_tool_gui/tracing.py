@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+
+@dataclass
+class Span:
+    """Duration of a stage of the work on a file."""
+
+    file: str
+    stage: str
+    start: float
+    duration: float = 0.0
+    bytes: int = 0
+    pid: int = 0
+    tid: int = 0
+    error: str | None = None
+
+
+class Tracer:
+    """
+    Records per-file, per-stage spans from any thread or worker process.
+
+    Spans of worker processes are recorded by a tracer of the worker and added
+    to the tracer of the main process with extend().
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, file, stage):
+        """
+        Records the duration of the wrapped block as a span.
+
+        The span is yielded so that the block can set its byte count. An
+        exception raised by the block is recorded on the span and re-raised.
+        """
+        span = Span(
+            file=str(file),
+            stage=stage,
+            start=time.time(),
+            pid=os.getpid(),
+            tid=threading.get_ident(),
+        )
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as error:
+            span.error = f"{type(error).__name__}: {error}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            with self._lock:
+                self.spans.append(span)
+
+    def extend(self, spans):
+        """Adds spans recorded elsewhere, e.g. by a worker process."""
+        with self._lock:
+            self.spans.extend(spans)
+
+    def clear(self):
+        """Drops all the recorded spans."""
+        with self._lock:
+            self.spans = []
+
+    def snapshot(self):
+        """Returns a copy of the recorded spans."""
+        with self._lock:
+            return list(self.spans)
+
+    def export_jsonl(self, path):
+        """Writes one JSON object per span."""
+        with open(path, "w", encoding="utf-8") as file:
+            for span in self.snapshot():
+                file.write(json.dumps(asdict(span), ensure_ascii=False) + "\n")
+
+    def export_chrome_trace(self, path):
+        """Writes the spans in the Chrome trace event format."""
+        spans = self.snapshot()
+        origin = min((span.start for span in spans), default=0)
+        events = [
+            {
+                "name": span.stage,
+                "cat": "error" if span.error else "stage",
+                "ph": "X",
+                "ts": (span.start - origin) * 1_000_000,
+                "dur": span.duration * 1_000_000,
+                "pid": span.pid,
+                "tid": span.tid,
+                "args": {
+                    "file": span.file,
+                    "bytes": span.bytes,
+                    **({"error": span.error} if span.error else {}),
+                },
+            }
+            for span in spans
+        ]
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": events}, file, ensure_ascii=False)
+
+    def export(self, directory, name="trace"):
+        """
+        Writes the spans as JSON lines and as a Chrome trace.
+
+        Args:
+        directory(str): Directory to write to
+        name(str): Name of the files, without extension
+
+        Return:
+        tuple: Paths of the JSON lines and the Chrome trace files
+        """
+        jsonl_path = os.path.join(directory, f"{name}.jsonl")
+        chrome_path = os.path.join(directory, f"{name}.json")
+        self.export_jsonl(jsonl_path)
+        self.export_chrome_trace(chrome_path)
+        return jsonl_path, chrome_path
+
+    def summary(self, top=5, stages=None):
+        """
+        Summarise where the time went.
+
+        Args:
+        top(int): Number of slowest files to list
+        stages(set): Only count these stages, all if None
+
+        Return:
+        dict: "stages" as [(stage, total seconds, count)] and "files" as
+              [(file, total seconds)], both slowest first
+        """
+        stage_totals = defaultdict(float)
+        stage_counts = defaultdict(int)
+        file_totals = defaultdict(float)
+        for span in self.snapshot():
+            if stages is not None and span.stage not in stages:
+                continue
+            stage_totals[span.stage] += span.duration
+            stage_counts[span.stage] += 1
+            file_totals[span.file] += span.duration
+        return {
+            "stages": sorted(
+                (
+                    (stage, total, stage_counts[stage])
+                    for stage, total in stage_totals.items()
+                ),
+                key=lambda item: item[1],
+                reverse=True,
+            ),
+            "files": sorted(
+                file_totals.items(), key=lambda item: item[1], reverse=True
+            )[:top],
+        }
+
+
+def format_summary(summary):
+    """
+    Format a tracer summary for display.
+
+    Args:
+    summary(dict): Result of Tracer.summary()
+
+    Return:
+    list: Lines of text
+    """
+    lines = []
+    if summary["stages"]:
+        lines.append(
+            "Slowest stages: "
+            + ", ".join(
+                f"{stage} {total:.1f}s/{count}"
+                for stage, total, count in summary["stages"]
+            )
+        )
+    if summary["files"]:
+        lines.append(
+            "Slowest files: "
+            + ", ".join(
+                f"{os.path.basename(file)} {total:.1f}s"
+                for file, total in summary["files"]
+            )
+        )
+    return lines
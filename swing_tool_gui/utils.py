@@ -1,92 +1,234 @@
-import subprocess
+import os
+import platform
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING
 
-from kivy.uix.widget import Widget
-from PIL import Image
+if TYPE_CHECKING:
+    from kivy.uix.widget import Widget
 
+# leading bytes of the image formats PIL can read
+IMAGE_SIGNATURES = (
+    b"\xff\xd8\xff",  # JPEG
+    b"\x89PNG\r\n\x1a\n",  # PNG
+    b"GIF87a",
+    b"GIF89a",
+    b"II*\x00",  # little-endian TIFF
+    b"MM\x00*",  # big-endian TIFF
+    b"BM",  # BMP
+    b"8BPS",  # PSD
+    b"\x00\x00\x01\x00",  # ICO
+    b"icns",
+    b"\xd0\xcf\x11\xe0",  # OLE2 (FlashPix, MIC)
+    b"\x00\x00\x00\x0cjP  ",  # JPEG 2000
+    b"\xff\x4f\xff\x51",  # JPEG 2000 codestream
+)
+# formats identified by a chunk at an offset: (offset, bytes)
+IMAGE_SIGNATURES_AT = (
+    (8, b"WEBP"),
+    (4, b"ftypheic"),
+    (4, b"ftypheix"),
+    (4, b"ftypmif1"),
+    (4, b"ftypavif"),
+)
+SNIFF_SIZE = 16
+# Chinese fonts to register, by platform, most preferred first
+SYSTEM_FONT_CANDIDATES = {
+    "Windows": (
+        "C:\\Windows\\Fonts\\msyh.ttc",
+        "C:\\Windows\\Fonts\\simhei.ttf",
+        "C:\\Windows\\Fonts\\simsun.ttc",
+    ),
+    "Darwin": (
+        "/System/Library/Fonts/STHeiti Light.ttc",
+        "/System/Library/Fonts/PingFang.ttc",
+        "/System/Library/Fonts/Hiragino Sans GB.ttc",
+        "/Library/Fonts/Arial Unicode.ttf",
+    ),
+    "Linux": (
+        "/usr/share/fonts/truetype/arphic/ukai.ttc",
+        "/usr/share/fonts/truetype/arphic/uming.ttc",
+        "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+        "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+        "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+        "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+        "/usr/share/fonts/truetype/droid/DroidSansFallbackFull.ttf",
+    ),
+}
+# file of the user cache directory remembering the font found
+FONT_CACHE_FILE_NAME = "font.txt"
 
-class AppleScriptExecutor:
-    """A utility class for executing AppleScript commands."""
 
-    @staticmethod
-    def run_script(script):
-        """Runs the given AppleScript command and returns the output."""
-        process = subprocess.Popen(
-            script, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        output, error = process.communicate()
+def sniff_image(file_path: str):
+    """
+    Cheaply check if a file may be an image.
 
-        if process.returncode != 0:
-            raise RuntimeError(f"AppleScript execution failed: {error.decode('utf-8')}")
+    Known image signatures are matched against the first bytes of the file.
+    Files without a known signature are kept if their extension is one PIL
+    can read, since some formats (e.g. TGA) have no signature at all.
 
-        return output
+    Args:
+    file_path (str): Path to the file
 
+    Return:
+    bool: May be an image or not
+    """
+    try:
+        with open(file_path, "rb") as file:
+            head = file.read(SNIFF_SIZE)
+    except OSError:
+        return False
+    if head.startswith(IMAGE_SIGNATURES):
+        return True
+    if any(head[offset:].startswith(magic) for offset, magic in IMAGE_SIGNATURES_AT):
+        return True
+    from PIL import Image
 
-def is_image_file(file_path: str):
+    return os.path.splitext(file_path)[1].lower() in Image.registered_extensions()
+
+
+def verify_image(file_path: str):
     """
-    Check if a file is an image.
+    Check if a file is a valid image by verifying it with PIL.
 
     Args:
     file_path (str): Path to the file
 
     Return:
-    bool: Is image or not
+    bool: Is a valid image or not
     """
+    from PIL import Image
+
     try:
         with Image.open(file_path) as img:
             img.verify()
-    except (OSError, SyntaxError):
+    except Exception:
+        # not only OSError, e.g. DecompressionBombError for a huge image
         return False
     else:
         return True
 
 
-def apple_alias_to_posix_path(alias_path: bytes):
+def is_image_file(file_path: str):
     """
-    Convert apple alias path to POSIX path
+    Check if a file is an image.
 
     Args:
-    alias_path(bytes): Apple alias Path to the file
+    file_path (str): Path to the file
 
     Return:
-    str: POSIX path to the file
+    bool: Is image or not
     """
-    return alias_path.decode("utf-8").replace(":", "/").lstrip("alias Macintosh HD")
+    return sniff_image(file_path) and verify_image(file_path)
 
 
+@lru_cache(maxsize=None)
 def find_system_font():
     """
     Find system default Chinese font
 
+    The first installed candidate is remembered in the user cache directory,
+    so later launches only check that it still exists.
+
     Args:
     None
 
     Return:
-    str: Path to font file
+    str: Path to font file, None if no candidate is installed
+    """
+    cache_file = user_cache_dir() / FONT_CACHE_FILE_NAME
+    try:
+        cached = cache_file.read_text(encoding="utf-8").strip()
+    except OSError:
+        cached = ""
+    if cached and os.path.isfile(cached):
+        return cached
+    font_path = next(
+        (
+            path
+            for path in SYSTEM_FONT_CANDIDATES.get(platform.system(), ())
+            if os.path.isfile(path)
+        ),
+        None,
+    )
+    if font_path:
+        try:
+            cache_file.write_text(font_path, encoding="utf-8")
+        except OSError:
+            pass
+    return font_path
+
+
+def default_title(file_path: str):
+    """
+    Get the default title of an image, its file name without extension.
+
+    Args:
+    file_path(str): Path to the file
+
+    Return:
+    str: Default title
     """
-    import platform
+    return os.path.splitext(os.path.basename(file_path))[0]
 
+
+def user_cache_dir():
+    """
+    Get the per-user cache directory of the app, creating it if needed.
+
+    Args:
+    None
+
+    Return:
+    Path: Path to the cache directory
+    """
     system = platform.system()
-    if system == "Windows":
-        return "C:\\Windows\\Fonts\\msyh.ttc"
     if system == "Darwin":
-        return "/System/Library/Fonts/STHeiti Light.ttc"
-    if system == "Linux":
-        return "/usr/share/fonts/truetype/arphic/ukai.ttc"
-    return None
+        cache_dir = Path.home() / "Library" / "Caches" / "swing-tool-gui"
+    elif system == "Windows":
+        local_app_data = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData"
+        cache_dir = Path(local_app_data) / "swing-tool-gui" / "Cache"
+    else:
+        xdg_cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+        cache_dir = Path(xdg_cache_home) / "swing-tool-gui"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def format_duration(seconds: float):
+    """
+    Format a duration for display.
 
+    Args:
+    seconds(float): Duration in seconds
+
+    Return:
+    str: Duration like "42s", "3m05s" or "1h02m"
+    """
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m{seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m"
 
-def get_image_display_area(image_widget: Widget):
+
+def get_image_display_area(image_widget: "Widget", image_size=None):
     """
     Get image display area.
 
     Args:
     image_widget(Widget): Widget of image.
+    image_size(tuple): (width, height) of the image, the texture size if None,
+                       e.g. to lay out an image before its texture is loaded
 
     Return:
     tuple: (x, y, width, height)
     """
     # get size of image texture
-    texture_width, texture_height = image_widget.texture_size
+    texture_width, texture_height = image_size or image_widget.texture_size
     # get size of image widget
     widget_width, widget_height = image_widget.size
 
@@ -104,3 +246,63 @@ def get_image_display_area(image_widget: Widget):
     display_y = image_widget.center_y - display_height / 2
 
     return display_x, display_y, display_width, display_height
+
+
+def crop_box_to_source_rect(
+    crop_box: tuple, display_area: tuple, source_size: tuple[int, int]
+):
+    """
+    Map a crop box on the displayed image to a rectangle in source pixels.
+
+    Args:
+    crop_box(tuple): (x, y, width, height) of the crop box, in window coordinates
+    display_area(tuple): (x, y, width, height) of the displayed image
+    source_size(tuple): (width, height) of the source image
+
+    Return:
+    tuple: (left, top, right, bottom) in source pixels, top-left origin
+    """
+    box_x, box_y, box_width, box_height = crop_box
+    display_x, display_y, display_width, display_height = display_area
+    source_width, source_height = source_size
+
+    crop_x = round((box_x - display_x) / display_width * source_width)
+    # window coordinates grow upwards, image rows grow downwards
+    crop_y = round(source_height - (box_y - display_y) / display_height * source_height)
+    crop_width = round(box_width / display_width * source_width)
+    crop_height = round(box_height / display_height * source_height)
+
+    crop_x = max(0, crop_x)
+    crop_y = max(0, crop_y - crop_height)
+    crop_width = min(source_width - crop_x, crop_width)
+    crop_height = min(source_height - crop_y, crop_height)
+    return crop_x, crop_y, crop_x + crop_width, crop_y + crop_height
+
+
+def source_rect_to_crop_box(
+    rect: tuple, display_area: tuple, source_size: tuple[int, int]
+):
+    """
+    Map a rectangle in source pixels to a crop box on the displayed image.
+
+    Args:
+    rect(tuple): (left, top, right, bottom) in source pixels, top-left origin
+    display_area(tuple): (x, y, width, height) of the displayed image
+    source_size(tuple): (width, height) of the source image
+
+    Return:
+    tuple: (x, y, width, height) of the crop box, in window coordinates
+    """
+    left, top, right, bottom = rect
+    display_x, display_y, display_width, display_height = display_area
+    source_width, source_height = source_size
+
+    scale_x = display_width / source_width
+    scale_y = display_height / source_height
+    return (
+        display_x + left * scale_x,
+        # window coordinates grow upwards, image rows grow downwards
+        display_y + (source_height - bottom) * scale_y,
+        (right - left) * scale_x,
+        (bottom - top) * scale_y,
+    )
@@ -0,0 +1,441 @@
+import csv
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+from threading import Event, Lock
+
+from swing_tool_gui.autocrop import suggest_crop
+from swing_tool_gui.build import (
+    DEFAULT_VARIANTS,
+    STATE_DIR_NAME,
+    BuildTask,
+    StreamBuilder,
+    state_dir,
+)
+from swing_tool_gui.build_cache import BuildCache
+from swing_tool_gui.encoders import DEFAULT_PROFILE
+from swing_tool_gui.importer import iter_files
+from swing_tool_gui.utils import default_title, is_image_file
+
+LEDGER_FILE_NAME = "ledger.jsonl"
+# seconds a file must keep its size and mtime before it is built
+SETTLE_SECONDS = 2.0
+POLL_INTERVAL = 1.0
+# files of a folder giving the titles of its images
+TITLES_FILE_NAMES = ("titles.json", "titles.csv")
+# suffixes of files still being written by common copy tools
+PARTIAL_SUFFIXES = (".part", ".partial", ".tmp", ".crdownload", ".download")
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Reports the files changed below a directory, with Linux inotify."""
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor: watched directory
+        self._directories = {}
+        self._add_tree(directory)
+        self.directory = directory
+
+    def _add_tree(self, directory):
+        """Watches a directory and its subdirectories, returns their files."""
+        files = []
+        for root, dirs, names in os.walk(directory):
+            dirs[:] = [name for name in dirs if name != STATE_DIR_NAME]
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), INOTIFY_MASK)
+            if wd >= 0:
+                self._directories[wd] = root
+            files.extend(os.path.join(root, name) for name in names)
+        return files
+
+    def changes(self, timeout):
+        """
+        Wait for changes.
+
+        Args:
+        timeout(float): Longest wait in seconds
+
+        Return:
+        list: Paths of the files created or written to, every file of the
+              directory if events were lost
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            end = offset + length
+            name = data[offset:end].rstrip(b"\0")
+            offset = end
+            if mask & IN_Q_OVERFLOW:
+                # the kernel queue overflowed, every file has to be checked
+                changed.extend(iter_files([self.directory]))
+                continue
+            if mask & IN_IGNORED:
+                self._directories.pop(wd, None)
+                continue
+            directory = self._directories.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.extend(self._add_tree(path))
+            else:
+                changed.append(path)
+        return changed
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Reports the files changed below a directory, by listing it again."""
+
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self):
+        """Returns {path: (size, mtime)} of the files below the directory."""
+        snapshot = {}
+        for path in iter_files([self.directory]):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def changes(self, timeout):
+        """Waits for the next listing and returns the new or changed files."""
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._scan()
+        changed = [
+            path
+            for path, identity in snapshot.items()
+            if self._snapshot.get(path) != identity
+        ]
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+
+def create_watcher(directory, polling=False):
+    """
+    Watch a directory with inotify, or by polling where it is not available.
+
+    Args:
+    directory(str): Directory to watch
+    polling(bool): Poll even if inotify is available
+
+    Return:
+    InotifyWatcher | PollingWatcher: Watcher of the directory
+    """
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(directory)
+
+
+class Ledger:
+    """
+    Append-only record of the files processed by a watch folder.
+
+    A file is done while its size and mtime match the record, failed files
+    are only tried again once they change.
+    """
+
+    def __init__(self, output_dir):
+        self.path = Path(state_dir(output_dir)) / LEDGER_FILE_NAME
+        # input file: [size, mtime_ns]
+        self.done = {}
+        self._lock = Lock()
+        self._load()
+
+    def _load(self):
+        """Reads the records of the previous runs, skipping damaged lines."""
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                        self.done[record["file"]] = [
+                            record["size"],
+                            record["mtime_ns"],
+                        ]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+        except OSError:
+            pass
+
+    def is_done(self, path, identity):
+        """Checks if a file was processed with the given size and mtime."""
+        with self._lock:
+            return self.done.get(path) == list(identity)
+
+    def record(self, path, identity, result):
+        """Appends the result of a file to the ledger."""
+        record = {
+            "file": path,
+            "size": identity[0],
+            "mtime_ns": identity[1],
+            "outputs": result.outputs,
+            "error": result.error,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with self._lock:
+            self.done[path] = list(identity)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class TitleSource:
+    """
+    Titles of the watched images.
+
+    A title is read from a sidecar text file with the name of the image
+    ("photo.txt" for "photo.jpg"), then from a titles.json ({"photo.jpg":
+    "title"}) or titles.csv (file and title columns) in its folder, then
+    defaults to the file name.
+    """
+
+    def __init__(self):
+        # folder: (mtime of the titles file, {file name: title})
+        self._folders = {}
+
+    def title(self, path):
+        """Returns the title of an image."""
+        sidecar = os.path.splitext(path)[0] + ".txt"
+        try:
+            with open(sidecar, encoding="utf-8") as file:
+                title = file.readline().strip()
+            if title:
+                return title
+        except (OSError, UnicodeDecodeError):
+            pass
+        titles = self._folder_titles(os.path.dirname(path))
+        return titles.get(os.path.basename(path)) or default_title(path)
+
+    def _folder_titles(self, folder):
+        """Returns the titles file of a folder, read again when it changes."""
+        for name in TITLES_FILE_NAMES:
+            titles_path = os.path.join(folder, name)
+            try:
+                mtime = os.stat(titles_path).st_mtime_ns
+            except OSError:
+                continue
+            cached = self._folders.get(titles_path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            try:
+                titles = self._read_titles(titles_path)
+            except (OSError, ValueError, UnicodeDecodeError):
+                titles = {}
+            self._folders[titles_path] = (mtime, titles)
+            return titles
+        return {}
+
+    @staticmethod
+    def _read_titles(titles_path):
+        """Reads a titles.json or titles.csv file."""
+        with open(titles_path, encoding="utf-8", newline="") as file:
+            if titles_path.endswith(".json"):
+                titles = json.load(file)
+                if not isinstance(titles, dict):
+                    raise ValueError("titles.json must map file names to titles")
+                return {str(name): str(title) for name, title in titles.items()}
+            return {
+                row["file"]: row["title"]
+                for row in csv.DictReader(file)
+                if row.get("file") and row.get("title")
+            }
+
+
+class FolderWatcher:
+    """
+    Builds the images dropped in a directory until stopped.
+
+    A file is built once its size and mtime have not changed for settle
+    seconds. Builds go through a StreamBuilder holding at most queue_size
+    files, the watcher waits while it is full. Every result is written to a
+    ledger in the output directory so that a restart skips the files
+    already processed.
+    """
+
+    def __init__(
+        self,
+        input_dir,
+        output_dir,
+        variants=DEFAULT_VARIANTS,
+        encoder=DEFAULT_PROFILE,
+        derivatives=(),
+        workers=None,
+        queue_size=None,
+        settle=SETTLE_SECONDS,
+        polling=False,
+        auto_crop=False,
+        force=False,
+        on_result=None,
+    ):
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.variants = variants
+        self.encoder = encoder
+        self.derivatives = derivatives
+        self.settle = settle
+        self.polling = polling
+        self.auto_crop = auto_crop
+        self.on_result = on_result
+        Path(state_dir(self.output_dir)).mkdir(parents=True, exist_ok=True)
+        self.ledger = Ledger(self.output_dir)
+        self.titles = TitleSource()
+        self.builder = StreamBuilder(
+            workers=workers,
+            max_pending=queue_size,
+            on_result=self._on_result,
+            cache=BuildCache(state_dir(self.output_dir)),
+            force=force,
+        )
+        self._stop_event = Event()
+        # input file: (size, mtime_ns) of the queued files
+        self._queued = {}
+        self._queued_lock = Lock()
+        self._next_index = 0
+
+    def stop(self):
+        """Asks run() to return, after the queued files are built."""
+        self._stop_event.set()
+
+    def run(self):
+        """Watches and builds until stop() is called."""
+        watcher = create_watcher(self.input_dir, self.polling)
+        self.builder.start()
+        # input file: (size, mtime_ns, time of the last change)
+        pending = {}
+        try:
+            for path in iter_files([self.input_dir]):
+                self._track(pending, path)
+            while not self._stop_event.is_set():
+                for path in watcher.changes(timeout=min(self.settle / 2, 0.5)):
+                    self._track(pending, path)
+                self._queue_settled(pending)
+        finally:
+            watcher.close()
+            self.builder.close(wait=True)
+
+    def _ignored(self, path):
+        """Checks if a path is not an image to build."""
+        name = os.path.basename(path)
+        return (
+            name.startswith(".")
+            or name.lower().endswith(PARTIAL_SUFFIXES)
+            or name.lower().endswith(".txt")
+            or name in TITLES_FILE_NAMES
+            or Path(path).is_relative_to(self.output_dir)
+        )
+
+    def _track(self, pending, path):
+        """Starts waiting for a file to settle."""
+        if not self._ignored(path):
+            pending[path] = (None, None, time.monotonic())
+
+    def _queue_settled(self, pending):
+        """Builds the pending files which stopped changing."""
+        now = time.monotonic()
+        for path, (size, mtime_ns, changed_at) in list(pending.items()):
+            if self._stop_event.is_set():
+                return
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del pending[path]
+                continue
+            identity = (stat.st_size, stat.st_mtime_ns)
+            if identity != (size, mtime_ns):
+                pending[path] = (*identity, now)
+                continue
+            if now - changed_at < self.settle:
+                continue
+            del pending[path]
+            with self._queued_lock:
+                if self._queued.get(path) == identity:
+                    continue
+            if self.ledger.is_done(path, identity) or not is_image_file(path):
+                continue
+            self._queue(path, identity)
+
+    def _queue(self, path, identity):
+        """Sends a settled file to the builder, waiting while it is full."""
+        task = BuildTask(
+            index=self._next_index,
+            input_file=path,
+            title=self.titles.title(path),
+            output_dir=self.output_dir,
+            crop=self._suggested_crop(path),
+            variants=self.variants,
+            encoder=self.encoder,
+            derivatives=self.derivatives,
+        )
+        self._next_index += 1
+        with self._queued_lock:
+            self._queued[path] = identity
+        # backpressure: wait for a free slot, still reacting to stop()
+        while not self._stop_event.is_set():
+            if self.builder.submit(task, timeout=0.5):
+                return
+        with self._queued_lock:
+            self._queued.pop(path, None)
+
+    def _suggested_crop(self, path):
+        """Returns the suggested crop of a file if auto crop is on."""
+        if not self.auto_crop:
+            return None
+        try:
+            return suggest_crop(path)
+        except Exception:
+            return None
+
+    def _on_result(self, result):
+        """Writes a result to the ledger, called from the builder thread."""
+        with self._queued_lock:
+            identity = self._queued.pop(result.input_file, None)
+        if identity is not None:
+            try:
+                self.ledger.record(result.input_file, identity, result)
+            except OSError:
+                pass
+        if self.on_result:
+            self.on_result(result)
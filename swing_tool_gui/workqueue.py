@@ -0,0 +1,501 @@
+import json
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Event, Thread
+
+from swing_tool_gui.build import BatchBuilder, BuildTask, state_dir
+from swing_tool_gui.derivatives import DerivativeSpec
+from swing_tool_gui.encoders import EncoderProfile
+
+JOB_FILE_NAME = "job.json"
+JOB_FORMAT_VERSION = 1
+# directory of the output state directory holding the submitted jobs
+JOBS_DIR_NAME = "jobs"
+# shard states, one directory each, a shard file moves between them
+PENDING, LEASED, DONE, FAILED = "pending", "leased", "done", "failed"
+SHARD_STATES = (PENDING, LEASED, DONE, FAILED)
+DEFAULT_SHARD_SIZE = 50
+# seconds a worker holds a shard without renewing its lease
+DEFAULT_LEASE = 120
+# claims of a shard before it is given up
+DEFAULT_MAX_ATTEMPTS = 3
+# seconds an idle worker waits before looking for expired leases again
+IDLE_INTERVAL = 2.0
+
+
+class JobError(ValueError):
+    """Raised when a job directory cannot be read."""
+
+
+@dataclass
+class Shard:
+    """A part of a job leased by a worker."""
+
+    name: str
+    path: Path
+    attempts: int
+    tasks: list[BuildTask]
+
+
+@dataclass
+class JobProgress:
+    """Aggregate state of a job, from the shard and result files."""
+
+    shards: int
+    pending: int
+    leased: int
+    done: int
+    failed: int
+    files: int
+    built: int
+    errors: int
+    # worker id: shards it holds
+    workers: dict[str, int] = field(default_factory=dict)
+
+    @property
+    def finished(self):
+        return self.done + self.failed >= self.shards
+
+
+def default_worker_id():
+    """Returns an id unique to this process among the hosts of a job."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def jobs_dir(output_dir):
+    """Returns the directory holding the jobs of an output directory."""
+    path = state_dir(output_dir) / JOBS_DIR_NAME
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _write_json(path, data):
+    """Writes a JSON file atomically, readers never see a partial file."""
+    temp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def _read_json(path):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+class JobQueue:
+    """
+    File-based work queue of a sharded build, shared by workers on any host.
+
+    A job is a directory holding its settings and one file per shard. A
+    shard file moves between the pending, leased, done and failed
+    directories by renames, which are atomic on a local or shared filesystem,
+    so two workers never claim the same shard and no lock is needed. SQLite
+    locking is not reliable on network filesystems, a rename is.
+
+    A worker renews the lease of its shard by touching the leased file. A
+    lease not renewed in time is taken back to pending by any worker, with
+    one more attempt counted, and given up after max_attempts. Lease times
+    are compared with the clock of the shared filesystem, not of the hosts.
+    The worker taking a lease back first renames it to a hidden file, which
+    is itself taken back if that worker dies before requeueing the shard.
+    """
+
+    def __init__(self, job_dir):
+        self.job_dir = Path(job_dir)
+        try:
+            job = _read_json(self.job_dir / JOB_FILE_NAME)
+        except (OSError, ValueError) as error:
+            raise JobError(f"{self.job_dir}: {error}") from None
+        if job.get("format") != JOB_FORMAT_VERSION:
+            raise JobError(f"{self.job_dir}: not a job directory")
+        self.job = job
+        self.output_dir = job["output_dir"]
+        self.encoder = EncoderProfile(**job["encoder"])
+        self.derivatives = tuple(
+            DerivativeSpec.from_dict(spec) for spec in job.get("derivatives", ())
+        )
+        self.lease = job.get("lease", DEFAULT_LEASE)
+        self.max_attempts = job.get("max_attempts", DEFAULT_MAX_ATTEMPTS)
+        # results of the finished shards, they never change
+        self._done_results = {}
+
+    @classmethod
+    def submit(
+        cls,
+        tasks,
+        output_dir,
+        encoder,
+        job_dir=None,
+        shard_size=DEFAULT_SHARD_SIZE,
+        lease=DEFAULT_LEASE,
+        max_attempts=DEFAULT_MAX_ATTEMPTS,
+        derivatives=(),
+    ):
+        """
+        Write a job split into shards, ready to be claimed by workers.
+
+        Args:
+        tasks(list): BuildTask of each file, with its title, crop and variants
+        output_dir(str): Output directory of the job
+        encoder(EncoderProfile): Encoder of the outputs
+        job_dir(str): Directory of the job, a new one in the output state
+                      directory if None
+        shard_size(int): Files per shard
+        lease(float): Seconds a worker holds a shard without renewing it
+        max_attempts(int): Claims of a shard before it is given up
+        derivatives(tuple): DerivativeSpec saved next to the outputs
+
+        Return:
+        JobQueue: Queue of the new job
+        """
+        job_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        job_dir = Path(job_dir) if job_dir else jobs_dir(output_dir) / job_id
+        for state in SHARD_STATES:
+            (job_dir / state).mkdir(parents=True, exist_ok=True)
+        shards = []
+        for start in range(0, len(tasks), shard_size):
+            end = start + shard_size
+            shards.append(tasks[start:end])
+        for number, shard_tasks in enumerate(shards):
+            _write_json(
+                job_dir / PENDING / f"shard-{number:05d}.json",
+                {
+                    "attempts": 0,
+                    "entries": [
+                        {
+                            "index": task.index,
+                            "file": task.input_file,
+                            "title": task.title,
+                            "crop": list(task.crop) if task.crop else None,
+                            "variants": list(task.variants),
+                        }
+                        for task in shard_tasks
+                    ],
+                },
+            )
+        # written last, workers ignore a directory without it
+        _write_json(
+            job_dir / JOB_FILE_NAME,
+            {
+                "format": JOB_FORMAT_VERSION,
+                "id": job_id,
+                "created": time.time(),
+                "output_dir": str(output_dir),
+                "encoder": encoder.to_dict(),
+                "derivatives": [spec.to_dict() for spec in derivatives],
+                "lease": lease,
+                "max_attempts": max_attempts,
+                "shards": len(shards),
+                "files": len(tasks),
+            },
+        )
+        return cls(job_dir)
+
+    def claim(self, worker_id):
+        """
+        Lease the next pending shard, taking back expired leases first.
+
+        Args:
+        worker_id(str): Id of the claiming worker
+
+        Return:
+        Shard: Leased shard, None if no shard is pending
+        """
+        self.reclaim_expired()
+        for pending_path in sorted((self.job_dir / PENDING).glob("shard-*.json")):
+            name = pending_path.stem
+            leased_path = self.job_dir / LEASED / f"{name}.{worker_id}"
+            try:
+                # a rename keeps the mtime, start the lease before moving
+                os.utime(pending_path)
+                os.rename(pending_path, leased_path)
+            except FileNotFoundError:
+                # claimed by another worker first
+                continue
+            if (self.job_dir / DONE / f"{name}.json").exists():
+                # a late worker finished it after its lease was taken back
+                os.remove(leased_path)
+                continue
+            data = _read_json(leased_path)
+            tasks = [
+                BuildTask(
+                    index=entry["index"],
+                    input_file=entry["file"],
+                    title=entry["title"],
+                    output_dir=self.output_dir,
+                    crop=tuple(entry["crop"]) if entry["crop"] else None,
+                    variants=tuple(entry["variants"]),
+                    encoder=self.encoder,
+                    derivatives=self.derivatives,
+                )
+                for entry in data["entries"]
+            ]
+            return Shard(name, leased_path, data["attempts"] + 1, tasks)
+        return None
+
+    def renew(self, shard):
+        """Renews the lease of a shard, returns False if it was taken back."""
+        try:
+            os.utime(shard.path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self, shard, results, worker_id):
+        """
+        Record the results of a shard and end its lease.
+
+        Args:
+        shard(Shard): Leased shard
+        results(list): BuildResult of each file of the shard
+        worker_id(str): Id of the worker
+
+        Return:
+        None
+        """
+        _write_json(
+            self.job_dir / DONE / f"{shard.name}.json",
+            {
+                "worker": worker_id,
+                "attempts": shard.attempts,
+                "results": [
+                    {
+                        "file": result.input_file,
+                        "outputs": result.outputs,
+                        "error": result.error,
+                        "duration": result.duration,
+                    }
+                    for result in results
+                ],
+            },
+        )
+        for path in (shard.path, self.job_dir / FAILED / f"{shard.name}.json"):
+            # the shard may have been given up while this worker built it
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def release(self, shard, error=None):
+        """Gives a shard back to pending after a failure, or up if out of tries."""
+        self._requeue(shard.path, shard.name, error)
+
+    def reclaim_expired(self):
+        """Takes back the shards whose lease was not renewed in time."""
+        now = self._filesystem_now()
+        for leased_path in (self.job_dir / LEASED).iterdir():
+            # leases, and the hidden files of shards being taken back
+            if not leased_path.name.lstrip(".").startswith("shard-"):
+                continue
+            try:
+                if now - leased_path.stat().st_mtime <= self.lease:
+                    continue
+            except FileNotFoundError:
+                continue
+            name = leased_path.name.lstrip(".").split(".", 1)[0]
+            # only the worker winning this rename takes the shard back
+            reclaim_path = leased_path.with_name(f".{name}.{uuid.uuid4().hex}")
+            try:
+                os.rename(leased_path, reclaim_path)
+                # a rename keeps the mtime, the hidden file expires in turn
+                # only if this worker dies before requeueing the shard
+                os.utime(reclaim_path)
+            except FileNotFoundError:
+                continue
+            self._requeue(reclaim_path, name, "lease expired")
+
+    def progress(self):
+        """Returns the aggregate progress of the job."""
+        counts = {}
+        workers = {}
+        done_names = set()
+        for state in SHARD_STATES:
+            names = [
+                path.name
+                for path in (self.job_dir / state).iterdir()
+                if not path.name.startswith(".")
+            ]
+            if state == DONE:
+                done_names = set(names)
+            if state == FAILED:
+                # a late worker may finish a shard after it was given up
+                names = [name for name in names if name not in done_names]
+            counts[state] = len(names)
+            if state == LEASED:
+                for name in names:
+                    worker_id = name.split(".", 1)[1]
+                    workers[worker_id] = workers.get(worker_id, 0) + 1
+        built = errors = 0
+        for path in (self.job_dir / DONE).glob("shard-*.json"):
+            results = self._done_results.get(path.name)
+            if results is None:
+                try:
+                    results = _read_json(path)["results"]
+                except (OSError, ValueError):
+                    continue
+                self._done_results[path.name] = results
+            for result in results:
+                if result["error"] is None:
+                    built += 1
+                else:
+                    errors += 1
+        return JobProgress(
+            shards=self.job["shards"],
+            pending=counts[PENDING],
+            leased=counts[LEASED],
+            done=counts[DONE],
+            failed=counts[FAILED],
+            files=self.job["files"],
+            built=built,
+            errors=errors,
+            workers=workers,
+        )
+
+    def _requeue(self, path, name, error):
+        """Moves a shard file back to pending, or to failed if out of tries."""
+        if (self.job_dir / DONE / f"{name}.json").exists():
+            # a late worker finished it after its lease was taken back
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return
+        try:
+            data = _read_json(path)
+        except FileNotFoundError:
+            return
+        data["attempts"] += 1
+        data["error"] = error
+        state = FAILED if data["attempts"] >= self.max_attempts else PENDING
+        _write_json(self.job_dir / state / f"{name}.json", data)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _filesystem_now(self):
+        """Returns the current time of the clock of the job filesystem."""
+        clock_path = self.job_dir / LEASED / f".clock-{uuid.uuid4().hex}"
+        clock_path.touch()
+        try:
+            return clock_path.stat().st_mtime
+        finally:
+            clock_path.unlink()
+
+
+class QueueWorker:
+    """
+    Claims the shards of a job one at a time and builds them.
+
+    Each shard is built by a BatchBuilder with its own process pool. The
+    lease of the shard is renewed in the background while it builds. Workers
+    on several hosts would overwrite each other's build cache, so none is
+    used: a finished shard is never built again, its outputs always are. The
+    worker returns once every shard of the job is done or failed, waiting
+    while other workers hold the last shards in case their leases expire.
+    """
+
+    def __init__(self, job_dir, workers=None, worker_id=None, on_shard=None):
+        self.queue = JobQueue(job_dir)
+        self.workers = workers
+        self.worker_id = worker_id or default_worker_id()
+        # called with (shard, results) after every shard
+        self.on_shard = on_shard
+        self._stop_event = Event()
+
+    def stop(self):
+        """Stops after the current shard."""
+        self._stop_event.set()
+
+    def run(self):
+        """
+        Build shards until the job is finished or the worker is stopped.
+
+        Args:
+        None
+
+        Return:
+        int: Number of shards built by this worker
+        """
+        built = 0
+        while not self._stop_event.is_set():
+            shard = self.queue.claim(self.worker_id)
+            if shard is None:
+                if self.queue.progress().finished:
+                    break
+                self._stop_event.wait(IDLE_INTERVAL)
+                continue
+            self._build(shard)
+            built += 1
+        return built
+
+    def _build(self, shard):
+        """Builds a shard, renewing its lease until it is finished."""
+        finished = Event()
+        renewer = Thread(
+            target=self._renew_lease,
+            args=(shard, finished),
+            name="lease-renewer",
+            daemon=True,
+        )
+        renewer.start()
+        try:
+            builder = BatchBuilder(shard.tasks, workers=self.workers)
+            builder.start()
+            summary = builder.wait()
+        except Exception as error:
+            finished.set()
+            self.queue.release(shard, f"{type(error).__name__}: {error}")
+            return
+        finished.set()
+        self.queue.complete(shard, summary.results, self.worker_id)
+        if self.on_shard:
+            self.on_shard(shard, summary.results)
+
+    def _renew_lease(self, shard, finished):
+        """Touches the leased shard file until the shard is finished."""
+        while not finished.wait(self.queue.lease / 4):
+            if not self.queue.renew(shard):
+                return
+
+
+class JobMonitor:
+    """
+    Polls the progress of a job in the background until it is finished.
+
+    on_progress is called from a background thread with a JobProgress after
+    every poll, callers running a UI must hand it over to their main loop.
+    """
+
+    def __init__(self, queue, on_progress, interval=1.0):
+        self.queue = queue
+        self.on_progress = on_progress
+        self.interval = interval
+        self._stop_event = Event()
+        self._thread = None
+
+    def start(self):
+        """Starts polling."""
+        self._thread = Thread(target=self._run, name="job-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops polling, the job itself goes on."""
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                progress = self.queue.progress()
+            except OSError:
+                # the shared filesystem may be briefly unavailable
+                progress = None
+            if progress is not None:
+                self.on_progress(progress)
+                if progress.finished:
+                    return
+            self._stop_event.wait(self.interval)
@@ -0,0 +1,68 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from PIL import Image
+
+from swing_tool_gui import build
+from swing_tool_gui.build import BuildTask, build_file
+
+
+class SizePreservingBuilder:
+    """Builder keeping the size of its input, like a frame drawn over it."""
+
+    def build(self, src, title, ig=False):
+        with Image.open(src) as img:
+            return img.convert("RGB")
+
+
+class FixedSizeBuilder:
+    """Builder making outputs of a fixed size, whatever the input."""
+
+    def build(self, src, title, ig=False):
+        with Image.open(src) as img:
+            return img.convert("RGB").resize((1080, 1350) if ig else (1080, 1080))
+
+
+class BuildFileTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = Path(temp_dir.name)
+        self.addCleanup(setattr, build, "_builder", build._builder)
+        self.addCleanup(setattr, build, "_output_side", build._output_side)
+
+    def use_builder(self, builder):
+        build._builder = builder
+        build._output_side = None
+
+    def build_source(self, size):
+        source = self.root / "photo.jpg"
+        Image.new("RGB", size, "orange").save(source)
+        task = BuildTask(
+            index=0,
+            input_file=str(source),
+            title="Photo",
+            output_dir=str(self.root),
+        )
+        result = build_file(task)
+        self.assertTrue(result.ok, result.error_detail)
+        return result
+
+    def test_size_preserving_builder_gets_full_resolution(self):
+        self.use_builder(SizePreservingBuilder())
+        result = self.build_source((1600, 1200))
+        self.assertEqual(build._output_side, 0)
+        self.assertEqual(len(result.outputs), 2)
+        for output in result.outputs:
+            with Image.open(output) as img:
+                self.assertEqual(img.size, (1600, 1200))
+
+    def test_fixed_size_builder_output_side(self):
+        self.use_builder(FixedSizeBuilder())
+        self.build_source((1600, 1200))
+        self.assertEqual(build._output_side, 1350)
+
+
+if __name__ == "__main__":
+    unittest.main()
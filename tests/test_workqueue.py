@@ -0,0 +1,134 @@
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from swing_tool_gui.build import BuildResult, BuildTask
+from swing_tool_gui.encoders import PROFILES
+from swing_tool_gui.workqueue import DONE, FAILED, LEASED, PENDING, JobQueue
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = Path(temp_dir.name)
+
+    def submit(self, files=4, shard_size=2, max_attempts=2):
+        tasks = [
+            BuildTask(
+                index=index,
+                input_file=str(self.root / f"{index}.jpg"),
+                title=f"photo {index}",
+                output_dir=str(self.root / "out"),
+            )
+            for index in range(files)
+        ]
+        return JobQueue.submit(
+            tasks,
+            self.root / "out",
+            PROFILES["jpeg"],
+            job_dir=self.root / "job",
+            shard_size=shard_size,
+            lease=60,
+            max_attempts=max_attempts,
+        )
+
+    def expire(self, queue):
+        """Makes every lease look older than the lease time."""
+        past = time.time() - queue.lease * 2
+        for path in (queue.job_dir / LEASED).iterdir():
+            os.utime(path, (past, past))
+
+    def names(self, queue, state):
+        return sorted(path.name for path in (queue.job_dir / state).iterdir())
+
+    def complete(self, queue, shard):
+        results = [
+            BuildResult(index=task.index, input_file=task.input_file)
+            for task in shard.tasks
+        ]
+        queue.complete(shard, results, "worker-a")
+
+    def test_claim(self):
+        queue = self.submit()
+        first = queue.claim("worker-a")
+        second = queue.claim("worker-b")
+        self.assertEqual((first.name, second.name), ("shard-00000", "shard-00001"))
+        self.assertEqual(first.attempts, 1)
+        self.assertEqual([task.index for task in second.tasks], [2, 3])
+        self.assertIsNone(queue.claim("worker-c"))
+        progress = queue.progress()
+        self.assertEqual((progress.pending, progress.leased), (0, 2))
+        self.assertEqual(progress.workers, {"worker-a": 1, "worker-b": 1})
+
+    def test_complete(self):
+        queue = self.submit()
+        self.complete(queue, queue.claim("worker-a"))
+        self.complete(queue, queue.claim("worker-a"))
+        progress = queue.progress()
+        self.assertEqual((progress.done, progress.built), (2, 4))
+        self.assertTrue(progress.finished)
+        self.assertEqual(self.names(queue, LEASED), [])
+
+    def test_expired_lease_is_retried(self):
+        queue = self.submit(files=2)
+        queue.claim("worker-a")
+        self.expire(queue)
+        retry = queue.claim("worker-b")
+        self.assertEqual((retry.name, retry.attempts), ("shard-00000", 2))
+        self.assertEqual(self.names(queue, LEASED), ["shard-00000.worker-b"])
+
+    def test_renewed_lease_is_kept(self):
+        queue = self.submit(files=2)
+        shard = queue.claim("worker-a")
+        self.expire(queue)
+        self.assertTrue(queue.renew(shard))
+        queue.reclaim_expired()
+        self.assertEqual(self.names(queue, LEASED), ["shard-00000.worker-a"])
+
+    def test_shard_is_given_up_after_max_attempts(self):
+        queue = self.submit(files=2, max_attempts=2)
+        queue.claim("worker-a")
+        self.expire(queue)
+        shard = queue.claim("worker-b")
+        self.expire(queue)
+        queue.reclaim_expired()
+        self.assertFalse(queue.renew(shard))
+        self.assertEqual(self.names(queue, FAILED), ["shard-00000.json"])
+        self.assertIsNone(queue.claim("worker-c"))
+        self.assertTrue(queue.progress().finished)
+
+    def test_release_requeues_the_shard(self):
+        queue = self.submit(files=2, max_attempts=3)
+        queue.release(queue.claim("worker-a"), "OSError: disk full")
+        self.assertEqual(self.names(queue, PENDING), ["shard-00000.json"])
+        self.assertEqual(queue.claim("worker-a").attempts, 2)
+
+    def test_interrupted_reclaim_is_recovered(self):
+        queue = self.submit(files=2)
+        queue.claim("worker-a")
+        # a worker died right after taking the lease back
+        leased_path = queue.job_dir / LEASED / "shard-00000.worker-a"
+        os.rename(leased_path, leased_path.with_name(".shard-00000.0123abcd"))
+        self.expire(queue)
+        shard = queue.claim("worker-b")
+        self.assertEqual((shard.name, shard.attempts), ("shard-00000", 2))
+
+    def test_late_complete_after_give_up(self):
+        queue = self.submit(files=4, max_attempts=1)
+        late = queue.claim("worker-a")
+        self.expire(queue)
+        queue.reclaim_expired()
+        self.assertEqual(self.names(queue, FAILED), ["shard-00000.json"])
+        self.complete(queue, late)
+        self.assertEqual(self.names(queue, FAILED), [])
+        self.assertEqual(self.names(queue, DONE), ["shard-00000.json"])
+        progress = queue.progress()
+        self.assertEqual((progress.done, progress.failed), (1, 0))
+        self.assertFalse(progress.finished)
+
+
+if __name__ == "__main__":
+    unittest.main()